@@ -9,6 +9,17 @@ from functools import partial
 from typing import List, Dict
 from service.application_service import ApplicationService, DocumentType
 from domain.llm_utils import LLMUtils, DocumentType, UtilsLogger
+from domain.allm_access import AbstractLLMAccess
+from domain.model_profiles import ModelProfiles
+from infrastructure.endpoint_pool import EndpointPool
+from infrastructure.tokenizer import TokenizerFactory
+from infrastructure.retry_policy import RetryPolicy
+from infrastructure.hedging_policy import HedgingPolicy
+from infrastructure.checkpoint_journal import CheckpointJournal
+from service.batch_service import BatchService
+from service.review_daemon import ReviewDaemon
+from service.review_daemon_server import ReviewDaemonServer
+from infrastructure.word2datastructure import WordToDatastructure
 
 
 program_name = os.path.basename(sys.argv[0])
@@ -56,11 +67,25 @@ post_request_ids: List = []
 only_slides = None
 document_type: DocumentType = DocumentType.ppt
 reviewer_properties_path: str = None
+cache_dir: str = os.path.join("~", ".cache", "document2llm")
+cache_max_size_mb: int = 1024
 
 parser = argparse.ArgumentParser(prog=program_name, formatter_class=argparse.RawDescriptionHelpFormatter,
                                  epilog=f'Apply LLM requests to content of files. Environment variable {DOC2LLM_REQUESTS_POST_REQUEST} embed requests with post requests that will happen on the generated LLM text. Variable {DOC2LLM_LOGGING_LEVEL} defines the logging level (DEBUG, INFO, WARN, ERROR).')
 parser.add_argument('--from_document', type=str, help='Specify the document to open')
 parser.add_argument('--to_document', type=str, help='Specify the review document to create')
+parser.add_argument('--from_glob', type=str, help='Batch mode: review every PowerPoint, Word, markdown and PDF document matching the glob pattern (** for sub directories) in one process, the document type is detected from the extension')
+parser.add_argument('--from_dir', type=str, help='Batch mode: review every PowerPoint, Word, markdown and PDF document of the directory and its sub directories in one process')
+parser.add_argument('--to_dir', type=str, help='Batch mode: directory receiving the reviews and the batch summary, default is next to each document with the summary in the current directory')
+parser.add_argument('--parallel_documents', type=int, default=4, help=f'Batch mode: number of documents parsed and reviewed at a time, their requests share the {AbstractLLMAccess.DOC2LLM_REQUESTS_NB_WORKERS} requests in flight, default is 4')
+parser.add_argument('--daemon', action="store_true", help='Start the review daemon: jobs posted to its local HTTP API (POST /jobs) are reviewed without start up cost, the other options are the defaults of every job')
+parser.add_argument('--daemon_port', type=int, default=8765, help='Port of the review daemon on 127.0.0.1, default is 8765')
+parser.add_argument('--daemon_socket', type=str, help='Unix socket the review daemon listens on instead of the TCP port')
+parser.add_argument('--daemon_jobs', type=int, default=2, help='Number of jobs the review daemon runs at a time, default is 2')
+parser.add_argument('--daemon_client_quota', type=int, default=1, help='Number of jobs of a same client the review daemon runs at a time, default is 1')
+parser.add_argument('--daemon_root', type=str, default=os.getcwd(), help='Directory the documents, reviews, context and reviewer properties of the daemon jobs must be in, default is the current directory')
+parser.add_argument('--daemon_token_file', type=str, default=os.path.join("~", ".document2llm", "daemon.token"), help='File receiving the bearer token generated when the daemon starts, default is ~/.document2llm/daemon.token')
+parser.add_argument('--daemon_job_ttl', type=float, default=ReviewDaemon.DEFAULT_JOB_TTL, help=f'Seconds the daemon keeps a finished job, default is {ReviewDaemon.DEFAULT_JOB_TTL}')
 parser.add_argument('--model_name', type=str, help=f'Specify the name of the LLM model to use. Default is {model_name}')
 parser.add_argument('--context_path', type=str, help='Path to an optional text file (whatever extension) where the context of the document is described.')
 parser.add_argument('--detailed_analysis', action="store_true", help='Select a detailed analysis or high level one')
@@ -71,6 +96,38 @@ parser.add_argument('--force_temperature', type=float, help=f'Higher temperature
 parser.add_argument('--simulate_calls_only', action="store_true", help=f'Do not perform the calls to LLM: used for debugging purpose.')
 parser.add_argument('--post_requests', type=csv_, help=f'Specify one or more post requests to format the output from the following list: [[ {llm_utils.get_all_post_llm_requests_and_ids_str()} ]], default is {post_request_ids}')
 parser.add_argument('--context_length', type=int, help=f'Specify the context length acceptable from the part of source file (without including the number of tokens of the request), default is {context_length}')
+parser.add_argument('--compact_serialization', action="store_true", help='Send slides in a terse line notation (short keys, rounded numbers, default values left out) with a shorter format description, and texts without JSON escaping: fewer prompt tokens')
+parser.add_argument('--tokenizer', type=str, default=TokenizerFactory.AUTO, help=f'Tokenizer used to count tokens: {TokenizerFactory.AUTO} (tiktoken when installed), {TokenizerFactory.HEURISTIC}, {TokenizerFactory.TIKTOKEN}[:<encoding name>] or the path of a HuggingFace tokenizer.json file, default is {TokenizerFactory.AUTO}')
+parser.add_argument('--model_context_window', type=int, help=f'Context window of the model in tokens: content whose prompt would exceed it is split at heading, paragraph or slide boundaries and the answers are stitched back, default is read from the model profile (environment variable {ModelProfiles.DOC2LLM_MODEL_PROFILES})')
+parser.add_argument('--max_attempts', type=int, default=RetryPolicy.DEFAULT_MAX_ATTEMPTS, help=f'Maximum number of attempts per LLM request on transient errors (network, timeouts, rate limits, server errors), default is {RetryPolicy.DEFAULT_MAX_ATTEMPTS}')
+parser.add_argument('--connect_timeout', type=float, default=RetryPolicy.DEFAULT_CONNECT_TIMEOUT, help=f'Timeout in seconds to connect to the LLM, default is {RetryPolicy.DEFAULT_CONNECT_TIMEOUT}')
+parser.add_argument('--read_timeout', type=float, default=RetryPolicy.DEFAULT_READ_TIMEOUT, help=f'Timeout in seconds waiting for data from the LLM, default is {RetryPolicy.DEFAULT_READ_TIMEOUT}')
+parser.add_argument('--hedge_percentile', type=float, help='Send a duplicate of a LLM request that did not answer within this percentile (for example 95) of the latencies observed for the same request, the first answer is taken: per default no duplicate is sent')
+parser.add_argument('--hedge_max_extra_load', type=float, default=HedgingPolicy.DEFAULT_MAX_EXTRA_LOAD, help=f'Maximum share of duplicates sent by --hedge_percentile compared to the number of requests, default is {HedgingPolicy.DEFAULT_MAX_EXTRA_LOAD}')
+parser.add_argument('--async_requests', action="store_true", help=f'Detailed analysis only: send requests through the asyncio client keeping {AbstractLLMAccess.DOC2LLM_REQUESTS_NB_WORKERS} requests in flight at all times.')
+parser.add_argument('--cache_dir', type=str, help=f'Directory of the persistent LLM response cache, default is {cache_dir}. The cache is enabled by default: reviewing again unchanged content returns the cached answers, use --no_cache to get new ones')
+parser.add_argument('--cache_max_size_mb', type=int, help=f'Size cap of the response cache in MB, least recently used responses are evicted first, default is {cache_max_size_mb}')
+parser.add_argument('--cache_readonly', action="store_true", help=f'Serve responses from the cache but never write new responses into it')
+parser.add_argument('--no_cache', action="store_true", help=f'Do not use the response cache (enabled by default): every request is sent to the LLM')
+parser.add_argument('--requests_per_minute', type=float, help=f'Maximum number of requests per minute sent to the LLM by all workers, default is read from the model profile (environment variable {ModelProfiles.DOC2LLM_MODEL_PROFILES})')
+parser.add_argument('--tokens_per_minute', type=float, help=f'Maximum number of tokens per minute sent to the LLM by all workers, default is read from the model profile (environment variable {ModelProfiles.DOC2LLM_MODEL_PROFILES})')
+parser.add_argument('--stream_responses', action="store_true", help=f'Stream the LLM answers: partial answers are appended to the temporary review file as they arrive and time to first token / tokens per second are logged')
+parser.add_argument('--prefix_cache_layout', action="store_true", help=f'Place reviewer, format description and document content before the request so providers with prompt caching reuse the document prefix (detailed analysis also sends a warm up call per chunk)')
+parser.add_argument('--endpoints_path', type=str, help='JSON file listing several OpenAI compatible endpoints ([{"base_url": ..., "api_key_env": "OPENAI_API_KEY", "weight": 1, "max_concurrency": 8}]) to load balance the requests on, instead of OPENAI_BASE_URL')
+parser.add_argument('--endpoint_routing', type=str, choices=EndpointPool.ROUTINGS, default=EndpointPool.LEAST_IN_FLIGHT, help=f'How requests are routed across endpoints, default is {EndpointPool.LEAST_IN_FLIGHT}')
+parser.add_argument('--batch_export', type=str, help='Do not call the LLM: write every request as a Batch API JSONL line (stable custom_id) into the specified file. Combined with --batch_import, only requests without result (typically post requests) are exported.')
+parser.add_argument('--batch_import', type=csv_, help='Do not call the LLM: take the responses from one or more Batch API result files (comma separated) and render the review')
+parser.add_argument('--pipeline_post_requests', action="store_true", help='Send the post requests of a chunk in the background while the next chunks are reviewed (up to DOC2LLM_REQUESTS_NB_WORKERS chunks at a time), the output order is unchanged')
+parser.add_argument('--schedule_whole_document', action="store_true", help='Review all chunks (slides, chapters, deck) concurrently with their post requests, keeping DOC2LLM_REQUESTS_NB_WORKERS requests in flight: the output order is unchanged')
+parser.add_argument('--resume', action="store_true", help='Continue an interrupted review of the same document with the same options: chunks recorded in the journal (<to_document>.journal.jsonl) are not sent again')
+parser.add_argument('--journal_fsync', type=str, choices=CheckpointJournal.FSYNC_POLICIES, default=CheckpointJournal.FSYNC_PERIODIC, help=f'When the journal of reviewed chunks is synced to disk, default is {CheckpointJournal.FSYNC_PERIODIC} (at most every second)')
+parser.add_argument('--incremental', action="store_true", help='Review a new revision of the document: only slides and chapters changed since the previous review (<to_document>.manifest.json) are sent, the others reuse their answers')
+parser.add_argument('--plan', action="store_true", help='Do not call the LLM: print the LLM calls, the expected prompt and completion tokens and estimated cost per request and the projected wall time of the review, stored in <to_document>.plan.md')
+parser.add_argument('--max_prompt_tokens', type=int, help='Budget of prompt tokens sent by the run: post requests are dropped, then the review stops cleanly (use --resume to continue) once it would be exceeded')
+parser.add_argument('--max_cost', type=float, help='Budget of estimated cost of the run, from the prices of the model profiles: post requests are dropped, then the review stops cleanly once it would be exceeded')
+parser.add_argument('--record_cassette', type=str, help='Record every response with its token usage and latency into the specified cassette file (gzip compressed when ending with .gz) for later replay')
+parser.add_argument('--replay_cassette', type=str, help='Do not call the LLM: serve the responses recorded in the specified cassette file, waiting for their recorded latency')
+parser.add_argument('--replay_latency_scale', type=float, default=1.0, help='Factor applied to the recorded latencies by --replay_cassette (0 answers immediately), default is 1.0')
 parser.add_argument('--enable_ocr',  action="store_true", help=f'When specified will OCR any image found: This can require a lot of memory and is deactivated by default')
 
 subparsers = parser.add_subparsers(dest='command')
@@ -85,6 +142,10 @@ ppt_parser.add_argument('--no_artistic_slide_requests',action="store_true", help
 ppt_parser.add_argument('--deck_requests', type=csv_, help=f'Specify deck requests to process: 1,3-5,7 from the following list: [[ {llm_utils.get_all_deck_requests_and_ids_str()} ]], default is {selected_deck_requests}')
 ppt_parser.add_argument('--no_deck_requests',action="store_true", help=f'Skip deck check')
 
+# Without sub command (batch mode or default PowerPoint review), slide options keep their defaults
+parser.set_defaults(skip_slides=None, only_slides=None, text_slide_requests=None, no_text_slide_requests=False, \
+                    artistic_slide_requests=None, no_artistic_slide_requests=False, deck_requests=None, no_deck_requests=False)
+
 doc_parser = subparsers.add_parser(DocumentType.doc.name, epilog=f'Word analysis: The environment variable {DOC2LLM_REQUESTS_DOC} can point to a JSON file for additional requests.')
 doc_parser.add_argument('--skip_paragraphs', type=csv_, help='Specify paragraphs to skip: 1,2.1,3: Cannot be used with only_paragraphs')
 doc_parser.add_argument('--only_paragraphs', type=csv_, help='Specify paragraphs to keep: 2,3.4,5: Cannot be used with skip_paragraphs')
@@ -127,6 +188,12 @@ if args.reviewer_properties_path:
     reviewer_properties_path = args.reviewer_properties_path
 if args.post_requests:
     post_request_ids = llm_utils.get_list_parameters(args.post_requests)
+if args.cache_dir:
+    cache_dir = args.cache_dir
+if args.cache_max_size_mb:
+    cache_max_size_mb = args.cache_max_size_mb
+if args.no_cache:
+    cache_dir = None
 
 elements_to_skip: List = []
 elements_to_keep: List = []
@@ -173,8 +240,39 @@ elif args.command == DocumentType.ppt.name or document_type == DocumentType.ppt:
         elements_to_keep = llm_utils.get_list_parameters(args.only_slides)
 
 llm_utils.set_document_type(document_type)
-ApplicationService(from_document, to_document, elements_to_skip, elements_to_keep, args.detailed_analysis, \
-                   reviewer_properties_path, args.simulate_calls_only, llm_utils, context_length, args.enable_ocr,\
-                   selected_text_slide_requests, selected_artistic_slide_requests, \
-                   selected_deck_requests, selected_paragraphs_requests, split_request_per_paragraph_deepness,
-                   model_name, context_path, post_request_ids, document_type)
\ No newline at end of file
+llm_utils.set_tokenizer(TokenizerFactory.create(args.tokenizer, model_name, logger))
+application_parameters: Dict = dict(detailed_analysis=args.detailed_analysis, reviewer_properties_path=reviewer_properties_path,
+                   simulate_calls_only=args.simulate_calls_only, context_length=context_length, enable_ocr=args.enable_ocr,
+                   selected_text_slide_requests=selected_text_slide_requests, selected_artistic_slide_requests=selected_artistic_slide_requests,
+                   selected_deck_requests=selected_deck_requests, selected_paragraphs_requests=selected_paragraphs_requests,
+                   split_request_per_paragraph_deepness=split_request_per_paragraph_deepness, model_name=model_name, context_path=context_path,
+                   post_request_ids=post_request_ids,
+                   async_requests=args.async_requests, cache_dir=cache_dir, cache_readonly=args.cache_readonly, cache_max_size_mb=cache_max_size_mb,
+                   requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+                   stream_responses=args.stream_responses, prefix_cache_layout=args.prefix_cache_layout,
+                   endpoints_path=args.endpoints_path, endpoint_routing=args.endpoint_routing,
+                   batch_export_path=args.batch_export, batch_import_paths=args.batch_import, model_context_window=args.model_context_window,
+                   max_attempts=args.max_attempts, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout,
+                   hedge_percentile=args.hedge_percentile, hedge_max_extra_load=args.hedge_max_extra_load,
+                   record_cassette_path=args.record_cassette, replay_cassette_path=args.replay_cassette, replay_latency_scale=args.replay_latency_scale,
+                   pipeline_post_requests=args.pipeline_post_requests, schedule_whole_document=args.schedule_whole_document,
+                   resume=args.resume, journal_fsync=args.journal_fsync,
+                   incremental=args.incremental, plan=args.plan, max_prompt_tokens=args.max_prompt_tokens, max_cost=args.max_cost,
+                   compact_serialization=args.compact_serialization)
+if args.daemon:
+    if args.enable_ocr:
+        WordToDatastructure.get_ocr_reader()
+    review_daemon: ReviewDaemon = ReviewDaemon(logger, llm_utils, application_parameters, args.daemon_jobs, args.daemon_client_quota, AbstractLLMAccess.get_number_workers(), \
+                                               args.daemon_root, args.daemon_job_ttl)
+    ReviewDaemonServer(review_daemon, logger, args.daemon_token_file, port=args.daemon_port, socket_path=args.daemon_socket).serve_forever()
+elif args.from_glob or args.from_dir:
+    document_paths: List = BatchService.list_documents(logger, args.from_glob, args.from_dir)
+    if len(document_paths) == 0:
+        print(f"ERROR: No PowerPoint, Word, markdown or PDF document found in {args.from_glob or args.from_dir}!")
+        sys.exit(1)
+    BatchService(logger, document_paths, args.to_dir, args.parallel_documents, AbstractLLMAccess.get_number_workers(), llm_utils, args.detailed_analysis,
+                 document_type if args.command else None, elements_to_skip, elements_to_keep, application_parameters).run()
+else:
+    application_service: ApplicationService = ApplicationService(from_document, to_document, elements_to_skip, elements_to_keep, llm_utils=llm_utils, document_type=document_type, **application_parameters)
+    if application_service.review_plan is not None:
+        print(application_service.review_plan.to_markdown())
@@ -2,14 +2,21 @@
 @author Jean-Philippe Ulpiano
 """
 from abc import ABC, abstractmethod
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Callable
+from concurrent.futures import Future
+from collections import deque
 from domain.ichecker import IChecker, PostProcessChecker
 from logging import Logger
 from domain.icontent_out import IContentOut
-from domain.allm_access import AbstractLLMAccess
+from domain.allm_access import AbstractLLMAccess, ContextWindowExceededError, BudgetExceededError
 from domain.llm_utils import LLMUtils
+from domain.task_graph import TaskGraph
+from domain.ijournal import IJournal
+from domain.imanifest import IManifest
 from pprint import pformat
 import traceback
+import hashlib
+import json
 import re
 
 class ADocumentToDatastructure(ABC):
@@ -17,13 +24,71 @@ class ADocumentToDatastructure(ABC):
     logger: Logger = None
     llm_access: AbstractLLMAccess = None
     flush_on_exception: bool = True
+    task_graph: TaskGraph = None
+    schedule_whole_document: bool = False
+    journal: IJournal = None
+    manifest: IManifest = None
+    SECTION_FRESH: str = "fresh"
+    SECTION_REUSED: str = "reused"
+    SECTION_RESUMED: str = "resumed"
+    SECTION_DESCRIPTIONS: Dict[str, str] = {SECTION_FRESH: "*New or changed since the previous review.*",
+                                            SECTION_REUSED: "*Unchanged since the previous review, answers reused.*",
+                                            SECTION_RESUMED: "*Reviewed before the previous run was interrupted, answers resumed.*"}
     DISAMBIGUITE_TITLE: int = 1
+    # Boundaries tried in order to split a text too big for the context window
+    TEXT_SPLIT_BOUNDARIES: List = [r'(?m)^(?=#)', r'(?<=\n\n)', r'(?<=\n)']
     def __init__(self, logger: Logger, content_out: IContentOut, 
                  llm_access: AbstractLLMAccess, llm_utils: LLMUtils):
         self.content_out = content_out
         self.logger = logger
         self.llm_access = llm_access
         self.llm_utils = llm_utils
+        # Output actions in document order, each waiting for the (optional) future it documents
+        self.pending_outputs: deque = deque()
+        # (title, status) of every reviewed chunk: fresh, reused from the previous revision or resumed from the journal
+        self.sections: List[Tuple[str, str]] = []
+        self.disambiguite_title: int = ADocumentToDatastructure.DISAMBIGUITE_TITLE
+
+    def set_scheduling(self, pipeline_post_requests: bool, schedule_whole_document: bool) -> None:
+        # Pipelining: post requests of a chunk are sent in the background while the primary requests of the next chunks go on.
+        # Whole document: every chunk is a task as well, all chunks are reviewed concurrently up to the number of workers.
+        self.schedule_whole_document = schedule_whole_document
+        self.task_graph = TaskGraph(self.llm_access.get_number_workers()) if pipeline_post_requests or schedule_whole_document else None
+
+    def set_journal(self, journal: IJournal) -> None:
+        self.journal = journal
+
+    def set_manifest(self, manifest: IManifest) -> None:
+        # Incremental review: chunks whose content did not change since the previous revision reuse its answers
+        self.manifest = manifest
+
+    def get_sections(self) -> List[Tuple[str, str]]:
+        return self.sections
+
+    def __output(self, write: Callable[[any], None], future: Future = None) -> None:
+        self.pending_outputs.append((future, write))
+        self.__flush_outputs(False)
+
+    def __flush_outputs(self, wait: bool) -> None:
+        # Only the completed head of the queue is written: the document keeps its order whatever finishes first
+        while len(self.pending_outputs) > 0:
+            future, write = self.pending_outputs[0]
+            if future is not None and not wait and not future.done():
+                return
+            # A failed chunk stays at the head: nothing after it is written
+            result: any = future.result() if future is not None else None
+            self.pending_outputs.popleft()
+            write(result)
+
+    def __flush_completed_outputs(self) -> None:
+        # On error, the outputs before the first failed chunk are still written, as a serial review would have done
+        while len(self.pending_outputs) > 0:
+            future, write = self.pending_outputs[0]
+            if future is not None and future.exception() is not None:
+                break
+            self.pending_outputs.popleft()
+            write(future.result() if future is not None else None)
+        self.pending_outputs.clear()
 
     @abstractmethod
     def _document_to_data_structure(self) -> List:
@@ -50,59 +115,207 @@ class ADocumentToDatastructure(ABC):
         """
         """
 
+    def _get_position_independent_content(self, content_to_check: any) -> any:
+        # Content identifying a chunk in the manifest: the same chunk moved elsewhere in the document must be found again
+        return content_to_check
+
     def __print_initial_request(self, response: Dict, print_title: bool, slide_info: str) -> List:
 
         if print_title: 
             request_cleaned: str =  response['request_name'] #re.sub(r'[\(\),\.]*', '', response['request_name'])
-            self.content_out.add_title(2, f"{request_cleaned} (temperature: {response['temperature']}, top_p: {response['top_p']}) ({ADocumentToDatastructure.DISAMBIGUITE_TITLE})")
-            ADocumentToDatastructure.DISAMBIGUITE_TITLE += 1
+            self.content_out.add_title(2, f"{request_cleaned} (temperature: {response['temperature']}, top_p: {response['top_p']}) ({self.disambiguite_title})")
+            self.disambiguite_title += 1
         else:
             self.content_out.document(f"**{response['request_name']}** (temperature: {response['temperature']}, top_p: {response['top_p']})")
         self.content_out.document_response(slide_info, response['response'])        
 
-    def __send_llm_requests_and_expand_output(self, content_to_check: List, print_title: bool, slide_info: str) -> None:
-            
-            result: List = self.llm_access.check(content_to_check, True)
-            for response in result:
-                self.__print_initial_request(response, print_title, slide_info)
-                additional_requests: List = []
-                if 'post_request_name' in response and response['post_request_name'] is not None:
-                    for post_request_name in response['post_request_name'].split(','):
-                        additional_requests.extend(self.llm_utils.get_post_additional_requests_from_name(post_request_name))
-                    self.logger.info(f"From request {response['request_name']}, preparing post request: response['{post_request_name}']: \n{additional_requests} for response: {response}")
-                post_process_checker: IChecker = PostProcessChecker(self.llm_utils, None, f' (Post Process)', f' (Post Process)', additional_requests)
-                     
-                if len(post_process_checker.get_all_requests()) > 0:
-                    self.llm_access.set_checker(post_process_checker)
-                    post_process_result: List = self.llm_access.check(response['response'], False)
-                    for post_process_response in post_process_result:
-                        self.__print_initial_request(post_process_response, print_title, 'Post process: ' + slide_info)
-                   
+    def __split_in_halves(self, blocks: List, size_function: any) -> List:
+        sizes: List = [ size_function(block) for block in blocks ]
+        half_size: float = sum(sizes) / 2.0
+        accumulated_size: float = 0
+        for index, size in enumerate(sizes[:-1]):
+            accumulated_size += size
+            if accumulated_size >= half_size:
+                return [blocks[:index + 1], blocks[index + 1:]]
+        return [blocks[:-1], blocks[-1:]]
+
+    def _split_content(self, content: any) -> List:
+        # Texts are split at headings first, then paragraphs, then lines; slides and decks (lists) between their elements
+        if isinstance(content, list):
+            if len(content) < 2:
+                return []
+            return self.__split_in_halves(content, lambda element: self.llm_utils.get_number_tokens(str(element)))
+        if isinstance(content, str):
+            for boundary in self.TEXT_SPLIT_BOUNDARIES:
+                blocks: List = [ block for block in re.split(boundary, content) if len(block) > 0 ]
+                if len(blocks) > 1:
+                    return [ "".join(half) for half in self.__split_in_halves(blocks, self.llm_utils.get_number_tokens) ]
+        return []
+
+    def __stitch_responses(self, part_results: List) -> List:
+        stitched_result: List = []
+        for part_responses in zip(*part_results):
+            response: Dict = dict(part_responses[0])
+            response['response'] = "\n\n".join([ f"**Part {index + 1} / {len(part_responses)}**\n\n{part_response['response']}" \
+                                                   for index, part_response in enumerate(part_responses) ])
+            if any(part_response.get('placeholder', False) for part_response in part_responses):
+                response['placeholder'] = True
+            stitched_result.append(response)
+        return stitched_result
+
+    def __get_oversized_placeholders(self, content_to_check: any, requires_format_description: bool) -> List:
+        # Sending it again would fail the same way: the chunk is left out and the review goes on with the next one
+        prompt_tokens: int = int(self.llm_access.get_prompt_tokens(content_to_check, requires_format_description))
+        self.logger.error(f"Content of {prompt_tokens} tokens exceeds the context window and cannot be split any further, it is not reviewed.")
+        return [{'request_name': f"{request['request_name']}{self.llm_access.checker.get_separator_information()}",
+                 'response': f"*Not reviewed: this content of {prompt_tokens} prompt tokens exceeds the context window and cannot be split any further.*",
+                 'temperature': None, 'top_p': None, 'post_request_name': None, 'placeholder': True} for request in self.llm_access.checker.get_all_requests()]
+
+    def __check_splitting_on_overflow(self, content_to_check: any, requires_format_description: bool) -> List:
+        if not self.llm_access.exceeds_context_window(content_to_check, requires_format_description):
+            try:
+                return self.llm_access.check(content_to_check, requires_format_description)
+            except ContextWindowExceededError as err:
+                self.logger.warning(f"Content rejected by the LLM ({err}), splitting it.")
+        parts: List = self._split_content(content_to_check)
+        if len(parts) < 2:
+            return self.__get_oversized_placeholders(content_to_check, requires_format_description)
+        self.logger.warning(f"Content of {int(self.llm_access.get_prompt_tokens(content_to_check, requires_format_description))} tokens exceeds the context window, " + \
+                            f"sending it in {len(parts)} parts.")
+        return self.__stitch_responses([ self.__check_splitting_on_overflow(part, requires_format_description) for part in parts ])
+
+    def __check_post_requests(self, post_process_checker: IChecker, response_text: str) -> List:
+        self.llm_access.set_checker(post_process_checker)
+        try:
+            return self.__check_splitting_on_overflow(response_text, False)
+        except BudgetExceededError as err:
+            # Post requests only reformat an answer: they are dropped first, the review goes on while its requests fit
+            self.logger.warning(f"Post requests dropped: {err}")
+            return [{'request_name': f"Post requests{post_process_checker.get_separator_information()}", 'response': "*Dropped: the budget of the run is exhausted.*",
+                     'temperature': None, 'top_p': None, 'post_request_name': None, 'placeholder': True}]
+
+    def __get_post_process_checker(self, response: Dict) -> IChecker:
+        if response.get('placeholder', False):
+            # No answer yet (request pending in a batch): post requests would process the placeholder
+            return None
+        additional_requests: List = []
+        if 'post_request_name' in response and response['post_request_name'] is not None:
+            for post_request_name in response['post_request_name'].split(','):
+                additional_requests.extend(self.llm_utils.get_post_additional_requests_from_name(post_request_name))
+            self.logger.info(f"From request {response['request_name']}, preparing post request: response['{post_request_name}']: \n{additional_requests} for response: {response}")
+        post_process_checker: IChecker = PostProcessChecker(self.llm_utils, None, f' (Post Process)', f' (Post Process)', additional_requests)
+        return post_process_checker if len(post_process_checker.get_all_requests()) > 0 else None
+
+    def __send_llm_requests(self, instance_checker: IChecker, content_to_check: List) -> Future:
+        # Completes with the list of (response, post process result) of the chunk
+        self.llm_access.set_checker(instance_checker)
+        result: List = self.__check_splitting_on_overflow(content_to_check, True)
+        post_process_futures: List[Future] = []
+        for response in result:
+            post_process_checker: IChecker = self.__get_post_process_checker(response)
+            if post_process_checker is None:
+                post_process_futures.append(TaskGraph.completed(None))
+            elif self.task_graph is not None:
+                post_process_futures.append(self.task_graph.add_task(self.__check_post_requests, post_process_checker, response['response']))
+            else:
+                post_process_futures.append(TaskGraph.completed(self.__check_post_requests(post_process_checker, response['response'])))
+        return TaskGraph.gather([ TaskGraph.completed(result) ] + post_process_futures)
+
+    def __expand_output(self, results: List, print_title: bool, slide_info: str, section_status: str) -> None:
+        responses, post_process_results = results[0], results[1:]
+        if self.manifest is not None:
+            self.content_out.document(self.SECTION_DESCRIPTIONS[section_status])
+        for response, post_process_result in zip(responses, post_process_results):
+            self.__print_initial_request(response, print_title, slide_info)
+            for post_process_response in post_process_result or []:
+                self.__print_initial_request(post_process_response, print_title, 'Post process: ' + slide_info)
+
+    def __get_content_hash(self, instance_checker: IChecker, content_to_check: any) -> str:
+        # Titles number the chunks: only their content and requests identify them
+        chunk_description: str = json.dumps([type(instance_checker).__name__, self._get_position_independent_content(content_to_check), instance_checker.get_all_requests()], \
+                                            sort_keys=True, default=str)
+        return hashlib.sha256(chunk_description.encode('utf-8')).hexdigest()[:16]
+
+    def __record_results(self, chunk_id: str, content_hash: str, chunk_future: Future) -> None:
+        if chunk_future.exception() is not None:
+            return
+        results: List = chunk_future.result()
+        responses: List = results[0] + [ response for post_process_result in results[1:] for response in post_process_result or [] ]
+        # Placeholders (requests pending in a batch, simulated calls) are not reviews
+        if any(response.get('placeholder', False) for response in responses):
+            return
+        if self.journal is not None:
+            self.journal.record(chunk_id, results)
+        if self.manifest is not None:
+            self.manifest.record(content_hash, results)
+
+    def __send_llm_requests_and_expand_output(self, title_str: str, chunk_id: str, content_hash: str, instance_checker: IChecker, content_to_check: List, \
+                                              print_title: bool, slide_info: str) -> None:
+        # The journal is keyed by position and content, the manifest by content only: unchanged chunks are found wherever they moved
+        previous_results: List = self.journal.get(chunk_id) if self.journal is not None else None
+        section_status: str = self.SECTION_RESUMED
+        if previous_results is None and self.manifest is not None:
+            previous_results = self.manifest.get(content_hash)
+            section_status = self.SECTION_REUSED
+        if previous_results is not None:
+            self.logger.info(f"Chunk {chunk_id} already reviewed ({section_status}), taking its previous results.")
+            chunk_future: Future = TaskGraph.completed(previous_results)
+            if self.manifest is not None:
+                self.manifest.record(content_hash, previous_results)
+        else:
+            section_status = self.SECTION_FRESH
+            if self.schedule_whole_document:
+                chunk_future: Future = self.task_graph.add_task(self.__send_llm_requests, instance_checker, content_to_check)
+            else:
+                chunk_future: Future = self.__send_llm_requests(instance_checker, content_to_check)
+            chunk_future.add_done_callback(lambda future: self.__record_results(chunk_id, content_hash, future))
+        self.sections.append((title_str, section_status))
+        self.__output(lambda results: self.__expand_output(results, print_title, slide_info, section_status), chunk_future)
+
     def __core_process(self) -> None:
         data_structure: List = self._document_to_data_structure()
-        for index, data in enumerate(data_structure):
-            self.logger.debug(f"Executing request : {index + 1} / {len(data_structure)}")
+        try:
+            for index, data in enumerate(data_structure):
+                self.logger.debug(f"Executing request : {index + 1} / {len(data_structure)}")
             
-            title_rank, title_str = self._get_title_rank_title_str_as_tuple(data)
-            self.logger.info(f"{' ' * (title_rank * 2)}{'=' * 20} Processing {title_str} >>> {'=' * 20}  >> (Request {index + 1} / {len(data_structure)})")
-            self.content_out.add_title(title_rank, title_str)
-
-            instance_checker: IChecker = self._get_checker_instance(data)
-            if instance_checker is not None:
-                self.llm_access.set_checker(instance_checker)
-                self.__send_llm_requests_and_expand_output(*self._get_llm_parameters_requests_as_tuple(data))
+                title_rank, title_str = self._get_title_rank_title_str_as_tuple(data)
+                self.logger.info(f"{' ' * (title_rank * 2)}{'=' * 20} Processing {title_str} >>> {'=' * 20}  >> (Request {index + 1} / {len(data_structure)})")
+                self.__output(lambda _, title_rank=title_rank, title_str=title_str: self.content_out.add_title(title_rank, title_str))
+
+                instance_checker: IChecker = self._get_checker_instance(data)
+                if instance_checker is not None:
+                    llm_parameters: Tuple = self._get_llm_parameters_requests_as_tuple(data)
+                    content_hash: str = self.__get_content_hash(instance_checker, llm_parameters[0])
+                    self.__send_llm_requests_and_expand_output(title_str, f"{index}-{content_hash}", content_hash, instance_checker, *llm_parameters)
             
-            done_text: str = self._get_done_text(data)
-            if done_text is not None:
-                self.logger.info(f"{' ' * (title_rank * 2)}{'=' * 20} <<< Finished processing {done_text} done and documented {'=' * 20}")  
+                done_text: str = self._get_done_text(data)
+                if done_text is not None:
+                    self.__output(lambda _, title_rank=title_rank, done_text=done_text: \
+                                  self.logger.info(f"{' ' * (title_rank * 2)}{'=' * 20} <<< Finished processing {done_text} done and documented {'=' * 20}"))
+            self.__flush_outputs(True)
+        finally:
+            self.__flush_completed_outputs()
 
-    def process(self) -> None:
+    def process(self) -> bool:
+        completed: bool = False
         if self.flush_on_exception:
             try:
                 self.__core_process()
+                completed = True
+            except BudgetExceededError as err:
+                self.logger.warning(f"Stopping the review, the remaining content is not reviewed: {err}")
+                self.content_out.document("*Review stopped: the budget of the run is exhausted, the remaining content is not reviewed.*")
             except Exception as err:                    
                 self.logger.warning(f"Caught exception {err=}\n {type(err)=}\n {traceback.print_exc()}\n Leaving application.")
         else:
             self.__core_process()
+            completed = True
+        if self.journal is not None:
+            self.journal.close(completed)
+        if self.manifest is not None:
+            self.manifest.close(completed)
+        if self.task_graph is not None:
+            self.task_graph.shutdown()
 
         self.content_out.flush_and_close()
+        return completed
@@ -2,32 +2,101 @@
 @author Jean-Philippe Ulpiano
 """
 from abc import abstractmethod, ABC
-from typing import List
-import json
+from typing import List, Dict
+import os
+import threading
 from logging import Logger
 from domain.ichecker import IChecker
 from domain.llm_utils import LLMUtils
+from domain.model_profiles import ModelProfiles
 
 class ContextWindowExceededError(Exception):
     pass
 
+class BudgetExceededError(Exception):
+    pass
+
 class AbstractLLMAccess(ABC):
+    DOC2LLM_REQUESTS_NB_WORKERS: str = "DOC2LLM_REQUESTS_NB_WORKERS"
+    context_window: int = None
+    reserved_output_tokens: int = 0
+    model_profiles: ModelProfiles = None
+
     def __init__(self, logger: Logger, reviewer: str, model_name: str, llm_utils: LLMUtils): 
         self.reviewer = reviewer
         self.logger = logger
-        self.checker = None
+        # The checker is per thread: post requests of a chunk can be checked in the background while the next chunk is
+        self.thread_state: threading.local = threading.local()
         self.model_name = model_name # "llama3-70b"  # or use gpt-4o-mini, gpt-4o as per access requested
         self.llm_utils = llm_utils
 
+    @property
+    def checker(self) -> IChecker:
+        return getattr(self.thread_state, 'checker', None)
+
     def set_checker(self, checker: IChecker):
-        self.checker = checker
+        self.thread_state.checker = checker
+
+    def set_context_window(self, context_window: int, reserved_output_tokens: int) -> None:
+        self.context_window = context_window
+        self.reserved_output_tokens = reserved_output_tokens
+
+    def set_model_profiles(self, model_profiles: ModelProfiles) -> None:
+        self.model_profiles = model_profiles
+
+    def get_context_window(self, model_name: str) -> int:
+        if model_name is None or model_name == self.model_name or self.model_profiles is None:
+            return self.context_window
+        return self.model_profiles.get_value(model_name, ModelProfiles.CONTEXT_WINDOW, self.context_window)
+
+    def _get_effective_context_window(self) -> int:
+        # A request fits when its model or its fallback model takes it: the most constrained request decides
+        requests: List = self.checker.get_all_requests() if self.checker is not None else []
+        context_windows: List = []
+        for request in requests:
+            models: List = [ request.get('model') ] + ([ request['fallback_model'] ] if request.get('fallback_model') is not None else [])
+            model_context_windows: List = [ context_window for context_window in map(self.get_context_window, models) if context_window is not None ]
+            if len(model_context_windows) > 0:
+                context_windows.append(max(model_context_windows))
+        return min(context_windows) if len(context_windows) > 0 else self.context_window
+
+    def _get_request_text(self, request: Dict) -> str:
+        return " ".join(request['request']) if type(request['request']) is list else request['request']
+
+    def _get_requests_tokens(self, requests: List) -> int:
+        # All requests are sent together in one prompt
+        return sum(self.llm_utils.get_number_tokens(self._get_request_text(request)) for request in requests)
+
+    def get_prompt_tokens(self, content: any, requires_format_description: bool) -> int:
+        system_prompt, instructions = self.llm_utils.get_preamble(self.reviewer, requires_format_description)
+        prompt_tokens: int = self.llm_utils.get_number_tokens(system_prompt) + self.llm_utils.get_number_tokens(instructions) + \
+                             self.llm_utils.get_number_tokens(self.llm_utils.serialize_content(content))
+        if self.checker is not None:
+            prompt_tokens += self._get_requests_tokens(self.checker.get_all_requests())
+        return prompt_tokens
+
+    def exceeds_context_window(self, content: any, requires_format_description: bool) -> bool:
+        context_window: int = self._get_effective_context_window()
+        if context_window is None:
+            return False
+        return self.get_prompt_tokens(content, requires_format_description) > context_window - self.reserved_output_tokens
+
+    @staticmethod
+    def get_number_workers() -> int:
+        nb_workers: str = os.getenv(AbstractLLMAccess.DOC2LLM_REQUESTS_NB_WORKERS, default="1")
+        return max(int(nb_workers if nb_workers.isdigit() else "1"), 1)
+
+    def close(self) -> None:
+        """
+        Releases the threads of the access once the document is reviewed.
+        """
 
     @abstractmethod
     def _prepare_and_send_requests(self, request_inputs: List) -> List:
         """
         """
     @abstractmethod
-    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> str: 
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> str: 
         """
         """
 
@@ -36,7 +105,7 @@ class AbstractLLMAccess(ABC):
             raise Exception("Internal error: Checker was not properly defined!") 
         slide_review_llm_requests: List = self.checker.get_all_requests() 
         error_information: str = self.checker.get_error_information() 
-        slide_contents_str: str = str(json.dumps(slide_content))
+        slide_contents_str: str = self.llm_utils.serialize_content(slide_content)
 
         self.logger.debug(f'check: slide_review_llm_requests: {slide_review_llm_requests}')
         request_inputs: List = [{
@@ -46,6 +115,10 @@ class AbstractLLMAccess(ABC):
             'temperature': request['temperature'] if 'temperature' in request else 0.1,
             'top_p': request['top_p'] if 'top_p' in request else 0.1,
             'post_request_name': request['post_request_name'] if 'post_request_name' in request else None,
+            # Optional routing: model of the request, its answer size and a bigger context model used on overflow
+            'model': request.get('model'),
+            'max_tokens': request.get('max_tokens'),
+            'fallback_model': request.get('fallback_model'),
             # Following two are necessary for multi threading
             'error_information': error_information,
             'slide_contents_str': slide_contents_str,
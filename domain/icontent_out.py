@@ -23,3 +23,15 @@ class IContentOut:
     def document_response(self, slide_info: str, content: str) -> None:
         """
         """
+
+    @abstractmethod
+    def document_stream(self, stream_name: str, text: str) -> None:
+        """
+        Appends a partial response as it is received, text is None once the stream is complete.
+        """
+
+    @abstractmethod
+    def discard_stream(self, stream_name: str, reason: str) -> None:
+        """
+        Marks the partial response of a failed stream as discarded, the request being sent again or given up.
+        """
@@ -0,0 +1,24 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from abc import ABC, abstractmethod
+from typing import List
+
+class IJournal(ABC):
+    @abstractmethod
+    def get(self, chunk_id: str) -> List:
+        """
+        Results of a chunk completed by a previous run, None if the chunk still needs to be reviewed.
+        """
+
+    @abstractmethod
+    def record(self, chunk_id: str, results: List) -> None:
+        """
+        Persist the results of a completed chunk so a resumed run can reuse them.
+        """
+
+    @abstractmethod
+    def close(self, completed: bool) -> None:
+        """
+        Once the review is completed, the journal is not needed anymore.
+        """
@@ -0,0 +1,24 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from abc import ABC, abstractmethod
+from typing import List
+
+class IManifest(ABC):
+    @abstractmethod
+    def get(self, content_hash: str) -> List:
+        """
+        Results of an unchanged chunk in the previous review of the document, None if its content is new or changed.
+        """
+
+    @abstractmethod
+    def record(self, content_hash: str, results: List) -> None:
+        """
+        Keep the results of a chunk of the current revision, fresh or reused.
+        """
+
+    @abstractmethod
+    def close(self, completed: bool) -> None:
+        """
+        Write the manifest: the items of the current revision once the review is completed.
+        """
@@ -0,0 +1,26 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from abc import ABC, abstractmethod
+import re
+
+class ITokenizer(ABC):
+    @abstractmethod
+    def count_tokens(self, text: str) -> int:
+        """
+        """
+
+    @abstractmethod
+    def get_name(self) -> str:
+        """
+        """
+
+class HeuristicTokenizer(ITokenizer):
+    # Very approximate approach where we consider 2 to 3 characters per token
+    CHARACTERS_PER_TOKEN: float = 2.8
+
+    def count_tokens(self, text: str) -> int:
+        return len(re.sub(r'\s+', '', text)) / self.CHARACTERS_PER_TOKEN
+
+    def get_name(self) -> str:
+        return f"heuristic ({self.CHARACTERS_PER_TOKEN} characters per token)"
@@ -2,14 +2,19 @@
 @author Jean-Philippe Ulpiano
 """
 from __future__ import annotations
-from typing import Dict, List
+from typing import Dict, List, Tuple
 import json
+import copy
 import re
 import os
 from pprint import pprint, pformat
 from pathlib import Path
 from enum import Enum
+from collections import OrderedDict
+import threading
+import hashlib
 import logging
+from domain.itokenizer import ITokenizer, HeuristicTokenizer
 
 class DocumentType(Enum):
     ppt = 1
@@ -30,6 +35,7 @@ class UtilsLogger:
 class LLMUtils:
     post_additional_request_ids: List = []
     CREATE_SUMMARY_FINDINGS = "create_summary_findings"
+    TOKEN_COUNT_CACHE_SIZE: int = 65536
     logger = UtilsLogger.get_logger(__name__)
     def __init__(self, color_palette: List, \
                  slide_text_filename: str, slide_artistic_filename: str, slide_deck_filename: str, word_requests_filename: str, additional_requests_filename: str):
@@ -40,6 +46,9 @@ class LLMUtils:
         word_review_external_requests: List = self.__read_json(word_requests_filename)
         additional_requests: List = self.__read_json(additional_requests_filename)
         self.document_type = DocumentType.ppt
+        self.compact_serialization: bool = False
+        self.preambles: Dict[tuple, Tuple[str, str]] = {}
+        self.set_tokenizer(HeuristicTokenizer())
 
         self.additional_context: str = None
         self.slide_artistic_content_review_llm_requests = [
@@ -220,9 +229,30 @@ class LLMUtils:
             request = request.replace(match, replacement, 1)
         return request
 
+    def copy(self) -> LLMUtils:
+        # Request catalogs are copied: temperature, top_p or document type set for one review do not leak into the others
+        llm_utils: LLMUtils = copy.copy(self)
+        for request_group in ['word_review_llm_requests', 'deck_review_llm_requests', 'slide_text_review_llm_requests',
+                              'slide_artistic_content_review_llm_requests', 'post_additional_requests']:
+            setattr(llm_utils, request_group, copy.deepcopy(getattr(self, request_group)))
+        return llm_utils
+
     def set_document_type(self, document_type: DocumentType) -> None:
         self.document_type = document_type
 
+    def set_compact_serialization(self, compact_serialization: bool) -> None:
+        # Slides are sent in a terse line notation and texts as they are instead of JSON
+        self.compact_serialization = compact_serialization
+
+    def serialize_content(self, content: any) -> str:
+        if not self.compact_serialization:
+            return json.dumps(content)
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list) and all(isinstance(element, str) for element in content):
+            return "\n".join(content)
+        return json.dumps(content, separators=(",", ":"), ensure_ascii=False)
+
     def get_post_additional_requests_from_name(self, requested_post_request_name: List) -> List:
         post_requests_found: List = []
         for index, post_request in enumerate(self.post_additional_requests):
@@ -372,17 +402,50 @@ class LLMUtils:
     
     def get_llm_reviewer_set(self, reviewer: str) -> str:
         return_str: str = f"- You impersonate {reviewer}, for all prompts keeping the characteristics leading to excellence as expected from {reviewer}\n"
-        if self.document_type == DocumentType.ppt:
+        if self.document_type == DocumentType.ppt and self.compact_serialization:
+                return_str +=   "- The data you will analyze is an export of a deck in a compact text notation.\n"+\
+                                "- Do not comment on the notation itself.\n"+\
+                                "- The notation provides text content and shape's geometry and layout.\n"+\
+                                "- In your analysis and  documentation, you will exclusively refer to the content of the export representing the document."
+        elif self.document_type == DocumentType.ppt:
                 return_str +=   "- The data you will analyze is an export of a deck into JSON data.\n"+\
                                 "- Do not comment on the JSON source itself.\n"+\
                                 "- The JSON structure will provide text content and shape's geometry and layout.\n"+\
                                 "- In your analysis and  documentation, you will exclusively refer to the content of the JSON structure representing the document."
         return return_str
 
+    def get_preamble(self, reviewer: str, requires_format_description: bool, request_has_graphical: bool = False) -> Tuple[str, str]:
+        # System prompt and instructions preceding the content, identical for all the requests of a run: built once
+        preamble_key: tuple = (reviewer, self.document_type, requires_format_description, request_has_graphical, self.compact_serialization, self.additional_context)
+        preamble: Tuple[str, str] = self.preambles.get(preamble_key)
+        if preamble is None:
+            instructions: str = ""
+            if self.additional_context is not None:
+                instructions += f'[{self.additional_context}]\n'
+            format_description: str = self.get_format_description(request_has_graphical) if requires_format_description else None
+            if format_description is not None:
+                instructions += format_description + "\n"
+            preamble = (f'[{self.get_llm_reviewer_set(reviewer)}]', instructions)
+            self.preambles[preamble_key] = preamble
+        return preamble
+
+    def __get_compact_format_description(self, request_has_graphical: bool) -> str:
+        instructions: str = "Slides are given in a compact notation: a line \"Slide <number>\" then one block per shape made of a header in square brackets " + \
+                            "giving the type of the shape (title for the title of the slide, table <columns>x<rows> for tables) followed by its text, " + \
+                            "tables in markdown format. Please NEVER EVER mention this notation in your response, mention you are analyzing a slide instead."
+        if request_has_graphical:
+            instructions += " The header also gives x and y the position from the left and the top, w and h the width and height, all in percent of the slide, " + \
+                            "rot the rotation in degrees, fill and line the colours of the shape and of its line (#RRGGBB or a Powerpoint scheme name) " + \
+                            "with the line thickness in points, font the font name, size in points and colour of the text (followed by the text concerned " + \
+                            "when the shape uses several fonts)."
+        return instructions
+
     # TODO: This method will have to be better integrated to provide graphic or table details according to the request 
     def get_format_description(self, request_has_graphical: bool = False):
         instructions: str = None
-        if self.document_type == DocumentType.ppt:
+        if self.document_type == DocumentType.ppt and self.compact_serialization:
+            instructions = self.__get_compact_format_description(request_has_graphical)
+        elif self.document_type == DocumentType.ppt:
             instructions = f"""Consider the following json for text boxes or groups of shapes the json information represents shapes of a pptx slide, your analysis shall take into account the full text present in the slide that can be extracted from the provided JSON as follows (Please NEVER EVER mention this JSON in your response, mention you are analyzing a slide instead):
                                     
                                 "shape": {{
@@ -457,8 +520,23 @@ class LLMUtils:
     def get_default_reviewer_properties() -> str:
         return "a SME able to first compose highly cost effective team and second is capable to setup very high quality focused teams" 
 
-    @staticmethod
-    def get_number_tokens(string: str) -> int:
-        # Currently using a very approximate approach where we consider 2 to 3 characters per token
-        # Instead a tokenizer of HuggingFace or similar should be used instead
-        return len(re.sub(r'\s+', '', string)) / 2.8
\ No newline at end of file
+    def set_tokenizer(self, tokenizer: ITokenizer) -> None:
+        self.tokenizer = tokenizer
+        # Chunkers, rate limiter and reports count the same text blocks again and again.
+        # Counts are keyed by a digest of the text: the cache does not keep whole documents alive
+        self.token_counts: OrderedDict = OrderedDict()
+        self.token_counts_lock: threading.Lock = threading.Lock()
+
+    def get_number_tokens(self, string: str) -> int:
+        key: bytes = hashlib.blake2b(string.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        with self.token_counts_lock:
+            number_tokens: int = self.token_counts.get(key)
+            if number_tokens is not None:
+                self.token_counts.move_to_end(key)
+                return number_tokens
+        number_tokens = self.tokenizer.count_tokens(string)
+        with self.token_counts_lock:
+            self.token_counts[key] = number_tokens
+            if len(self.token_counts) > self.TOKEN_COUNT_CACHE_SIZE:
+                self.token_counts.popitem(last=False)
+        return number_tokens
\ No newline at end of file
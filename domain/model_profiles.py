@@ -0,0 +1,63 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict
+from pathlib import Path
+import json
+import os
+
+class ModelProfiles:
+    """
+    @brief Per-model settings read from the JSON file pointed by DOC2LLM_MODEL_PROFILES, for example:
+        { "llama3.3-70b": { "requests_per_minute": 60, "tokens_per_minute": 200000 } }
+    A "default" entry applies to any model not explicitly listed.
+    """
+    DOC2LLM_MODEL_PROFILES: str = "DOC2LLM_MODEL_PROFILES"
+    DEFAULT_PROFILE: str = "default"
+    REQUESTS_PER_MINUTE: str = "requests_per_minute"
+    TOKENS_PER_MINUTE: str = "tokens_per_minute"
+    CONTEXT_WINDOW: str = "context_window"
+    RESERVED_OUTPUT_TOKENS: str = "reserved_output_tokens"
+    DEFAULT_RESERVED_OUTPUT_TOKENS: int = 1024
+    PROMPT_COST_PER_MILLION: str = "prompt_cost_per_million"
+    CACHED_PROMPT_COST_PER_MILLION: str = "cached_prompt_cost_per_million"
+    COMPLETION_COST_PER_MILLION: str = "completion_cost_per_million"
+    # Used to plan a review before running it (--plan) and to reserve a budget for a call before sending it
+    EXPECTED_COMPLETION_TOKENS: str = "expected_completion_tokens"
+    DEFAULT_EXPECTED_COMPLETION_TOKENS: int = 500
+    TIME_TO_FIRST_TOKEN: str = "time_to_first_token"
+    DEFAULT_TIME_TO_FIRST_TOKEN: float = 1.0
+    TOKENS_PER_SECOND: str = "tokens_per_second"
+    DEFAULT_TOKENS_PER_SECOND: float = 40.0
+
+    def __init__(self, profiles_filename: str = None):
+        if profiles_filename is None:
+            profiles_filename = os.getenv(self.DOC2LLM_MODEL_PROFILES, default="")
+        self.profiles: Dict = {}
+        path = Path(profiles_filename)
+        if path.is_file():
+            with open(profiles_filename) as f:
+                self.profiles = json.load(f)
+
+    def get_profile(self, model_name: str) -> Dict:
+        profile: Dict = dict(self.profiles.get(self.DEFAULT_PROFILE, {}))
+        profile.update(self.profiles.get(model_name, {}))
+        return profile
+
+    def get_value(self, model_name: str, key: str, default_value: any = None) -> any:
+        return self.get_profile(model_name).get(key, default_value)
+
+    def get_cost(self, model_name: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+        profile: Dict = self.get_profile(model_name)
+        prompt_cost: float = profile.get(self.PROMPT_COST_PER_MILLION, 0)
+        cached_prompt_cost: float = profile.get(self.CACHED_PROMPT_COST_PER_MILLION, prompt_cost)
+        completion_cost: float = profile.get(self.COMPLETION_COST_PER_MILLION, 0)
+        return ((prompt_tokens - cached_tokens) * prompt_cost + cached_tokens * cached_prompt_cost + completion_tokens * completion_cost) / 1000000.0
+
+    def get_expected_completion_tokens(self, model_name: str, max_tokens: int = None) -> int:
+        expected_completion_tokens: int = self.get_value(model_name, self.EXPECTED_COMPLETION_TOKENS, self.DEFAULT_EXPECTED_COMPLETION_TOKENS)
+        return min(expected_completion_tokens, max_tokens) if max_tokens is not None else expected_completion_tokens
+
+    def get_expected_latency(self, model_name: str, completion_tokens: int) -> float:
+        return self.get_value(model_name, self.TIME_TO_FIRST_TOKEN, self.DEFAULT_TIME_TO_FIRST_TOKEN) + \
+               completion_tokens / self.get_value(model_name, self.TOKENS_PER_SECOND, self.DEFAULT_TOKENS_PER_SECOND)
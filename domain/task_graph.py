@@ -0,0 +1,80 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Callable
+import threading
+
+class TaskGraph:
+    """
+    @brief Runs tasks on one shared pool as soon as the tasks they depend on are done: no thread ever waits
+    for another task. A task receives the results of its dependencies followed by its own arguments; when it
+    returns a Future (typically from gather()), its own future completes with the result of that one.
+    """
+    def __init__(self, max_workers: int, thread_name_prefix: str = "doc2llm-task"):
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    @staticmethod
+    def completed(result: any) -> Future:
+        future: Future = Future()
+        future.set_result(result)
+        return future
+
+    @staticmethod
+    def __chain(source: Future, target: Future) -> None:
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            TaskGraph.__set_result(target, source.result())
+
+    @staticmethod
+    def __set_result(target: Future, result: any) -> None:
+        if isinstance(result, Future):
+            result.add_done_callback(lambda source: TaskGraph.__chain(source, target))
+        else:
+            target.set_result(result)
+
+    @staticmethod
+    def gather(futures: List[Future]) -> Future:
+        # Completes with the list of results in the given order, or with the first exception met
+        gathered: Future = Future()
+        remaining: List[int] = [len(futures)]
+        lock: threading.Lock = threading.Lock()
+
+        def on_done(future: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0 or gathered.done():
+                    return
+            failed: List[Future] = [ future for future in futures if future.exception() is not None ]
+            if len(failed) > 0:
+                gathered.set_exception(failed[0].exception())
+            else:
+                gathered.set_result([ future.result() for future in futures ])
+
+        if len(futures) == 0:
+            gathered.set_result([])
+        for future in futures:
+            future.add_done_callback(on_done)
+        return gathered
+
+    def __run(self, task_future: Future, function: Callable, dependencies: List[Future], args: tuple) -> None:
+        try:
+            self.__set_result(task_future, function(*[ dependency.result() for dependency in dependencies ], *args))
+        except BaseException as err:
+            task_future.set_exception(err)
+
+    def add_task(self, function: Callable, *args, dependencies: List[Future] = []) -> Future:
+        task_future: Future = Future()
+
+        def on_dependencies_done(dependencies_future: Future) -> None:
+            if dependencies_future.exception() is not None:
+                task_future.set_exception(dependencies_future.exception())
+            else:
+                self.executor.submit(self.__run, task_future, function, dependencies, args)
+
+        self.gather(dependencies).add_done_callback(on_dependencies_done)
+        return task_future
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,216 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from openai import AsyncOpenAI
+from typing import List, Dict
+from concurrent.futures import Future
+import threading
+import asyncio
+import time
+import os
+from domain.allm_access import ContextWindowExceededError
+from infrastructure.llm_access_detailed import LLMAccessDetailed
+from infrastructure.response_cache import ResponseCache
+from infrastructure.endpoint_pool import Endpoint
+
+class AsyncLLMAccess(LLMAccessDetailed):
+    """
+    @brief Detailed access sending every request through the async OpenAI client.
+    All requests of the run share one event loop and one semaphore: as soon as a request
+    completes, the next queued one starts, so DOC2LLM_REQUESTS_NB_WORKERS requests are kept in flight.
+    """
+
+    async_client = AsyncOpenAI(
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        # api_key=os.getenv("OPENAI_API_KEY") is default
+        # Retries are handled by the retry policy
+        max_retries=0
+    )
+    loop: asyncio.AbstractEventLoop = None
+    semaphore: asyncio.Semaphore = None
+    loop_lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def _get_event_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls.loop_lock:
+            if cls.loop is None:
+                cls.loop = asyncio.new_event_loop()
+                cls.semaphore = asyncio.Semaphore(cls.get_number_workers())
+                threading.Thread(target=cls.loop.run_forever, name="doc2llm-async-llm", daemon=True).start()
+        return cls.loop
+
+    async def _send_request_plain_async(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        endpoint: Endpoint = await self.endpoint_pool.acquire_async() if self.endpoint_pool is not None else None
+        client: AsyncOpenAI = endpoint.async_client if endpoint is not None else self.async_client
+        start_time: float = time.monotonic()
+        try:
+            if self.stream_output is not None:
+                response: Dict = await self._send_streamed_request_async(client, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+            else:
+                response: Dict = await self._send_completion_request_async(client, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        except Exception as err:
+            if endpoint is not None:
+                self.endpoint_pool.release(endpoint, err=err)
+            raise
+        except asyncio.CancelledError:
+            # The hedged duplicate answered first
+            if endpoint is not None:
+                self.endpoint_pool.release(endpoint)
+            raise
+        if endpoint is not None:
+            self.endpoint_pool.release(endpoint, time.monotonic() - start_time)
+            response['endpoint'] = endpoint.name
+        return response
+
+    async def _send_request_plain_timed_async(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        start_time: float = time.monotonic()
+        response: Dict = await self._send_request_plain_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        self.hedging_policy.record_latency(request_name, time.monotonic() - start_time)
+        return response
+
+    async def _send_request_hedged_async(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        if self.hedging_policy is None:
+            return await self._send_request_plain_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        hedge_delay: float = self.hedging_policy.get_hedge_delay(request_name)
+        if hedge_delay is None:
+            return await self._send_request_plain_timed_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        primary: asyncio.Task = asyncio.ensure_future(self._send_request_plain_timed_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens))
+        done, _ = await asyncio.wait([primary], timeout=hedge_delay)
+        # The duplicate takes a free slot at once or is not sent
+        if len(done) > 0 or self.semaphore.locked():
+            return await primary
+        await self.semaphore.acquire()
+        estimated_tokens: int = self._estimate_prompt_tokens(messages)
+        hedge_allowed, hedge_reservation = self._try_acquire_hedge(request_name, model_name, estimated_tokens, max_tokens)
+        if not hedge_allowed:
+            self.semaphore.release()
+            return await primary
+        self.logger.info(f"{request_name}: No answer after {hedge_delay:.2f} s, sending a hedged duplicate.")
+        hedge: asyncio.Task = asyncio.ensure_future(self._send_request_plain_timed_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens))
+        hedge.add_done_callback(lambda task: self.semaphore.release())
+        pending: set = {primary, hedge}
+        winner: asyncio.Task = None
+        while len(pending) > 0 and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.exception() is None), None)
+        if winner is None:
+            self._charge_hedge_loser(hedge_reservation, model_name, estimated_tokens, None)
+            return await primary
+        if winner is hedge:
+            self.hedging_policy.record_hedge_won()
+        # The slower call is cancelled: its prompt may already be processed, so unless it answered or failed its reservation is charged
+        loser: asyncio.Task = primary if winner is hedge else hedge
+        loser.cancel()
+        loser.add_done_callback(lambda task: self._charge_hedge_loser(hedge_reservation, model_name, estimated_tokens, \
+                                                                      {} if task.cancelled() else task.result() if task.exception() is None else None))
+        return winner.result()
+
+    async def _send_completion_request_async(self, client: AsyncOpenAI, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        raw_review = await client.chat.completions.with_raw_response.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=self._get_max_tokens_parameter(max_tokens),
+            timeout=self.retry_policy.get_timeout()
+        )
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(raw_review.headers)
+        review = raw_review.parse()
+        return self._review_to_response(review, messages, request_name, temperature, top_p, post_request_name)
+
+    async def _send_streamed_request_async(self, client: AsyncOpenAI, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        stream_state: Dict = self._start_stream()
+        raw_stream = await client.chat.completions.with_raw_response.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=self._get_max_tokens_parameter(max_tokens),
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=self.retry_policy.get_timeout()
+        )
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(raw_stream.headers)
+        async for chunk in raw_stream.parse():
+            self._consume_stream_chunk(stream_state, chunk, request_name)
+        return self._stream_to_response(stream_state, messages, request_name, temperature, top_p, post_request_name)
+
+    async def _send_request_with_retries_async(self, request_key: str, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        response: Dict = None
+        delay: float = self.retry_policy.base_delay
+        start_time: float = time.monotonic()
+        attempt: int = 0
+        estimated_tokens: int = self._estimate_prompt_tokens(messages)
+        reservation: Dict = self._reserve_budget(request_name, model_name, estimated_tokens, max_tokens)
+        try:
+            while response is None:
+                attempt += 1
+                try:
+                    self._before_call()
+                    if self.rate_limiter is not None:
+                        await self.rate_limiter.acquire_async(estimated_tokens)
+                    response = await self._send_request_hedged_async(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+                    self._after_call_success()
+                except Exception as err:
+                    delay = self._handle_send_error(err, error_information, request_name, messages, attempt, delay)
+                    await asyncio.sleep(delay)
+        finally:
+            self._settle_budget(reservation, model_name, response)
+        self._add_call_statistics(response, start_time, attempt - 1, model_name)
+        self._record_usage(estimated_tokens, response)
+        self._account_usage(response)
+        # The cache is a SQLite file: its reads and writes must not block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._store_cached_response, request_key, response)
+        return response
+
+    async def _send_request_to_model_async(self, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        reformatted_request_messages: List = self._reformat_messages(messages)
+        request_key: str = ResponseCache.compute_key(model_name, reformatted_request_messages, temperature, top_p, max_tokens)
+        response: Dict = await asyncio.get_running_loop().run_in_executor(None, self._get_cached_response, request_key, request_name, temperature, top_p, post_request_name)
+        if response is None:
+            if self.single_flight is None:
+                response = await self._send_request_with_retries_async(request_key, reformatted_request_messages, error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+            else:
+                response = await self.single_flight.do_async(request_key, lambda: self._send_request_with_retries_async(request_key, reformatted_request_messages, \
+                                                                                                                        error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens))
+                response = dict(response, request_name=request_name, post_request_name=post_request_name)
+        response['model'] = model_name
+        self._record_cassette(request_key, response)
+        self._record_run_report(response, error_information)
+        return response
+
+    async def _send_request_async(self, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, \
+                                  model_name: str = None, max_tokens: int = None, fallback_model: str = None) -> Dict:
+        model_name = model_name if model_name is not None else self.model_name
+        try:
+            return await self._send_request_to_model_async(messages, error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        except ContextWindowExceededError:
+            if fallback_model is None or fallback_model == model_name:
+                raise
+            self.logger.warning(f"{request_name}: Request too big for model {model_name}, sending it to fallback model {fallback_model}.")
+        return await self._send_request_to_model_async(messages, error_information, request_name, temperature, top_p, post_request_name, fallback_model, max_tokens)
+
+    async def __send_request_bounded(self, request_input: Dict) -> Dict:
+        async with self.semaphore:
+            return await self._send_request_async(self._create_request_messages(request_input), \
+                                                  request_input['error_information'], \
+                                                  request_input["request_name"], \
+                                                  request_input['temperature'], \
+                                                  request_input['top_p'], \
+                                                  request_input['post_request_name'], \
+                                                  request_input.get('model'), \
+                                                  request_input.get('max_tokens'), \
+                                                  request_input.get('fallback_model'))
+
+    def _prepare_and_send_requests(self, request_inputs: List) -> List:
+        self._warm_up_shared_prefix(request_inputs)
+        loop: asyncio.AbstractEventLoop = self._get_event_loop()
+        futures: List[Future] = [ asyncio.run_coroutine_threadsafe(self.__send_request_bounded(request_input), loop) \
+                                  for request_input in request_inputs ]
+        responses: List = [ future.result() for future in futures ]
+
+        for response in responses:
+            response["request_name"] += self.checker.get_separator_information()
+        return responses
@@ -0,0 +1,80 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from openai.types.chat import ChatCompletion
+from typing import List, Dict
+from logging import Logger
+from pathlib import Path
+import threading
+import json
+
+class BatchExportFile:
+    """
+    @brief Writes requests as Batch API JSONL lines. The custom_id is derived from the response cache key
+    (model, messages, sampling parameters): it is stable across runs and identical requests are written once.
+    """
+    CUSTOM_ID_PREFIX: str = "doc2llm-"
+    BATCH_URL: str = "/v1/chat/completions"
+
+    def __init__(self, batch_export_path: str, logger: Logger):
+        self.batch_export_path = batch_export_path
+        self.logger = logger
+        self.lock: threading.Lock = threading.Lock()
+        self.custom_ids: set = set()
+        self.batch_file = open(batch_export_path, "w", encoding="utf-8")
+
+    @staticmethod
+    def get_custom_id(request_key: str) -> str:
+        return f"{BatchExportFile.CUSTOM_ID_PREFIX}{request_key}"
+
+    def write(self, request_key: str, model_name: str, messages: List, temperature: float, top_p: float, max_tokens: int = None) -> str:
+        custom_id: str = self.get_custom_id(request_key)
+        with self.lock:
+            if custom_id not in self.custom_ids:
+                self.custom_ids.add(custom_id)
+                body: Dict = {
+                    'model': model_name,
+                    'messages': messages,
+                    'temperature': temperature,
+                    'top_p': top_p
+                }
+                if max_tokens is not None:
+                    body['max_tokens'] = max_tokens
+                self.batch_file.write(json.dumps({
+                    'custom_id': custom_id,
+                    'method': 'POST',
+                    'url': self.BATCH_URL,
+                    'body': body
+                }, ensure_ascii=False) + "\n")
+        return custom_id
+
+    def close(self) -> None:
+        with self.lock:
+            self.batch_file.close()
+        self.logger.info(f"{len(self.custom_ids)} requests exported to batch file {self.batch_export_path}")
+
+class BatchResults:
+    """
+    @brief Results of one or more Batch API output files indexed by custom_id.
+    """
+    def __init__(self, batch_result_paths: List, logger: Logger):
+        self.logger = logger
+        self.reviews: Dict[str, ChatCompletion] = {}
+        for batch_result_path in batch_result_paths:
+            if not Path(batch_result_path).is_file():
+                raise FileNotFoundError(f"Batch result file {batch_result_path} could not be read.")
+            with open(batch_result_path, encoding="utf-8") as f:
+                for line in f:
+                    if len(line.strip()) > 0:
+                        self.__add_result(json.loads(line))
+        self.logger.info(f"{len(self.reviews)} batch results loaded from {', '.join(batch_result_paths)}")
+
+    def __add_result(self, result: Dict) -> None:
+        response: Dict = result.get('response') or {}
+        if result.get('error') is not None or response.get('status_code') != 200:
+            self.logger.warning(f"Batch result {result.get('custom_id')} failed: {result.get('error') or response.get('status_code')}")
+            return
+        self.reviews[result['custom_id']] = ChatCompletion.model_validate(response['body'])
+
+    def get_review(self, custom_id: str) -> ChatCompletion:
+        return self.reviews.get(custom_id)
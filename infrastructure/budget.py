@@ -0,0 +1,68 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict
+from logging import Logger
+import threading
+from domain.allm_access import BudgetExceededError
+from domain.model_profiles import ModelProfiles
+
+class Budget:
+    """
+    @brief Caps the prompt tokens and / or the estimated cost of a run. Before being sent, a call reserves its
+    prompt tokens and its expected completion: when the calls done plus the calls in flight would exceed the budget,
+    BudgetExceededError is raised and nothing is sent. Once answered, the reservation is replaced by the actual usage.
+    """
+    def __init__(self, logger: Logger, model_profiles: ModelProfiles, max_prompt_tokens: int = None, max_cost: float = None):
+        self.logger = logger
+        self.model_profiles = model_profiles
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_cost = max_cost
+        self.lock: threading.Lock = threading.Lock()
+        self.prompt_tokens: int = 0
+        self.cost: float = 0
+        self.reserved_prompt_tokens: int = 0
+        self.reserved_cost: float = 0
+        self.refused_calls: int = 0
+
+    def try_reserve(self, model_name: str, prompt_tokens: int, max_tokens: int) -> Dict:
+        # None when the call does not fit in the budget
+        completion_tokens: int = self.model_profiles.get_expected_completion_tokens(model_name, max_tokens)
+        reservation: Dict = {'prompt_tokens': prompt_tokens, 'cost': self.model_profiles.get_cost(model_name, prompt_tokens, 0, completion_tokens)}
+        with self.lock:
+            exceeds_prompt_tokens: bool = self.max_prompt_tokens is not None and \
+                                          self.prompt_tokens + self.reserved_prompt_tokens + reservation['prompt_tokens'] > self.max_prompt_tokens
+            exceeds_cost: bool = self.max_cost is not None and self.cost + self.reserved_cost + reservation['cost'] > self.max_cost
+            if exceeds_prompt_tokens or exceeds_cost:
+                return None
+            self.reserved_prompt_tokens += reservation['prompt_tokens']
+            self.reserved_cost += reservation['cost']
+        return reservation
+
+    def reserve(self, request_name: str, model_name: str, prompt_tokens: int, max_tokens: int) -> Dict:
+        reservation: Dict = self.try_reserve(model_name, prompt_tokens, max_tokens)
+        if reservation is None:
+            with self.lock:
+                self.refused_calls += 1
+            raise BudgetExceededError(f"{request_name}: Sending {prompt_tokens} more prompt tokens would exceed the budget ({self.get_statistics_str()}).")
+        return reservation
+
+    def settle(self, reservation: Dict, model_name: str, response: Dict = None) -> None:
+        # Failed calls are not charged: their reservation is only released
+        with self.lock:
+            self.reserved_prompt_tokens -= reservation['prompt_tokens']
+            self.reserved_cost -= reservation['cost']
+            if response is None:
+                return
+            if 'usage' in response:
+                usage: Dict = response['usage']
+                self.prompt_tokens += usage['prompt_tokens']
+                self.cost += self.model_profiles.get_cost(model_name, usage['prompt_tokens'], usage.get('cached_tokens', 0), usage['completion_tokens'])
+            else:
+                self.prompt_tokens += reservation['prompt_tokens']
+                self.cost += reservation['cost']
+
+    def get_statistics_str(self) -> str:
+        max_prompt_tokens: str = str(self.max_prompt_tokens) if self.max_prompt_tokens is not None else "unlimited"
+        max_cost: str = f"{self.max_cost:.4f}" if self.max_cost is not None else "unlimited"
+        return f"Budget: {self.prompt_tokens} / {max_prompt_tokens} prompt tokens, estimated cost {self.cost:.4f} / {max_cost}, {self.refused_calls} calls refused"
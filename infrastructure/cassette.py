@@ -0,0 +1,65 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict
+from logging import Logger
+from pathlib import Path
+import threading
+import gzip
+import json
+
+class CassetteRecorder:
+    """
+    @brief Records the responses of a real run as JSONL lines (gzip compressed when the file name ends with .gz).
+    Each line holds the response cache key of the request, the response text, its token usage and its latency:
+    identical requests are recorded once.
+    """
+    def __init__(self, cassette_path: str, logger: Logger):
+        self.cassette_path = cassette_path
+        self.logger = logger
+        self.lock: threading.Lock = threading.Lock()
+        self.request_keys: set = set()
+        self.cassette_file = Cassette.open_file(cassette_path, "wt")
+
+    def record(self, request_key: str, response: Dict) -> None:
+        with self.lock:
+            if request_key in self.request_keys:
+                return
+            self.request_keys.add(request_key)
+            self.cassette_file.write(json.dumps({
+                'key': request_key,
+                'model': response.get('model'),
+                'response': response['response'],
+                'usage': response.get('usage'),
+                'latency': round(response.get('latency') or 0, 3)
+            }, ensure_ascii=False, separators=(',', ':')) + "\n")
+
+    def close(self) -> None:
+        with self.lock:
+            self.cassette_file.close()
+        self.logger.info(f"{len(self.request_keys)} responses recorded in cassette {self.cassette_path}")
+
+class Cassette:
+    """
+    @brief Responses of a cassette file indexed by request key.
+    """
+    def __init__(self, cassette_path: str, logger: Logger):
+        self.logger = logger
+        self.entries: Dict[str, Dict] = {}
+        if not Path(cassette_path).is_file():
+            raise FileNotFoundError(f"Cassette file {cassette_path} could not be read.")
+        with self.open_file(cassette_path, "rt") as f:
+            for line in f:
+                if len(line.strip()) > 0:
+                    entry: Dict = json.loads(line)
+                    self.entries[entry['key']] = entry
+        self.logger.info(f"{len(self.entries)} responses loaded from cassette {cassette_path}")
+
+    @staticmethod
+    def open_file(cassette_path: str, mode: str) -> any:
+        if cassette_path.endswith(".gz"):
+            return gzip.open(cassette_path, mode, encoding="utf-8")
+        return open(cassette_path, mode, encoding="utf-8")
+
+    def get(self, request_key: str) -> Dict:
+        return self.entries.get(request_key)
@@ -0,0 +1,99 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from domain.ijournal import IJournal
+from typing import List, Dict
+from logging import Logger
+from pathlib import Path
+import threading
+import json
+import time
+import os
+
+class CheckpointJournal(IJournal):
+    """
+    @brief Append-only JSONL journal of the chunks reviewed so far. The first line holds the key of the run (hash
+    of the input document and of the configuration): a journal is only resumed by a run with the same key.
+    Records are flushed at once and fsynced according to the policy: always, periodic (at most every second) or never.
+    The file is only created when the first chunk is recorded.
+    """
+    FSYNC_ALWAYS: str = "always"
+    FSYNC_PERIODIC: str = "periodic"
+    FSYNC_NEVER: str = "never"
+    FSYNC_POLICIES: List[str] = [FSYNC_ALWAYS, FSYNC_PERIODIC, FSYNC_NEVER]
+    FSYNC_PERIOD: float = 1.0
+
+    def __init__(self, journal_path: str, key: str, logger: Logger, resume: bool, fsync_policy: str = FSYNC_PERIODIC):
+        self.journal_path = journal_path
+        self.key = key
+        self.logger = logger
+        self.fsync_policy = fsync_policy
+        self.lock: threading.Lock = threading.Lock()
+        self.records: Dict[str, List] = {}
+        self.last_fsync: float = time.monotonic()
+        self.journal_file = None
+        if resume:
+            self.__load()
+
+    def __load(self) -> None:
+        if not Path(self.journal_path).is_file():
+            self.logger.warning(f"No journal {self.journal_path} to resume from, starting from scratch.")
+            return
+        with open(self.journal_path, "rb") as f:
+            content: bytes = f.read()
+        # A record cut by the crash is dropped so that the next record starts on its own line
+        complete_length: int = content.rfind(b"\n") + 1
+        if complete_length < len(content):
+            self.logger.warning(f"Ignoring the incomplete last record of journal {self.journal_path}.")
+            content = content[:complete_length]
+        lines: List[str] = content.decode("utf-8", errors="replace").splitlines()
+        try:
+            header: Dict = json.loads(lines[0]) if len(lines) > 0 else {}
+            key: str = header.get('key')
+        except (json.JSONDecodeError, AttributeError):
+            self.logger.warning(f"Journal {self.journal_path} has an unreadable header, starting from scratch.")
+            return
+        if key != self.key:
+            self.logger.warning(f"Journal {self.journal_path} was written for another document or configuration, starting from scratch.")
+            return
+        for line in lines[1:]:
+            try:
+                record: Dict = json.loads(line)
+                self.records[record['chunk']] = record['results']
+            except (json.JSONDecodeError, KeyError, TypeError):
+                self.logger.warning(f"Ignoring an unreadable record of journal {self.journal_path}.")
+        if len(self.records) > 0:
+            os.truncate(self.journal_path, complete_length)
+            self.journal_file = open(self.journal_path, "a", encoding="utf-8")
+        self.logger.info(f"Resuming from journal {self.journal_path}: {len(self.records)} chunks already reviewed.")
+
+    def __write(self, record: Dict) -> None:
+        if self.journal_file is None:
+            self.journal_file = open(self.journal_path, "w", encoding="utf-8")
+            self.__write({'key': self.key})
+        self.journal_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.journal_file.flush()
+        now: float = time.monotonic()
+        if self.fsync_policy == self.FSYNC_ALWAYS or (self.fsync_policy == self.FSYNC_PERIODIC and now - self.last_fsync >= self.FSYNC_PERIOD):
+            os.fsync(self.journal_file.fileno())
+            self.last_fsync = now
+
+    def get(self, chunk_id: str) -> List:
+        with self.lock:
+            return self.records.get(chunk_id)
+
+    def record(self, chunk_id: str, results: List) -> None:
+        with self.lock:
+            self.records[chunk_id] = results
+            self.__write({'chunk': chunk_id, 'results': results})
+
+    def close(self, completed: bool) -> None:
+        with self.lock:
+            if self.journal_file is not None:
+                if not completed and self.fsync_policy != self.FSYNC_NEVER:
+                    os.fsync(self.journal_file.fileno())
+                self.journal_file.close()
+        if completed:
+            Path(self.journal_path).unlink(missing_ok=True)
+        elif Path(self.journal_path).is_file():
+            self.logger.warning(f"Review not completed: run again with --resume to continue from journal {self.journal_path}.")
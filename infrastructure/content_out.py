@@ -7,11 +7,12 @@ from pprint import pformat
 import logging
 import re
 import pathlib  
+import threading
 
 class ContentOut(IContentOut):
     
-    toc: List = []
-    findings: Dict = {}
+    toc: List = None
+    findings: Dict = None
     TOTAL_FINDINGS: str = 'All findings'
     NAME_FINDING_KEY: str = 'name_finding'
     NUMBER_FINDING_KEY: str = 'number_finding'
@@ -22,6 +23,12 @@ class ContentOut(IContentOut):
         self.log_file_name = log_file_name
         self.temporary_file_name = f"{log_file_name}.temporary"
         self.temporary_file = open(self.temporary_file_name, "a", encoding="utf-8") 
+        self.temporary_file_lock: threading.Lock = threading.Lock()
+        self.stream_buffers: Dict = {}
+        self.open_streams: set = set()
+        # Per review: several documents can be reviewed by the same process (batch mode)
+        self.toc = []
+        self.findings = {}
         self.file_content: List = []
         self.file_title = f'# {file_title}'
         self.file_description = file_description
@@ -83,7 +90,34 @@ class ContentOut(IContentOut):
 
     def __append_log(self, data: str):
         self.file_content.append(data)
-        self.temporary_file.write(f"{data}\n")
+        with self.temporary_file_lock:
+            self.temporary_file.write(f"{data}\n")
+            # Followed while the review goes on (daemon result streaming)
+            self.temporary_file.flush()
+
+    def document_stream(self, stream_name: str, text: str) -> None:
+        # Several requests can stream at once: only complete lines are written, prefixed with their request
+        with self.temporary_file_lock:
+            buffer: str = self.stream_buffers.pop(stream_name, "") + (text if text is not None else "")
+            lines: List = buffer.split("\n")
+            if text is not None:
+                self.stream_buffers[stream_name] = lines.pop()
+                self.open_streams.add(stream_name)
+            else:
+                self.open_streams.discard(stream_name)
+            for line in lines:
+                if text is not None or len(line) > 0:
+                    self.temporary_file.write(f"[{stream_name}] {line}\n")
+            self.temporary_file.flush()
+
+    def discard_stream(self, stream_name: str, reason: str) -> None:
+        # Lines already written cannot be taken back: other streams are interleaved with them
+        with self.temporary_file_lock:
+            self.stream_buffers.pop(stream_name, None)
+            if stream_name in self.open_streams:
+                self.open_streams.discard(stream_name)
+                self.temporary_file.write(f"[{stream_name}] --- {reason}: partial response above discarded ---\n")
+                self.temporary_file.flush()
         
     def document(self, line: str) -> str:
         md_text: str = '\n'.join([ re.sub(r'^#+', '#' * (len(self.title_level_number)), message) \
@@ -0,0 +1,181 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+from typing import List, Tuple
+from logging import Logger
+from pathlib import Path
+from infrastructure.retry_policy import CircuitOpenError
+import threading
+import asyncio
+import json
+import time
+import os
+
+class Endpoint:
+    def __init__(self, base_url: str, api_key: str = None, weight: float = 1.0, max_concurrency: int = None, name: str = None):
+        self.base_url = base_url
+        self.name = name if name is not None else base_url
+        self.weight: float = weight if weight is not None and weight > 0 else 1.0
+        self.max_concurrency: int = max_concurrency
+        # Retries are handled by the retry policy: a failing endpoint is left for another one
+        self.client: OpenAI = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.async_client: AsyncOpenAI = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.in_flight: int = 0
+        self.ewma_latency: float = None
+        self.healthy: bool = True
+        self.consecutive_failures: int = 0
+        self.last_failure_time: float = 0
+
+    def has_capacity(self) -> bool:
+        return self.healthy and (self.max_concurrency is None or self.in_flight < self.max_concurrency)
+
+    def get_load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+    def get_expected_latency(self) -> float:
+        # Endpoints without measurement yet are tried first
+        return (self.ewma_latency if self.ewma_latency is not None else 0) * (self.in_flight + 1) / self.weight
+
+class EndpointPool:
+    """
+    @brief Pool of OpenAI compatible endpoints (for example several vLLM replicas).
+    Each request is routed to the healthy endpoint with the fewest requests in flight (relative to its weight)
+    or with the lowest measured latency (EWMA). Endpoints failing repeatedly are taken out of rotation
+    and put back once a health check succeeds.
+    The JSON file describing the endpoints is a list of:
+        { "base_url": "http://replica-1:8000/v1", "api_key_env": "OPENAI_API_KEY", "weight": 1, "max_concurrency": 8 }
+    """
+    LEAST_IN_FLIGHT: str = "least_in_flight"
+    LOWEST_LATENCY: str = "lowest_latency"
+    ROUTINGS: List = [LEAST_IN_FLIGHT, LOWEST_LATENCY]
+
+    def __init__(self, endpoints: List[Endpoint], logger: Logger, routing: str = LEAST_IN_FLIGHT, \
+                 failure_threshold: int = 3, health_check_interval: float = 30.0, ewma_alpha: float = 0.3):
+        if len(endpoints) == 0:
+            raise ValueError("An endpoint pool requires at least one endpoint")
+        self.endpoints: List[Endpoint] = endpoints
+        self.logger = logger
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.health_check_interval = health_check_interval
+        self.ewma_alpha = ewma_alpha
+        self.condition: threading.Condition = threading.Condition()
+        # Coroutines waiting for an endpoint, woken up from the releasing thread on their own event loop
+        self.async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        threading.Thread(target=self.__health_check_loop, name="doc2llm-endpoint-health", daemon=True).start()
+
+    @staticmethod
+    def from_file(endpoints_path: str, logger: Logger, routing: str = LEAST_IN_FLIGHT) -> 'EndpointPool':
+        path = Path(endpoints_path)
+        if not path.is_file():
+            raise FileNotFoundError(f"Endpoints file {endpoints_path} could not be read.")
+        with open(endpoints_path) as f:
+            endpoint_descriptions: List = json.load(f)
+        endpoints: List[Endpoint] = [ Endpoint(endpoint_description['base_url'],
+                                               os.getenv(endpoint_description.get('api_key_env', "OPENAI_API_KEY")),
+                                               endpoint_description.get('weight', 1.0),
+                                               endpoint_description.get('max_concurrency'),
+                                               endpoint_description.get('name')) for endpoint_description in endpoint_descriptions ]
+        logger.info(f"Endpoint pool: {', '.join([endpoint.name for endpoint in endpoints])} routed by {routing}")
+        return EndpointPool(endpoints, logger, routing)
+
+    @staticmethod
+    def is_endpoint_failure(err: Exception) -> bool:
+        # Only failures of the replica itself take it out of rotation, not invalid requests
+        if isinstance(err, APIConnectionError):
+            return True
+        return isinstance(err, APIStatusError) and err.status_code >= 500
+
+    def __select(self, exclude: Endpoint) -> Endpoint:
+        candidates: List[Endpoint] = [ endpoint for endpoint in self.endpoints if endpoint.has_capacity() and endpoint is not exclude ]
+        if len(candidates) == 0 and exclude is not None and exclude.has_capacity():
+            candidates = [exclude]
+        if len(candidates) == 0:
+            return None
+        # Endpoints that failed recently are avoided while others answer: a retry switches to the next endpoint
+        now: float = time.monotonic()
+        not_failing: List[Endpoint] = [ endpoint for endpoint in candidates if endpoint.consecutive_failures == 0 or now - endpoint.last_failure_time > self.health_check_interval ]
+        if len(not_failing) > 0:
+            candidates = not_failing
+        if self.routing == self.LOWEST_LATENCY:
+            return min(candidates, key=lambda endpoint: endpoint.get_expected_latency())
+        return min(candidates, key=lambda endpoint: endpoint.get_load())
+
+    def __try_acquire(self, exclude: Endpoint) -> Endpoint:
+        if not any(endpoint.healthy for endpoint in self.endpoints):
+            raise CircuitOpenError("All endpoints are out of rotation, failing fast until a health check succeeds", self.health_check_interval)
+        endpoint: Endpoint = self.__select(exclude)
+        if endpoint is not None:
+            endpoint.in_flight += 1
+        return endpoint
+
+    def acquire(self, exclude: Endpoint = None) -> Endpoint:
+        with self.condition:
+            while (endpoint := self.__try_acquire(exclude)) is None:
+                self.condition.wait(timeout=1.0)
+            return endpoint
+
+    async def acquire_async(self, exclude: Endpoint = None) -> Endpoint:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        while True:
+            waiter: Tuple[asyncio.AbstractEventLoop, asyncio.Event] = (loop, asyncio.Event())
+            with self.condition:
+                endpoint: Endpoint = self.__try_acquire(exclude)
+                if endpoint is not None:
+                    return endpoint
+                self.async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self.condition:
+                    if waiter in self.async_waiters:
+                        self.async_waiters.remove(waiter)
+
+    def __notify_all(self) -> None:
+        # Called with the condition held
+        self.condition.notify_all()
+        for loop, event in self.async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+        self.async_waiters.clear()
+
+    def release(self, endpoint: Endpoint, latency: float = None, err: Exception = None) -> None:
+        with self.condition:
+            endpoint.in_flight -= 1
+            if err is None:
+                endpoint.consecutive_failures = 0
+                if latency is not None:
+                    endpoint.ewma_latency = latency if endpoint.ewma_latency is None else \
+                        self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma_latency
+            elif self.is_endpoint_failure(err):
+                endpoint.consecutive_failures += 1
+                endpoint.last_failure_time = time.monotonic()
+                if endpoint.healthy and endpoint.consecutive_failures >= self.failure_threshold:
+                    endpoint.healthy = False
+                    self.logger.warning(f"Endpoint {endpoint.name} taken out of rotation after {endpoint.consecutive_failures} consecutive failures")
+            self.__notify_all()
+
+    def __health_check_loop(self) -> None:
+        while True:
+            time.sleep(self.health_check_interval)
+            for endpoint in [ endpoint for endpoint in self.endpoints if not endpoint.healthy ]:
+                try:
+                    endpoint.client.models.list()
+                except Exception as err:
+                    self.logger.debug(f"Endpoint {endpoint.name} still failing its health check: {err=}")
+                    continue
+                with self.condition:
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+                    self.__notify_all()
+                self.logger.info(f"Endpoint {endpoint.name} back in rotation")
+
+    def get_statistics_str(self) -> str:
+        return "Endpoints: " + ", ".join([ f"{endpoint.name} ({'healthy' if endpoint.healthy else 'out of rotation'}, " + \
+                                           (f"EWMA latency {endpoint.ewma_latency:.2f} s)" if endpoint.ewma_latency is not None else "no latency measured)") \
+                                           for endpoint in self.endpoints ])
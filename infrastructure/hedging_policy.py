@@ -0,0 +1,58 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict
+from collections import deque
+import threading
+import math
+
+class HedgingPolicy:
+    """
+    @brief Decides when a slow LLM call gets a duplicate (hedged request).
+    A duplicate is sent once a call did not answer within the given percentile of the latencies observed
+    for the same request name. The number of duplicates stays below max_extra_load times the number of calls.
+    """
+    DEFAULT_MAX_EXTRA_LOAD: float = 0.1
+
+    def __init__(self, percentile: float, max_extra_load: float = DEFAULT_MAX_EXTRA_LOAD, min_samples: int = 10, window_size: int = 200):
+        self.percentile = percentile
+        self.max_extra_load = max_extra_load
+        self.min_samples = min_samples
+        self.window_size = window_size
+        self.latencies: Dict[str, deque] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.calls: int = 0
+        self.hedges_sent: int = 0
+        self.hedges_won: int = 0
+
+    def record_latency(self, request_name: str, latency: float) -> None:
+        with self.lock:
+            self.latencies.setdefault(request_name, deque(maxlen=self.window_size)).append(latency)
+
+    def get_hedge_delay(self, request_name: str) -> float:
+        with self.lock:
+            self.calls += 1
+            latencies: deque = self.latencies.get(request_name)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            sorted_latencies: list = sorted(latencies)
+        return sorted_latencies[max(math.ceil(self.percentile / 100.0 * len(sorted_latencies)) - 1, 0)]
+
+    def try_acquire_hedge(self) -> bool:
+        with self.lock:
+            if self.hedges_sent + 1 > self.max_extra_load * self.calls:
+                return False
+            self.hedges_sent += 1
+            return True
+
+    def cancel_hedge(self) -> None:
+        # Allowed by the policy but not sent: no slot, rate limit or budget left for it
+        with self.lock:
+            self.hedges_sent -= 1
+
+    def record_hedge_won(self) -> None:
+        with self.lock:
+            self.hedges_won += 1
+
+    def get_statistics_str(self) -> str:
+        return f"Hedged requests: {self.hedges_sent} duplicates sent for {self.calls} calls, {self.hedges_won} answered first"
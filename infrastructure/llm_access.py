@@ -1,15 +1,28 @@
 """
 @author Jean-Philippe Ulpiano
 """
-from openai import OpenAI
+from openai import OpenAI, InternalServerError, NOT_GIVEN
 from pprint import pformat
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import time
 import re
 import os
 import json
 import sys
+import threading
+import logging
 from domain.allm_access import AbstractLLMAccess, ContextWindowExceededError
+from infrastructure.response_cache import ResponseCache
+from infrastructure.cassette import CassetteRecorder
+from infrastructure.rate_limiter import RateLimiter
+from infrastructure.single_flight import SingleFlight
+from infrastructure.endpoint_pool import EndpointPool, Endpoint
+from infrastructure.run_report import RunReport
+from infrastructure.retry_policy import RetryPolicy, CircuitOpenError
+from infrastructure.hedging_policy import HedgingPolicy
+from infrastructure.budget import Budget
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from domain.icontent_out import IContentOut
 
 class LLMAccess(AbstractLLMAccess):
 
@@ -17,7 +30,88 @@ class LLMAccess(AbstractLLMAccess):
         base_url=os.getenv("OPENAI_BASE_URL"),
         # base_url="https://api.openai.com/v1"
         # api_key=os.getenv("OPENAI_API_KEY") is default
+        # Retries are handled by the retry policy
+        max_retries=0
     )
+    response_cache: ResponseCache = None
+    rate_limiter: RateLimiter = None
+    stream_output: IContentOut = None
+    single_flight: SingleFlight = None
+    endpoint_pool: EndpointPool = None
+    run_report: RunReport = None
+    cassette_recorder: CassetteRecorder = None
+    retry_policy: RetryPolicy = RetryPolicy()
+    hedging_policy: HedgingPolicy = None
+    hedge_executor: ThreadPoolExecutor = None
+    budget: Budget = None
+    in_flight_semaphore: threading.BoundedSemaphore = None
+    prefix_cache_layout: bool = False
+    prefix_cache_warm_up: bool = False
+    PREFIX_WARM_UP_REQUEST_NAME: str = "Prefix cache warm up"
+
+    def set_response_cache(self, response_cache: ResponseCache) -> None:
+        self.response_cache = response_cache
+
+    def set_rate_limiter(self, rate_limiter: RateLimiter) -> None:
+        self.rate_limiter = rate_limiter
+
+    def set_endpoint_pool(self, endpoint_pool: EndpointPool) -> None:
+        self.endpoint_pool = endpoint_pool
+
+    def set_single_flight(self, single_flight: SingleFlight) -> None:
+        self.single_flight = single_flight
+
+    def set_run_report(self, run_report: RunReport) -> None:
+        self.run_report = run_report
+
+    def set_cassette_recorder(self, cassette_recorder: CassetteRecorder) -> None:
+        self.cassette_recorder = cassette_recorder
+
+    def set_retry_policy(self, retry_policy: RetryPolicy) -> None:
+        self.retry_policy = retry_policy
+
+    def set_hedging_policy(self, hedging_policy: HedgingPolicy) -> None:
+        # A call and its duplicate both run in the executor so that the first answer can be taken
+        self.hedging_policy = hedging_policy
+        self.hedge_executor = ThreadPoolExecutor(max_workers=2 * self.get_number_workers(), thread_name_prefix="doc2llm-hedge")
+
+    def set_budget(self, budget: Budget) -> None:
+        self.budget = budget
+
+    def set_max_in_flight(self, max_in_flight: int) -> None:
+        # Caps the calls of all threads together, whatever the number of chunks reviewed concurrently
+        self.set_in_flight_semaphore(threading.BoundedSemaphore(max_in_flight))
+
+    def set_in_flight_semaphore(self, in_flight_semaphore: threading.BoundedSemaphore) -> None:
+        # Shared by several accesses (batch mode): the bound applies to all documents together
+        self.in_flight_semaphore = in_flight_semaphore
+
+    def _send_request_bounded(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int, \
+                              estimated_tokens: int) -> Dict:
+        # The slot is taken first: rate limiter tokens are only consumed by a call about to be sent, not by one waiting for a slot
+        if self.in_flight_semaphore is None:
+            return self.__send_request_rate_limited(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens, estimated_tokens)
+        with self.in_flight_semaphore:
+            return self.__send_request_rate_limited(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens, estimated_tokens)
+
+    def __send_request_rate_limited(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int, \
+                                    estimated_tokens: int) -> Dict:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimated_tokens)
+        return self._send_request_hedged(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+
+    def set_prefix_cache_layout(self, prefix_cache_layout: bool, prefix_cache_warm_up: bool) -> None:
+        # Document content first and request last: all requests on the same content share a prompt prefix
+        # that providers with prompt / KV caching can reuse
+        self.prefix_cache_layout = prefix_cache_layout
+        self.prefix_cache_warm_up = prefix_cache_warm_up
+        self.usage_lock: threading.Lock = threading.Lock()
+        self.prompt_tokens_total: int = 0
+        self.cached_tokens_total: int = 0
+
+    def set_stream_output(self, stream_output: IContentOut) -> None:
+        # When set, completions are streamed and every delta is appended to the temporary output
+        self.stream_output = stream_output
 
     def _get_request_llm_to_string(self, request_input: Dict):
         request_llm: str = ""
@@ -32,19 +126,12 @@ class LLMAccess(AbstractLLMAccess):
         return request_llm
     
     def _create_message(self, llm_requests: List, reviewer: str, content: str, requires_format_description: bool):
-        self.logger.debug(f"_create_message:content = {content}")
-        llm_requests.insert(0, {"role": "system", "content": f'[{self.llm_utils.get_llm_reviewer_set(reviewer)}]'})
-        instructions: str = ""
-        if self.llm_utils.get_additional_context() is not None:
-            instructions += f'[{self.llm_utils.get_additional_context()}]\n'
-        if requires_format_description:
-            tmp_instructions: str = self.llm_utils.get_format_description()
-            if tmp_instructions is not None:
-                instructions += tmp_instructions + "\n"
-        instructions += content + "\n"
-        llm_requests.append({"role": "user",   "content": instructions})
-        self.logger.debug(f"_create_message:request_list = {pformat(llm_requests, width=150)}")
-        return llm_requests
+        system_prompt, instructions = self.llm_utils.get_preamble(reviewer, requires_format_description)
+        system_message: Dict = {"role": "system", "content": system_prompt}
+        instructions_message: Dict = {"role": "user", "content": instructions + content + "\n"}
+        if self.prefix_cache_layout:
+            return [system_message, instructions_message] + llm_requests
+        return [system_message] + llm_requests + [instructions_message]
 
     def _create_messages(self, request_inputs: List, content: str, requires_format_description: bool):
         llm_requests: List = []
@@ -69,129 +156,478 @@ class LLMAccess(AbstractLLMAccess):
             avg_top_p /= len(request_inputs)
         return llm_requests, request_names, avg_temperature, avg_top_p
 
-    # TODO: Actually this process should be ahndeled when appending messages not before sending them to the LLM
+    @staticmethod
+    def __clean_value(value: any) -> any:
+        # TODO, use https://pypi.org/project/Unidecode/ instead
+        return value.replace(r"\\u2019", "'").replace(r'\\u[\da-f]{4}', ' ') if isinstance(value, str) else value
+
+    @staticmethod
+    def __merge_message(message: Dict, additional_message: Dict, add_missing_keys: bool) -> None:
+        for key, value in additional_message.items():
+            if key == 'role': continue
+            if key in message: message[key] += '\n' + value
+            elif add_missing_keys: message[key] = value
+
     def _reformat_messages(self, messages: List) -> List:
+        # Single pass building new messages, the messages given are left untouched: all system messages are clubbed together
+        # into a first message, messages following each other with the same role are clubbed together
         role_key: str = 'role'
-        system_value: str = 'system'
-        previous_role_name: str = None
+        system_message: Dict = None
         optimized_messages: List = []
-        # First ensure all system messages are properly clubbed together into 1 message only
-        index_systems: List = []
-        self.logger.debug(f"**** Before changes: \n{pformat(messages, width=250)}")
-        for index, message in enumerate(messages):
-            if role_key in message and message[role_key] == system_value:
-                index_systems.append(index)
-                self.logger.debug(f"Found system role at index {index}: {pformat(message, width=250)}")
-        if len(index_systems) > 0:
-            system_element: Dict = messages.pop(index_systems[0])
-            messages.insert(0, system_element)
-            if len(index_systems) > 1:
-                system_element = messages[0]
-                for index_to_move in index_systems[1:]:
-                    additional_system_element = messages.pop(index_to_move)
-                    for key, value in additional_system_element.items():
-                        if key == role_key: continue
-                        if key in system_element:
-                            self.log.info(f"Extending {system_element[key]}\nwith\n{value}")
-                            system_element[key] += '\n' + value
-        
-        self.logger.debug(f"**** Merged system roles to the begining: \n{pformat(messages, width=250)}")
-                    
-        # Now club messages together which are following each other and have the same role
-        for index, message in enumerate(messages):
-            if role_key in message:
-                if message[role_key] == previous_role_name:
-                    for key, value in message.items():
-                        last_message: Dict = optimized_messages[-1]
-                        if key != role_key:
-                            if key in last_message: last_message[key] += '\n' + message[key]
-                            else: last_message[key] = message[key]
+        for message in messages:
+            if role_key not in message:
+                self.logger.error(f"Message {pformat(message)} does snot have any role {role_key}!")
+                continue
+            cleaned_message: Dict = { key: self.__clean_value(value) for key, value in message.items() }
+            if message[role_key] == 'system':
+                if system_message is None:
+                    system_message = cleaned_message
                 else:
-                    previous_role_name = message[role_key]
-                    optimized_messages.append(message)
+                    self.__merge_message(system_message, cleaned_message, False)
+            elif len(optimized_messages) > 0 and optimized_messages[-1][role_key] == message[role_key]:
+                self.__merge_message(optimized_messages[-1], cleaned_message, True)
             else:
-                self.logger.error(f"Message {pformat(message)} does snot have any role {role_key}!")
+                optimized_messages.append(cleaned_message)
+        return ([system_message] if system_message is not None else []) + optimized_messages
 
-        self.logger.debug(f"Merged all same roles together: {pformat(optimized_messages, width=250)}")
-        # Clean content of messages
-        reformatted_request_messages: List = []
-        for message in optimized_messages:
-            reformatted_message: dict = {}
-            for key, value in message.items():
-                if isinstance(value, str):
-                    # TODO, use https://pypi.org/project/Unidecode/ instead
-                    value = value.replace(r"\\u2019", "'").replace(r'\\u[\da-f]{4}', ' ')
-                reformatted_message[key] = value
-            reformatted_request_messages.append(reformatted_message)
-        self.logger.debug(f"**** Removed string problems:\ndebug{pformat(reformatted_request_messages, width=250)}")
-
-        return reformatted_request_messages
 # Checkout: https://stackoverflow.com/questions/78084538/openai-assistants-api-how-do-i-upload-a-file-and-use-it-as-a-knowledge-base
-    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> str: 
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> str: 
         #pprint(self.slide_content)
         #pprint(request)
-        return_message: str = None
+        model_name = model_name if model_name is not None else self.model_name
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f'\nRequesting LLm with:\n{"-" * 20}\n  Model: {model_name},  Request name {request_name} '+\
+                              f'\n  request JSON Dumped:\n  {"-" * 20}\n{json.dumps(messages, sort_keys=True, indent=2, separators=(",", ": "))}'+\
+                              f'\n  request NON JSON Dumped:\n  {"-" * 24}:\n{messages}')
+        endpoint: Endpoint = self.endpoint_pool.acquire() if self.endpoint_pool is not None else None
+        client: OpenAI = endpoint.client if endpoint is not None else self.client
+        start_time: float = time.monotonic()
+        try:
+            if self.stream_output is not None:
+                response: Dict = self._send_streamed_request(client, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+            else:
+                response: Dict = self._send_completion_request(client, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        except Exception as err:
+            if endpoint is not None:
+                self.endpoint_pool.release(endpoint, err=err)
+            raise
+        if endpoint is not None:
+            self.endpoint_pool.release(endpoint, time.monotonic() - start_time)
+            response['endpoint'] = endpoint.name
+        return response
 
-        self.logger.debug(f'\nRequesting LLm with:\n{"-" * 20}\n  Model: {self.model_name},  Request name {request_name} '+\
-                         f'\n  request JSON Dumped:\n  {"-" * 20}\n{json.dumps(messages, sort_keys=True, indent=2, separators=(",", ": "))}'+\
-                         f'\n  request NON JSON Dumped:\n  {"-" * 24}:\n{messages}')
-        review = self.client.chat.completions.create(
-            model=self.model_name,
+    def _send_request_plain_timed(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        start_time: float = time.monotonic()
+        response: Dict = self._send_request_plain(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        self.hedging_policy.record_latency(request_name, time.monotonic() - start_time)
+        return response
+
+    def close(self) -> None:
+        # Losing hedged calls cannot be interrupted: they complete in the background
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False)
+
+    def _send_request_hedged(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        if self.hedging_policy is None:
+            return self._send_request_plain(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        hedge_delay: float = self.hedging_policy.get_hedge_delay(request_name)
+        if hedge_delay is None:
+            return self._send_request_plain_timed(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        primary: Future = self.hedge_executor.submit(self._send_request_plain_timed, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if len(done) > 0:
+            return primary.result()
+        if self.in_flight_semaphore is not None and not self.in_flight_semaphore.acquire(blocking=False):
+            return primary.result()
+        estimated_tokens: int = self._estimate_prompt_tokens(messages)
+        hedge_allowed, hedge_reservation = self._try_acquire_hedge(request_name, model_name, estimated_tokens, max_tokens)
+        if not hedge_allowed:
+            self.__release_in_flight_slot()
+            return primary.result()
+        # The endpoint pool routes the duplicate to the least loaded endpoint, hence usually not the one of the slow call
+        self.logger.info(f"{request_name}: No answer after {hedge_delay:.2f} s, sending a hedged duplicate.")
+        hedge: Future = self.hedge_executor.submit(self._send_request_plain_timed, messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        pending: set = {primary, hedge}
+        winner: Future = None
+        while len(pending) > 0 and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+        if winner is None:
+            self.__settle_hedge_loser(hedge_reservation, model_name, estimated_tokens, None)
+            return primary.result()
+        if winner is hedge:
+            self.hedging_policy.record_hedge_won()
+        # A blocking call cannot be interrupted: the slower one completes in the background, holding the extra slot until then,
+        # and its usage is charged once known. The answer of the faster one is charged by the caller.
+        loser: Future = primary if winner is hedge else hedge
+        if loser.cancel() and loser is hedge:
+            self.hedging_policy.cancel_hedge()
+        loser.add_done_callback(lambda future: self.__settle_hedge_loser(hedge_reservation, model_name, estimated_tokens, \
+                                                                         future.result() if not future.cancelled() and future.exception() is None else None))
+        return winner.result()
+
+    def _try_acquire_hedge(self, request_name: str, model_name: str, estimated_tokens: int, max_tokens: int) -> Tuple[bool, Dict]:
+        # A duplicate is only worth sending at once: not when it would exceed the budget or wait for the rate limiter
+        if not self.hedging_policy.try_acquire_hedge():
+            return False, None
+        reservation: Dict = None
+        if self.budget is not None:
+            reservation = self.budget.try_reserve(model_name, estimated_tokens, max_tokens)
+            if reservation is None:
+                self.hedging_policy.cancel_hedge()
+                return False, None
+        if self.rate_limiter is not None and not self.rate_limiter.try_acquire(estimated_tokens):
+            self._settle_budget(reservation, model_name, None)
+            self.hedging_policy.cancel_hedge()
+            return False, None
+        return True, reservation
+
+    def _charge_hedge_loser(self, reservation: Dict, model_name: str, estimated_tokens: int, response: Dict) -> None:
+        self._settle_budget(reservation, model_name, response)
+        if response is not None:
+            self._record_usage(estimated_tokens, response)
+            self._account_usage(response)
+
+    def __settle_hedge_loser(self, reservation: Dict, model_name: str, estimated_tokens: int, response: Dict) -> None:
+        self._charge_hedge_loser(reservation, model_name, estimated_tokens, response)
+        self.__release_in_flight_slot()
+
+    def __release_in_flight_slot(self) -> None:
+        if self.in_flight_semaphore is not None:
+            self.in_flight_semaphore.release()
+
+    def _get_max_tokens_parameter(self, max_tokens: int) -> any:
+        return max_tokens if max_tokens is not None else NOT_GIVEN
+
+    def _send_completion_request(self, client: OpenAI, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        raw_review = client.chat.completions.with_raw_response.create(
+            model=model_name,
+            messages=messages,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=self._get_max_tokens_parameter(max_tokens),
+            timeout=self.retry_policy.get_timeout()
+        )
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(raw_review.headers)
+        review = raw_review.parse()
+
+        return self._review_to_response(review, messages, request_name, temperature, top_p, post_request_name)
+
+    def _send_streamed_request(self, client: OpenAI, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        stream_state: Dict = self._start_stream()
+        raw_stream = client.chat.completions.with_raw_response.create(
+            model=model_name,
             messages=messages,
             temperature=temperature,
-            top_p=top_p
+            top_p=top_p,
+            max_tokens=self._get_max_tokens_parameter(max_tokens),
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=self.retry_policy.get_timeout()
         )
+        if self.rate_limiter is not None:
+            self.rate_limiter.update_from_headers(raw_stream.headers)
+        for chunk in raw_stream.parse():
+            self._consume_stream_chunk(stream_state, chunk, request_name)
+        return self._stream_to_response(stream_state, messages, request_name, temperature, top_p, post_request_name)
+
+    def _start_stream(self) -> Dict:
+        return {'start_time': time.monotonic(), 'first_token_time': None, 'parts': [], 'usage': None}
 
-        return_message = re.sub(r'\'\s+.*refusal=.*,.*role=.*\)', '', re.sub(r'ChatCompletionMessage\(content=', '', str(review.choices[0].message.content.strip())))
+    def _consume_stream_chunk(self, stream_state: Dict, chunk: any, request_name: str) -> None:
+        if getattr(chunk, 'usage', None) is not None:
+            stream_state['usage'] = chunk.usage
+        for choice in chunk.choices:
+            delta: str = choice.delta.content if choice.delta is not None else None
+            if delta:
+                if stream_state['first_token_time'] is None:
+                    stream_state['first_token_time'] = time.monotonic()
+                stream_state['parts'].append(delta)
+                self.stream_output.document_stream(request_name, delta)
+
+    def _stream_to_response(self, stream_state: Dict, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> Dict:
+        end_time: float = time.monotonic()
+        self.stream_output.document_stream(request_name, None)
+        content: str = "".join(stream_state['parts'])
+        response: Dict = self._content_to_response(content, stream_state['usage'], messages, request_name, temperature, top_p, post_request_name)
+        first_token_time: float = stream_state['first_token_time'] if stream_state['first_token_time'] is not None else end_time
+        completion_tokens: float = response['usage']['completion_tokens'] if 'usage' in response else self.llm_utils.get_number_tokens(content)
+        generation_time: float = end_time - first_token_time
+        response['time_to_first_token'] = first_token_time - stream_state['start_time']
+        response['tokens_per_second'] = completion_tokens / generation_time if generation_time > 0 else None
+        self.logger.info(f"{request_name}: Time to first token {response['time_to_first_token']:.2f} s, " + \
+                         (f"{response['tokens_per_second']:.1f} tokens/s" if response['tokens_per_second'] is not None else "tokens/s not measurable"))
+        return response
+
+    def _review_to_response(self, review: any, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> Dict:
+        return self._content_to_response(review.choices[0].message.content, getattr(review, 'usage', None), messages, request_name, temperature, top_p, post_request_name)
+
+    def _content_to_response(self, content: str, usage: any, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> Dict:
+        return_message: str = re.sub(r'\'\s+.*refusal=.*,.*role=.*\)', '', re.sub(r'ChatCompletionMessage\(content=', '', str(content.strip())))
         formatted_response = "\n".join([ "  " + message for message in return_message.split("\n")])
         self.logger.info(f'\nRequest:\n{"-" * 13}\n{pformat(messages, width=250)}')
         self.logger.info(f'\nLLm response:\n{"-" * 13}\n{formatted_response}')
 
-        return {
+        response: Dict = {
             'request_name': request_name,
             'response': return_message,
             'temperature': temperature,
             'top_p': top_p,
             'post_request_name': post_request_name
         }
+        if usage is not None:
+            prompt_tokens_details = getattr(usage, 'prompt_tokens_details', None)
+            response['usage'] = {
+                'prompt_tokens': usage.prompt_tokens,
+                'completion_tokens': usage.completion_tokens,
+                'total_tokens': usage.total_tokens,
+                'cached_tokens': (prompt_tokens_details.cached_tokens or 0) if prompt_tokens_details is not None else 0
+            }
+        return response
+
+    def _account_usage(self, response: Dict) -> None:
+        if self.prefix_cache_layout and 'usage' in response:
+            with self.usage_lock:
+                self.prompt_tokens_total += response['usage']['prompt_tokens']
+                self.cached_tokens_total += response['usage']['cached_tokens']
+
+    def get_prefix_cache_statistics_str(self) -> str:
+        cached_ratio: float = self.cached_tokens_total * 100.0 / self.prompt_tokens_total if self.prompt_tokens_total > 0 else 0
+        return f"Prefix cache: {self.cached_tokens_total} of {self.prompt_tokens_total} prompt tokens served from the provider cache ({cached_ratio:.1f}%)"
+
+    def _send_warm_up_completion(self, messages: List, model_name: str) -> Dict:
+        endpoint: Endpoint = self.endpoint_pool.acquire() if self.endpoint_pool is not None else None
+        try:
+            review = (endpoint.client if endpoint is not None else self.client).chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_tokens=1,
+                timeout=self.retry_policy.get_timeout()
+            )
+        finally:
+            if endpoint is not None:
+                self.endpoint_pool.release(endpoint)
+        return self._content_to_response("", getattr(review, 'usage', None), messages, self.PREFIX_WARM_UP_REQUEST_NAME, None, None, None)
+
+    def __send_warm_up_bounded(self, messages: List, model_name: str, estimated_tokens: int) -> Dict:
+        if self.in_flight_semaphore is None:
+            return self.__send_warm_up_rate_limited(messages, model_name, estimated_tokens)
+        with self.in_flight_semaphore:
+            return self.__send_warm_up_rate_limited(messages, model_name, estimated_tokens)
+
+    def __send_warm_up_rate_limited(self, messages: List, model_name: str, estimated_tokens: int) -> Dict:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimated_tokens)
+        return self._send_warm_up_completion(messages, model_name)
+
+    def _send_prefix_warm_up(self, reviewer: str, content: str, requires_format_description: bool, model_name: str = None, error_information: str = None) -> None:
+        # One single token completion on the shared prefix so that the following requests hit the provider cache
+        if not (self.prefix_cache_layout and self.prefix_cache_warm_up):
+            return
+        model_name = model_name if model_name is not None else self.model_name
+        messages: List = self._reformat_messages(self._create_message([], reviewer, content, requires_format_description))
+        estimated_tokens: int = self._estimate_prompt_tokens(messages)
+        # The warm up is a full prompt, charged like any call. Being optional, it is skipped rather than stopping the review
+        reservation: Dict = None
+        if self.budget is not None:
+            reservation = self.budget.try_reserve(model_name, estimated_tokens, 1)
+            if reservation is None:
+                self.logger.info(f"{self.PREFIX_WARM_UP_REQUEST_NAME}: Not sent, it would exceed the budget.")
+                return
+        response: Dict = None
+        try:
+            start_time: float = time.monotonic()
+            self._before_call()
+            response = self.__send_warm_up_bounded(messages, model_name, estimated_tokens)
+            self._after_call_success()
+            self._add_call_statistics(response, start_time, 0, model_name)
+            self._record_usage(estimated_tokens, response)
+            self._account_usage(response)
+            self._record_run_report(response, error_information)
+        except Exception as err:
+            self._after_call_failure(err)
+            self.logger.warning(f"{self.PREFIX_WARM_UP_REQUEST_NAME}: Caught exception {err=}, continuing without warm up.")
+        finally:
+            self._settle_budget(reservation, model_name, response)
+
+    def _estimate_prompt_tokens(self, messages: List) -> int:
+        return int(sum(self.llm_utils.get_number_tokens(message['content']) for message in messages if isinstance(message.get('content'), str)))
+
+    def _record_usage(self, estimated_tokens: int, response: Dict) -> None:
+        if self.rate_limiter is not None and 'usage' in response:
+            self.rate_limiter.record_usage(estimated_tokens, response['usage']['total_tokens'])
+
+    def _handle_send_error(self, err: Exception, error_information: str, request_name: str, messages: List, attempt: int, delay: float) -> float:
+        error_class: str = self.retry_policy.classify(err)
+        self.logger.warning(f"{error_information}: {request_name}: Attempt {attempt} / {self.retry_policy.max_attempts}: Caught exception {err=}, {type(err)=} ({error_class})\nMessage: {pformat(messages, width=150)}")
+        if self.stream_output is not None:
+            self.stream_output.discard_stream(request_name, f"Attempt {attempt} failed ({type(err).__name__})")
+        self._after_call_failure(err)
+        exhausted: bool = self.retry_policy.is_exhausted(attempt)
+        # Some OpenAI compatible proxies answer requests too big with internal errors: once retries are exhausted, splitting is the last resort
+        if error_class == RetryPolicy.CONTEXT_OVERFLOW or (exhausted and isinstance(err, InternalServerError)):
+            self.logger.error(f"{request_name}: It seems your request is too big or an internal error occured.")
+            raise ContextWindowExceededError(f"{request_name}: It seems your request is too big or an internal error occured.") from err
+        if error_class == RetryPolicy.FATAL:
+            self.logger.error(f"{request_name}: Error {type(err).__name__} is not transient, not retrying.")
+            raise err
+        if exhausted:
+            self.logger.error(f"{request_name}: Giving up after {attempt} attempts.")
+            raise err
+        if isinstance(err, CircuitOpenError):
+            # No call is let through before the circuit may close again
+            retry_after: float = err.retry_after
+        else:
+            retry_after: float = RateLimiter.get_retry_after(getattr(getattr(err, 'response', None), 'headers', None))
+            if retry_after is not None:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(retry_after)
+                self.logger.warning(f"{request_name}: Provider asked to retry after {retry_after} seconds.")
+        delay = self.retry_policy.next_delay(delay, retry_after)
+        self.logger.warning(f"{request_name}: Backoff retry: Sleeping {delay:.2f} seconds.")
+        return delay
+
+    def _before_call(self) -> None:
+        # With an endpoint pool, failing endpoints are taken out of rotation by the pool itself
+        if self.endpoint_pool is None:
+            self.retry_policy.circuit_breaker.before_call()
+
+    def _after_call_success(self) -> None:
+        if self.endpoint_pool is None:
+            self.retry_policy.circuit_breaker.record_success()
+
+    def _after_call_failure(self, err: Exception) -> None:
+        if self.endpoint_pool is not None or isinstance(err, CircuitOpenError):
+            return
+        if EndpointPool.is_endpoint_failure(err):
+            if self.retry_policy.circuit_breaker.record_failure():
+                self.logger.error(f"Circuit breaker opened: LLM calls fail fast for {self.retry_policy.circuit_breaker.reset_timeout} seconds.")
+        else:
+            # The endpoint answered, even if with an error: a trial call of a half open circuit is over
+            self.retry_policy.circuit_breaker.release_probe()
+
+    def _get_cached_response(self, request_key: str, request_name: str, temperature: float, top_p: float, post_request_name: str) -> Dict:
+        if self.response_cache is None:
+            return None
+        cached_response: str = self.response_cache.get(request_key)
+        if cached_response is None:
+            return None
+        self.logger.info(f"{request_name}: Response served from cache.")
+        return {
+            'request_name': request_name,
+            'response': cached_response,
+            'temperature': temperature,
+            'top_p': top_p,
+            'post_request_name': post_request_name,
+            'from_cache': True
+        }
 
-    def _send_request(self, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str) -> str:
-        openai_response: bool = False
-        sleep_time: int = 10
-        response: Dict = {}
-
-        while not openai_response:
-            try:
-                reformatted_request_messages: List = self._reformat_messages(messages)
-                response = self._send_request_plain(reformatted_request_messages, request_name, temperature, top_p, post_request_name)
-                openai_response = True
-            except Exception as err:                    
-                self.logger.warning(f"{error_information}: {request_name}: Caught exception {err=}, {type(err)=}\nMessage: {pformat(reformatted_request_messages, width=150)}")
-                if "ContextWindowExceededError" in str(err) or "openai.InternalServerError" in str(err):
-                    self.logger.error(f"{request_name}: It seems your request is too big or an internal error occured.")
-                    raise ContextWindowExceededError(f"{request_name}: It seems your request is too big or an internal error occured.")
-                self.logger.warning(f"{request_name}: Backoff retry: Sleeping {sleep_time} seconds.")
-                time.sleep(sleep_time)
-                if sleep_time < 30:
-                    sleep_time = sleep_time * 2
+    def _store_cached_response(self, request_key: str, response: Dict) -> None:
+        # Placeholders (requests pending in a batch) are not answers and are never cached
+        if self.response_cache is not None and not response.get('placeholder', False):
+            self.response_cache.put(request_key, response['response'])
+
+    def _add_call_statistics(self, response: Dict, start_time: float, retries: int, model_name: str) -> None:
+        # Latency includes rate limiting waits and backoffs: it is what the document processing experiences
+        response['latency'] = time.monotonic() - start_time
+        response['retries'] = retries
+        response['model'] = model_name
+
+    def _record_cassette(self, request_key: str, response: Dict) -> None:
+        if self.cassette_recorder is not None and not response.get('placeholder', False):
+            self.cassette_recorder.record(request_key, response)
+
+    def _record_run_report(self, response: Dict, error_information: str) -> None:
+        if self.run_report is not None:
+            self.run_report.record(response, error_information, self.model_name)
+
+    def _reserve_budget(self, request_name: str, model_name: str, estimated_tokens: int, max_tokens: int) -> Dict:
+        # Checked once per call, not per attempt: a refused call is not retried
+        return self.budget.reserve(request_name, model_name, estimated_tokens, max_tokens) if self.budget is not None else None
+
+    def _settle_budget(self, reservation: Dict, model_name: str, response: Dict) -> None:
+        if reservation is not None:
+            self.budget.settle(reservation, model_name, response)
+
+    def _send_request_with_retries(self, request_key: str, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        response: Dict = None
+        delay: float = self.retry_policy.base_delay
+        start_time: float = time.monotonic()
+        attempt: int = 0
+
+        estimated_tokens: int = self._estimate_prompt_tokens(messages)
+        reservation: Dict = self._reserve_budget(request_name, model_name, estimated_tokens, max_tokens)
+        try:
+            while response is None:
+                attempt += 1
+                try:
+                    self._before_call()
+                    response = self._send_request_bounded(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens, estimated_tokens)
+                    self._after_call_success()
+                except Exception as err:                    
+                    delay = self._handle_send_error(err, error_information, request_name, messages, attempt, delay)
+                    time.sleep(delay)
+        finally:
+            self._settle_budget(reservation, model_name, response)
+        self._add_call_statistics(response, start_time, attempt - 1, model_name)
+        self._record_usage(estimated_tokens, response)
+        self._account_usage(response)
+        self._store_cached_response(request_key, response)
         return response
-    
-    
+
+    def _send_request_to_model(self, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        reformatted_request_messages: List = self._reformat_messages(messages)
+        request_key: str = ResponseCache.compute_key(model_name, reformatted_request_messages, temperature, top_p, max_tokens)
+        response: Dict = self._get_cached_response(request_key, request_name, temperature, top_p, post_request_name)
+        if response is None:
+            if self.single_flight is None:
+                response = self._send_request_with_retries(request_key, reformatted_request_messages, error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+            else:
+                response = self.single_flight.do(request_key, lambda: self._send_request_with_retries(request_key, reformatted_request_messages, \
+                                                                                                      error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens))
+                # A coalesced response was produced for another caller: it carries this caller's names
+                response = dict(response, request_name=request_name, post_request_name=post_request_name)
+        response['model'] = model_name
+        self._record_cassette(request_key, response)
+        self._record_run_report(response, error_information)
+        return response
+
+    def _send_request(self, messages: List, error_information: str, request_name: str, temperature: float, top_p: float, post_request_name: str, \
+                      model_name: str = None, max_tokens: int = None, fallback_model: str = None) -> str:
+        model_name = model_name if model_name is not None else self.model_name
+        try:
+            return self._send_request_to_model(messages, error_information, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        except ContextWindowExceededError:
+            if fallback_model is None or fallback_model == model_name:
+                raise
+            self.logger.warning(f"{request_name}: Request too big for model {model_name}, sending it to fallback model {fallback_model}.")
+        return self._send_request_to_model(messages, error_information, request_name, temperature, top_p, post_request_name, fallback_model, max_tokens)
+
+    def _get_model_group(self, request_input: Dict) -> tuple:
+        return (request_input.get('model'), request_input.get('max_tokens'), request_input.get('fallback_model'))
+
+    def _group_by_model(self, request_inputs: List) -> List:
+        # Requests are only grouped in one prompt when they go to the same model with the same settings
+        groups: Dict = {}
+        for request_input in request_inputs:
+            groups.setdefault(self._get_model_group(request_input), []).append(request_input)
+        return list(groups.items())
+
     def _prepare_and_send_requests(self, request_inputs: List) -> List:
         return_value: List = []
-        slide_contents_str: str = request_inputs[0]['slide_contents_str'] if len(request_inputs) > 0 else None
-        error_information: str = request_inputs[0]['error_information'] if len(request_inputs) > 0 else None
-        post_request_name: str = request_inputs[0]['post_request_name'] if len(request_inputs) > 0 else None
-        requires_format_description: bool = request_inputs[0]['requires_format_description'] == '1' if len(request_inputs) > 0 else None
-
-        llm_requests, request_names, avg_temperature, avg_top_p = self._create_messages(request_inputs, slide_contents_str, requires_format_description)
-        return_value.append(self._send_request(llm_requests, \
-                                                error_information, \
-                                                " & ".join(request_names),
-                                                avg_temperature, avg_top_p,
-                                                post_request_name))
+        for (model_name, max_tokens, fallback_model), group_request_inputs in self._group_by_model(request_inputs):
+            slide_contents_str: str = group_request_inputs[0]['slide_contents_str']
+            error_information: str = group_request_inputs[0]['error_information']
+            post_request_name: str = group_request_inputs[0]['post_request_name']
+            requires_format_description: bool = group_request_inputs[0]['requires_format_description'] == '1'
+
+            llm_requests, request_names, avg_temperature, avg_top_p = self._create_messages(group_request_inputs, slide_contents_str, requires_format_description)
+            return_value.append(self._send_request(llm_requests, \
+                                                    error_information, \
+                                                    " & ".join(request_names),
+                                                    avg_temperature, avg_top_p,
+                                                    post_request_name,
+                                                    model_name, max_tokens, fallback_model))
         return return_value
     
-
-
-
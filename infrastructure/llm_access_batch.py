@@ -0,0 +1,43 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict
+
+from infrastructure.llm_access import LLMAccess
+from infrastructure.response_cache import ResponseCache
+from infrastructure.batch_file import BatchExportFile, BatchResults
+
+class LLMAccessBatchExport(LLMAccess):
+    batch_export_file: BatchExportFile = None
+
+    def set_batch_export_file(self, batch_export_file: BatchExportFile) -> None:
+        self.batch_export_file = batch_export_file
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> Dict: 
+        model_name = model_name if model_name is not None else self.model_name
+        custom_id: str = None
+        if self.batch_export_file is not None:
+            custom_id = self.batch_export_file.write(ResponseCache.compute_key(model_name, messages, temperature, top_p, max_tokens), model_name, messages, temperature, top_p, max_tokens)
+        return {
+            'request_name': request_name,
+            'response': f"# Request pending in batch\nRequest exported with custom_id {custom_id}, import the batch results to get the response." if custom_id is not None else \
+                        f"# Request pending in batch\nNo batch result found for this request.",
+            'temperature': temperature,
+            'top_p': top_p,
+            'post_request_name': post_request_name,
+            'placeholder': True
+        }
+
+class LLMAccessBatchImport(LLMAccessBatchExport):
+    batch_results: BatchResults = None
+
+    def set_batch_results(self, batch_results: BatchResults) -> None:
+        self.batch_results = batch_results
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> Dict: 
+        model_name = model_name if model_name is not None else self.model_name
+        review = self.batch_results.get_review(BatchExportFile.get_custom_id(ResponseCache.compute_key(model_name, messages, temperature, top_p, max_tokens)))
+        if review is None:
+            # Typically post requests of freshly imported responses: they go to the next batch if one is exported
+            return super()._send_request_plain(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        return self._review_to_response(review, messages, request_name, temperature, top_p, post_request_name)
@@ -1,41 +1,78 @@
-
 """
 @author Jean-Philippe Ulpiano
 """
 from typing import List, Dict
-import os
 from concurrent.futures import ThreadPoolExecutor
 from infrastructure.llm_access import LLMAccess
+from infrastructure.response_cache import ResponseCache
 from pprint import pformat
+import threading
 
 class LLMAccessDetailed(LLMAccess):
-    def __send_request_thread(self, request_input: Dict) -> str:
+    requests_executor: ThreadPoolExecutor = None
+    requests_executor_lock: threading.Lock = threading.Lock()
+
+    def __get_requests_executor(self) -> ThreadPoolExecutor:
+        # One pool for the requests of all chunks: chunks reviewed concurrently share its workers instead of each starting its own
+        with self.requests_executor_lock:
+            if self.requests_executor is None:
+                self.requests_executor = ThreadPoolExecutor(max_workers=self.get_number_workers(), thread_name_prefix="doc2llm-request")
+            return self.requests_executor
+
+    def close(self) -> None:
+        if self.requests_executor is not None:
+            self.requests_executor.shutdown()
+        super().close()
+
+    def _get_requests_tokens(self, requests: List) -> int:
+        # Each request is sent on its own: only the biggest one matters
+        return max([ self.llm_utils.get_number_tokens(self._get_request_text(request)) for request in requests ], default=0)
+
+    def _create_request_messages(self, request_input: Dict) -> List:
         requires_format_description: bool = request_input['requires_format_description'] == '1'
 
         llm_requests: List = [{"role": "user", 
                                "content": self._get_request_llm_to_string(request_input)}]
-        llm_requests = self._create_message(llm_requests, request_input['reviewer'], request_input['slide_contents_str'], requires_format_description) 
-        return self._send_request(llm_requests, \
+        return self._create_message(llm_requests, request_input['reviewer'], request_input['slide_contents_str'], requires_format_description) 
+
+    def __send_request_thread(self, request_input: Dict) -> str:
+        return self._send_request(self._create_request_messages(request_input), \
                                   request_input['error_information'], \
                                   request_input["request_name"],\
                                   request_input['temperature'], \
                                   request_input['top_p'], \
-                                  request_input['post_request_name'])
+                                  request_input['post_request_name'], \
+                                  request_input.get('model'), \
+                                  request_input.get('max_tokens'), \
+                                  request_input.get('fallback_model'))
     
+    def __is_cached(self, request_input: Dict) -> bool:
+        if self.response_cache is None:
+            return False
+        model_name: str = request_input.get('model') if request_input.get('model') is not None else self.model_name
+        request_key: str = ResponseCache.compute_key(model_name, self._reformat_messages(self._create_request_messages(request_input)), \
+                                                     request_input['temperature'], request_input['top_p'], request_input.get('max_tokens'))
+        return self.response_cache.contains(request_key)
+
+    def _warm_up_shared_prefix(self, request_inputs: List) -> None:
+        if not (self.prefix_cache_layout and self.prefix_cache_warm_up):
+            return
+        # The provider cache is per model: warm up each model receiving several requests.
+        # Requests answered by the response cache never reach the provider
+        requests_per_model: Dict = {}
+        for request_input in [ request_input for request_input in request_inputs if not self.__is_cached(request_input) ]:
+            requests_per_model.setdefault(request_input.get('model'), []).append(request_input)
+        for model_name, model_request_inputs in requests_per_model.items():
+            if len(model_request_inputs) > 1:
+                self._send_prefix_warm_up(model_request_inputs[0]['reviewer'], model_request_inputs[0]['slide_contents_str'], \
+                                          model_request_inputs[0]['requires_format_description'] == '1', model_name, model_request_inputs[0]['error_information'])
+
     def _prepare_and_send_requests( self, request_inputs: List):
-        return_value: List = []
-        number_processed_requests: int = 0
-        while number_processed_requests < len(request_inputs):
-            responses: List = []
-            nb_workers: str = os.getenv("DOC2LLM_REQUESTS_NB_WORKERS", default="1")
-            max_workers: int = max(int(nb_workers if nb_workers.isdigit() else "1"), 1)
-            number_batch_requests: int = min(len(request_inputs) - number_processed_requests, max_workers)
-            sub_request_inputs: List = request_inputs[number_processed_requests : number_processed_requests + number_batch_requests]
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                responses = list(executor.map(self.__send_request_thread, sub_request_inputs))
-
-            for response in responses:
-                response["request_name"] += self.checker.get_separator_information() 
-                return_value.append(response)
-            number_processed_requests += number_batch_requests
-        return return_value
\ No newline at end of file
+        self._warm_up_shared_prefix(request_inputs)
+        # A single pool for all requests: a worker picks the next request as soon as it is free
+        # instead of waiting for the slowest request of a batch. map() keeps the original order.
+        responses: List = list(self.__get_requests_executor().map(self.__send_request_thread, request_inputs))
+
+        for response in responses:
+            response["request_name"] += self.checker.get_separator_information() 
+        return responses
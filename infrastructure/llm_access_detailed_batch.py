@@ -0,0 +1,11 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from infrastructure.llm_access_detailed import LLMAccessDetailed
+from infrastructure.llm_access_batch import LLMAccessBatchExport, LLMAccessBatchImport
+
+class LLMAccessDetailedBatchExport(LLMAccessDetailed, LLMAccessBatchExport):
+    pass
+
+class LLMAccessDetailedBatchImport(LLMAccessDetailed, LLMAccessBatchImport):
+    pass
@@ -0,0 +1,8 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from infrastructure.llm_access_detailed import LLMAccessDetailed
+from infrastructure.llm_access_plan import LLMAccessPlan
+
+class LLMAccessDetailedPlan(LLMAccessDetailed, LLMAccessPlan):
+    pass
@@ -0,0 +1,18 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict
+import asyncio
+
+from infrastructure.llm_access_detailed import LLMAccessDetailed
+from infrastructure.async_llm_access import AsyncLLMAccess
+from infrastructure.llm_access_replay import LLMAccessReplay
+
+class LLMAccessDetailedReplay(LLMAccessDetailed, LLMAccessReplay):
+    pass
+
+class AsyncLLMAccessReplay(AsyncLLMAccess, LLMAccessReplay):
+    async def _send_request_plain_async(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        response, latency = self._get_recorded_response(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        await asyncio.sleep(latency)
+        return response
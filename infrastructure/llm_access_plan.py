@@ -0,0 +1,41 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict
+
+from infrastructure.llm_access import LLMAccess
+from domain.model_profiles import ModelProfiles
+
+class LLMAccessPlan(LLMAccess):
+    """
+    @brief Plans a review without calling the LLM: each request is answered with its prompt tokens, the completion
+    tokens and the latency expected from the model profile. The answer is padded to the expected completion size so
+    that the post requests processing it are planned with a realistic prompt as well.
+    """
+    def _get_planned_response(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> Dict:
+        model_name = model_name if model_name is not None else self.model_name
+        model_profiles: ModelProfiles = self.model_profiles if self.model_profiles is not None else ModelProfiles()
+        prompt_tokens: int = self._estimate_prompt_tokens(messages)
+        completion_tokens: int = model_profiles.get_expected_completion_tokens(model_name, max_tokens)
+        latency: float = model_profiles.get_expected_latency(model_name, completion_tokens)
+        return {
+            'request_name': request_name,
+            'response': f"# Planned request, not sent\n{prompt_tokens} prompt tokens, about {completion_tokens} completion tokens in {latency:.1f} s expected.\n" + \
+                        f"<!--{' x' * completion_tokens} -->",
+            'temperature': temperature,
+            'top_p': top_p,
+            'post_request_name': post_request_name,
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens, 'cached_tokens': 0},
+            'planned_latency': latency
+        }
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> Dict:
+        return self._get_planned_response(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+
+    def _send_warm_up_completion(self, messages: List, model_name: str) -> Dict:
+        return self._get_planned_response(messages, self.PREFIX_WARM_UP_REQUEST_NAME, None, None, None, model_name, 1)
+
+    def _add_call_statistics(self, response: Dict, start_time: float, retries: int, model_name: str) -> None:
+        super()._add_call_statistics(response, start_time, retries, model_name)
+        # The run report aggregates the expected latencies instead of the time taken to plan
+        response['latency'] = response['planned_latency']
@@ -0,0 +1,44 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict
+import time
+
+from infrastructure.llm_access import LLMAccess
+from infrastructure.response_cache import ResponseCache
+from infrastructure.cassette import Cassette
+
+class LLMAccessReplay(LLMAccess):
+    """
+    @brief Serves the responses recorded in a cassette instead of calling the LLM, waiting for the recorded
+    latency multiplied by latency_scale (0 answers immediately).
+    """
+    cassette: Cassette = None
+    latency_scale: float = 1.0
+
+    def set_cassette(self, cassette: Cassette, latency_scale: float) -> None:
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+
+    def _get_recorded_response(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str, max_tokens: int) -> tuple:
+        model_name = model_name if model_name is not None else self.model_name
+        entry: Dict = self.cassette.get(ResponseCache.compute_key(model_name, messages, temperature, top_p, max_tokens))
+        response: Dict = {
+            'request_name': request_name,
+            'response': entry['response'] if entry is not None else "# Request not recorded\nNo response found in the cassette for this request.",
+            'temperature': temperature,
+            'top_p': top_p,
+            'post_request_name': post_request_name
+        }
+        if entry is None:
+            self.logger.warning(f"{request_name}: No response recorded in the cassette.")
+            response['placeholder'] = True
+            return response, 0
+        if entry.get('usage') is not None:
+            response['usage'] = entry['usage']
+        return response, entry.get('latency', 0) * self.latency_scale
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> Dict:
+        response, latency = self._get_recorded_response(messages, request_name, temperature, top_p, post_request_name, model_name, max_tokens)
+        time.sleep(latency)
+        return response
@@ -8,7 +8,7 @@ from infrastructure.llm_access import LLMAccess
 
 class LLMAccessSimulateCalls(LLMAccess):
 
-    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str) -> str: 
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> str: 
 
         return {
             'request_name': request_name,
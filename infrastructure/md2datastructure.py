@@ -134,6 +134,9 @@ class MDToDatastructure(ADocumentToDatastructure):
     def _document_to_data_structure(self):
         text_for_request: str = ""
         last_text_found: str = ""
+        # Running token counts: chunking stays linear in the document size
+        text_for_request_tokens: float = 0
+        last_text_found_tokens: float = 0
         latest_saved_heading_deepness: int = -1
         paragraphs_to_process: List = []
         paragraph_number:str = self.INIT_PARAGRAPH
@@ -153,23 +156,29 @@ class MDToDatastructure(ADocumentToDatastructure):
                     self.logger.info(f"Paragraph {paragraph_number} being skipped because not expected to be kept as per request.")
                     continue
 
-                if self.llm_utils.get_number_tokens(text_for_request + last_text_found) < self.context_length_source_document and \
+                if text_for_request_tokens + last_text_found_tokens < self.context_length_source_document and \
                    current_heading_deepness > latest_saved_heading_deepness and \
                    current_heading_deepness > self.split_request_per_paragraph_deepness - 1:
                     text_for_request += last_text_found
+                    text_for_request_tokens += last_text_found_tokens
                     last_text_found = ""
+                    last_text_found_tokens = 0
                 elif len(text_for_request) > 0:
                         self.logger.debug(f"Preparing new request for text: {text_for_request}")
                         latest_saved_heading_deepness = current_heading_deepness
                         data_structure = self.__append_to_data_structure(data_structure, text_for_request, paragraphs_to_process, paragraph_number)
                         text_for_request = last_text_found
+                        text_for_request_tokens = last_text_found_tokens
                         last_text_found = ""
+                        last_text_found_tokens = 0
                         paragraphs_to_process = []
                 paragraphs_to_process.append(paragraph_number)
                 last_text_found += line + '\n'
+                last_text_found_tokens += self.llm_utils.get_number_tokens(line + '\n')
                 
             else:
                 last_text_found += line + '\n'
+                last_text_found_tokens += self.llm_utils.get_number_tokens(line + '\n')
                 
         text_for_request += last_text_found
         if len(text_for_request) > 0:
@@ -0,0 +1,194 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict
+import argparse
+import threading
+import random
+import math
+import time
+import json
+from domain.itokenizer import HeuristicTokenizer
+
+class MockLLMServer:
+    """
+    @brief Local OpenAI compatible server answering /v1/chat/completions (streamed or not) with generated text.
+    Time to first token follows a log-normal distribution around its median, generation speed and answer length
+    follow normal distributions. Rate limit (429 with Retry-After) and server errors (500) are injected at the
+    given ratios, prompts bigger than the context window are rejected like OpenAI does.
+    Start it with: python -m infrastructure.mock_llm_server --port 8000, then export OPENAI_BASE_URL=http://127.0.0.1:8000/v1
+    """
+    WORDS: List[str] = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod", "tempor"]
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8000, ttft_median: float = 0.3, ttft_sigma: float = 0.5, \
+                 tokens_per_second: float = 50.0, tokens_per_second_stddev: float = 10.0, output_tokens: int = 150, \
+                 output_tokens_stddev: int = 50, rate_limit_ratio: float = 0.0, server_error_ratio: float = 0.0, \
+                 retry_after: float = 1.0, context_window: int = None, seed: int = None):
+        self.ttft_median = ttft_median
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_second = tokens_per_second
+        self.tokens_per_second_stddev = tokens_per_second_stddev
+        self.output_tokens = output_tokens
+        self.output_tokens_stddev = output_tokens_stddev
+        self.rate_limit_ratio = rate_limit_ratio
+        self.server_error_ratio = server_error_ratio
+        self.retry_after = retry_after
+        self.context_window = context_window
+        self.tokenizer: HeuristicTokenizer = HeuristicTokenizer()
+        self.random: random.Random = random.Random(seed)
+        self.lock: threading.Lock = threading.Lock()
+        self.statistics: Dict[str, int] = {'requests': 0, 'rate_limited': 0, 'server_errors': 0, 'context_overflows': 0}
+        self.http_server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self.__create_handler())
+        self.http_server.daemon_threads = True
+
+    def get_base_url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def serve_forever(self) -> None:
+        self.http_server.serve_forever()
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="doc2llm-mock-llm-server", daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def _count(self, statistic: str) -> None:
+        with self.lock:
+            self.statistics[statistic] += 1
+
+    def _draw(self) -> tuple:
+        # random.Random is not thread safe for reproducible sequences: draw all values of a request at once
+        with self.lock:
+            injected: float = self.random.random()
+            ttft: float = self.random.lognormvariate(math.log(self.ttft_median), self.ttft_sigma) if self.ttft_median > 0 else 0
+            tokens_per_second: float = max(1.0, self.random.gauss(self.tokens_per_second, self.tokens_per_second_stddev))
+            output_tokens: int = max(1, int(self.random.gauss(self.output_tokens, self.output_tokens_stddev)))
+        return injected, ttft, tokens_per_second, output_tokens
+
+    def _get_error(self, injected: float, prompt_tokens: int) -> tuple:
+        if self.context_window is not None and prompt_tokens > self.context_window:
+            self._count('context_overflows')
+            return 400, {'message': f"This model's maximum context length is {self.context_window} tokens. However, your messages resulted in {prompt_tokens} tokens.", \
+                         'type': 'invalid_request_error', 'code': 'context_length_exceeded'}
+        if injected < self.rate_limit_ratio:
+            self._count('rate_limited')
+            return 429, {'message': "Rate limit reached (injected by the mock server).", 'type': 'requests', 'code': 'rate_limit_exceeded'}
+        if injected < self.rate_limit_ratio + self.server_error_ratio:
+            self._count('server_errors')
+            return 500, {'message': "Internal server error (injected by the mock server).", 'type': 'server_error', 'code': None}
+        return None, None
+
+    def _get_answer_tokens(self, messages: List, output_tokens: int) -> List[str]:
+        last_content: str = str(messages[-1].get('content', '')) if len(messages) > 0 else ''
+        tokens: List[str] = ["Mock", "answer", "to:"] + last_content.split()[:10]
+        tokens += [ self.WORDS[index % len(self.WORDS)] for index in range(max(0, output_tokens - len(tokens))) ]
+        return tokens[:output_tokens]
+
+    def get_statistics_str(self) -> str:
+        with self.lock:
+            return ", ".join([ f"{name}: {value}" for name, value in self.statistics.items() ])
+
+    def __create_handler(self) -> type:
+        server: MockLLMServer = self
+
+        class MockLLMRequestHandler(BaseHTTPRequestHandler):
+            protocol_version: str = "HTTP/1.1"
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+            def __send_json(self, status: int, body: Dict, headers: Dict = {}) -> None:
+                encoded_body: bytes = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded_body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(encoded_body)
+
+            def __send_event(self, body: Dict) -> None:
+                data: bytes = f"data: {json.dumps(body)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self) -> None:
+                if self.path.rstrip('/').endswith("/models"):
+                    self.__send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'created': 0, 'owned_by': 'doc2llm'}]})
+                else:
+                    self.__send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error', 'code': None}})
+
+            def do_POST(self) -> None:
+                request: Dict = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                if not self.path.rstrip('/').endswith("/chat/completions"):
+                    self.__send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error', 'code': None}})
+                    return
+                server._count('requests')
+                messages: List = request.get('messages', [])
+                prompt_tokens: int = int(sum(server.tokenizer.count_tokens(str(message.get('content', ''))) for message in messages))
+                injected, ttft, tokens_per_second, output_tokens = server._draw()
+                status, error = server._get_error(injected, prompt_tokens)
+                if status is not None:
+                    self.__send_json(status, {'error': error}, {'Retry-After': str(server.retry_after)} if status == 429 else {})
+                    return
+                if request.get('max_tokens') is not None:
+                    output_tokens = min(output_tokens, int(request['max_tokens']))
+                tokens: List[str] = server._get_answer_tokens(messages, output_tokens)
+                usage: Dict = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens), 'total_tokens': prompt_tokens + len(tokens)}
+                completion: Dict = {'id': f"chatcmpl-mock-{time.monotonic_ns()}", 'created': int(time.time()), 'model': request.get('model', 'mock')}
+                time.sleep(ttft)
+                if request.get('stream'):
+                    self.__stream(completion, tokens, tokens_per_second, usage, (request.get('stream_options') or {}).get('include_usage', False))
+                else:
+                    time.sleep(len(tokens) / tokens_per_second)
+                    self.__send_json(200, dict(completion, object='chat.completion', usage=usage, \
+                                               choices=[{'index': 0, 'message': {'role': 'assistant', 'content': " ".join(tokens)}, 'finish_reason': 'stop'}]))
+
+            def __stream(self, completion: Dict, tokens: List[str], tokens_per_second: float, usage: Dict, include_usage: bool) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                chunk: Dict = dict(completion, object='chat.completion.chunk')
+                self.__send_event(dict(chunk, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]))
+                for index, token in enumerate(tokens):
+                    self.__send_event(dict(chunk, choices=[{'index': 0, 'delta': {'content': token if index == 0 else ' ' + token}, 'finish_reason': None}]))
+                    time.sleep(1.0 / tokens_per_second)
+                self.__send_event(dict(chunk, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+                if include_usage:
+                    self.__send_event(dict(chunk, choices=[], usage=usage))
+                data: bytes = b"data: [DONE]\n\n"
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n0\r\n\r\n")
+                self.wfile.flush()
+
+        return MockLLMRequestHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m infrastructure.mock_llm_server", description='OpenAI compatible mock server to load test document2llm without calling a real LLM.')
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Address to listen on, default is 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on, default is 8000')
+    parser.add_argument('--ttft_median', type=float, default=0.3, help='Median time to first token in seconds (log-normal distribution), default is 0.3')
+    parser.add_argument('--ttft_sigma', type=float, default=0.5, help='Sigma of the log-normal time to first token distribution, default is 0.5')
+    parser.add_argument('--tokens_per_second', type=float, default=50.0, help='Mean generation speed in tokens per second, default is 50')
+    parser.add_argument('--tokens_per_second_stddev', type=float, default=10.0, help='Standard deviation of the generation speed, default is 10')
+    parser.add_argument('--output_tokens', type=int, default=150, help='Mean number of tokens per answer, default is 150')
+    parser.add_argument('--output_tokens_stddev', type=int, default=50, help='Standard deviation of the number of tokens per answer, default is 50')
+    parser.add_argument('--rate_limit_ratio', type=float, default=0.0, help='Share of requests answered with 429 and a Retry-After header, default is 0')
+    parser.add_argument('--server_error_ratio', type=float, default=0.0, help='Share of requests answered with 500, default is 0')
+    parser.add_argument('--retry_after', type=float, default=1.0, help='Retry-After in seconds of the injected 429 answers, default is 1')
+    parser.add_argument('--context_window', type=int, help='Prompts bigger than this number of tokens are rejected with context_length_exceeded, per default no limit')
+    parser.add_argument('--seed', type=int, help='Seed of the random distributions for reproducible runs')
+    args = parser.parse_args()
+
+    mock_llm_server: MockLLMServer = MockLLMServer(args.host, args.port, args.ttft_median, args.ttft_sigma, args.tokens_per_second, args.tokens_per_second_stddev, \
+                                                   args.output_tokens, args.output_tokens_stddev, args.rate_limit_ratio, args.server_error_ratio, \
+                                                   args.retry_after, args.context_window, args.seed)
+    print(f"Mock LLM server listening, use: export OPENAI_BASE_URL={mock_llm_server.get_base_url()}")
+    try:
+        mock_llm_server.serve_forever()
+    except KeyboardInterrupt:
+        print(mock_llm_server.get_statistics_str())
@@ -74,6 +74,12 @@ class PowerPointToDataStructure(ADocumentToDatastructure):
             return slide_shapes_content, title, slide_info, reduced_slide_text
     
 
+    def __get_slide_request_content(self, shapes: List) -> List:
+        return PPTReader.get_compact_shapes(shapes) if self.llm_utils.compact_serialization else shapes.copy()
+
+    def __get_deck_slide_text(self, reduced_slide_text: List) -> str:
+        return "\n".join([ text.strip("\n") for text in reduced_slide_text ]) if self.llm_utils.compact_serialization else json.dumps(reduced_slide_text)
+
     def __print_slide_keep_skip_info(self, keep_skip_info: str) -> None:
         self.logger.info(keep_skip_info)
         self.content_out.document(f"**{keep_skip_info}**")
@@ -186,7 +192,7 @@ class PowerPointToDataStructure(ADocumentToDatastructure):
                         {
                             self.TITLE_PARAMS: (1, f"Check of text content for slide {slide_number}"),
                             self.CHECKER_INSTANCE: TextSlideChecker(self.llm_utils, self.selected_text_slide_requests, f' (Slide {slide_idx + 1})', f' (Slide {slide_idx + 1})'),
-                            self.LLM_REQUEST_PARAMS: (slide_content["shapes"].copy(), True, slide_info),
+                            self.LLM_REQUEST_PARAMS: (self.__get_slide_request_content(slide_content["shapes"]), True, slide_info),
                             self.DONE_TEXT: f"Text slide request {slide_number} {title}"
                         }
                     )
@@ -196,7 +202,7 @@ class PowerPointToDataStructure(ADocumentToDatastructure):
                         {
                             self.TITLE_PARAMS: (1, f"Check of artistic content for slide {slide_number}"),
                             self.CHECKER_INSTANCE: ArtisticSlideChecker(self.llm_utils, self.selected_artistic_slide_requests, f' (Slide {slide_idx + 1})', f' (Slide {slide_idx + 1})'),
-                            self.LLM_REQUEST_PARAMS: (slide_content["shapes"].copy(), True, slide_info),
+                            self.LLM_REQUEST_PARAMS: (self.__get_slide_request_content(slide_content["shapes"]), True, slide_info),
                             self.DONE_TEXT: f"Artistic slide request {slide_number} {title}"
                         }
                     )
@@ -204,7 +210,7 @@ class PowerPointToDataStructure(ADocumentToDatastructure):
             deck_content.append(slide_content)
 
         if len(self.selected_deck_requests) > 0:
-            formatted_deck_content_list: List = [ f'Slide {slide_number + 1}, {slide_content["title"]}:\n{json.dumps(slide_content["reduced_slide_text"])}' \
+            formatted_deck_content_list: List = [ f'Slide {slide_number + 1}, {slide_content["title"]}:\n{self.__get_deck_slide_text(slide_content["reduced_slide_text"])}' \
                                                   for slide_number, slide_content in enumerate(deck_content) ]
             data_structure.append(
                 {
@@ -228,6 +234,16 @@ class PowerPointToDataStructure(ADocumentToDatastructure):
     def _get_done_text(self, data: any) -> str:
         return data[self.DONE_TEXT]
 
+    def _get_position_independent_content(self, content_to_check: any) -> any:
+        # Slide numbers change as soon as a slide is inserted or deleted before: they are left out
+        if isinstance(content_to_check, list):
+            return [ self._get_position_independent_content(element) for element in content_to_check ]
+        if isinstance(content_to_check, dict):
+            return { key: self._get_position_independent_content(value) for key, value in content_to_check.items() if key != "slide_number" }
+        if isinstance(content_to_check, str):
+            return re.sub(r'^Slide \d+\n', '', content_to_check)
+        return content_to_check
+
 
 
         
\ No newline at end of file
@@ -199,3 +199,73 @@ class PPTReader:
         return sorted(shapes, key = lambda shape_dict: shape_dict['y'])
     
 
+    @staticmethod
+    def __get_compact_color(color: str) -> str:
+        # "Scheme color: ACCENT_1 (5)" -> ACCENT_1, "(R, G, B): FF0000" or "Hexadecimal:0xRRGGBB: 0xFF0000" -> #FF0000
+        if color is None or color in ["Transparent", "None"]:
+            return None
+        scheme_color = re.match(r'^Scheme color: (\w+)', color)
+        if scheme_color is not None:
+            return scheme_color.group(1)
+        rgb_color = re.search(r'([0-9A-Fa-f]{6})$', color)
+        return f"#{rgb_color.group(1)}" if rgb_color is not None else color
+
+    @staticmethod
+    def __get_compact_number(value: any) -> str:
+        # Percentages of the slide are sent as "12.345% of slide width" or as floats: one decimal is precise enough
+        if isinstance(value, tuple):
+            value = value[0] if len(value) > 0 else None
+        number = re.match(r'^-?[\d.]+', str(value)) if value is not None else None
+        return f"{round(float(number.group(0)), 1):g}" if number is not None else None
+
+    @staticmethod
+    def __get_compact_fonts(font_details: List) -> str:
+        fonts: List = []
+        for font_detail in font_details:
+            font_size = font_detail.get("font_size (PT)")
+            font: str = " ".join([ part for part in [font_detail.get("font_name"), \
+                                                     f"{font_size:g}pt" if isinstance(font_size, (int, float)) else None, \
+                                                     PPTReader.__get_compact_color(font_detail.get("text_color"))] if part is not None ])
+            if len(font) > 0:
+                fonts.append((font, font_detail.get("text_impacted", "")))
+        distinct_fonts: List = list(dict.fromkeys([ font for font, _ in fonts ]))
+        if len(distinct_fonts) < 2:
+            return distinct_fonts[0] if len(distinct_fonts) > 0 else None
+        return "; ".join([ f'{font} "{text_impacted}"' for font, text_impacted in fonts ])
+
+    @staticmethod
+    def __get_compact_header(shape: Dict) -> str:
+        if shape.get("mytype") == "table":
+            header: List = [f'table {shape["table_size"]["number_cols"]}x{shape["table_size"]["number_rowss"]}']
+        elif str(shape.get("is_title")) == "True":
+            header: List = ["title"]
+        else:
+            header: List = [re.sub(r'\s*\(\d+\)$', '', str(shape.get("type", "shape"))).lower()]
+        position: Dict = shape.get("position", {})
+        size: Dict = shape.get("size", {})
+        attributes: List = [("x", PPTReader.__get_compact_number(position.get("from_left (% size)"))),
+                            ("y", PPTReader.__get_compact_number(position.get("from_top (% size)"))),
+                            ("w", PPTReader.__get_compact_number(size.get("width (% size)"))),
+                            ("h", PPTReader.__get_compact_number(size.get("height (% size)"))),
+                            ("rot", PPTReader.__get_compact_number(shape.get("rotation_degrees"))),
+                            ("fill", PPTReader.__get_compact_color(shape.get("shape_fore_color")))]
+        line: Dict = shape.get("line", {})
+        line_color: str = PPTReader.__get_compact_color(line.get("line_color"))
+        if line_color is not None:
+            attributes.append(("line", f'{line_color} {line["line_width_points"]:g}pt' if line.get("line_width_points") else line_color))
+        attributes.append(("font", PPTReader.__get_compact_fonts(shape.get("font_details", []))))
+        # Default values (no rotation, transparent colours, unknown fonts) are left out
+        header += [ f"{name}={value}" for name, value in attributes if value is not None and not (name == "rot" and value == "0") ]
+        return f"[{' '.join(header)}]"
+
+    @staticmethod
+    def get_compact_shapes(shapes: List) -> List[str]:
+        # Terse notation described by LLMUtils.get_format_description: one block per shape so that a slide too big is split between shapes
+        blocks: List[str] = []
+        for shape in shapes:
+            text: str = shape.get("table_cells") if shape.get("mytype") == "table" else shape.get("text")
+            text = (text or "").strip("\n")
+            blocks.append(PPTReader.__get_compact_header(shape) + (f"\n{text}" if len(text) > 0 else ""))
+        if len(blocks) > 0:
+            blocks[0] = f"Slide {shapes[0].get('slide_number')}\n{blocks[0]}"
+        return blocks
@@ -0,0 +1,113 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict
+from logging import Logger
+import threading
+import asyncio
+import time
+import re
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute: float):
+        self.capacity: float = float(capacity_per_minute)
+        self.refill_per_second: float = self.capacity / 60.0
+        self.available: float = self.capacity
+        self.last_refill: float = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_per_second)
+        self.last_refill = now
+
+    def get_wait_time(self, amount: float) -> float:
+        # A request bigger than the bucket would never pass: it waits for a full bucket instead
+        missing: float = min(amount, self.capacity) - self.available
+        return missing / self.refill_per_second if missing > 0 else 0
+
+    def consume(self, amount: float) -> None:
+        self.available -= amount
+
+class RateLimiter:
+    """
+    @brief Process wide requests per minute and tokens per minute limiter shared by all workers.
+    Callers are paused before sending, the token bucket is corrected with the real usage reported
+    by the LLM and the whole process is paused when the provider answers with Retry-After.
+    """
+    def __init__(self, logger: Logger, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.logger = logger
+        self.requests_bucket: TokenBucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens_bucket: TokenBucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def __try_acquire(self, estimated_tokens: int) -> float:
+        with self.lock:
+            now: float = time.monotonic()
+            wait_time: float = max(self.paused_until - now, 0)
+            for bucket, amount in [(self.requests_bucket, 1), (self.tokens_bucket, estimated_tokens)]:
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait_time = max(wait_time, bucket.get_wait_time(amount))
+            if wait_time <= 0:
+                if self.requests_bucket is not None: self.requests_bucket.consume(1)
+                if self.tokens_bucket is not None: self.tokens_bucket.consume(estimated_tokens)
+            return wait_time
+
+    def try_acquire(self, estimated_tokens: int) -> bool:
+        # Without waiting: used by the calls only worth sending at once
+        return self.__try_acquire(estimated_tokens) <= 0
+
+    def acquire(self, estimated_tokens: int) -> None:
+        while (wait_time := self.__try_acquire(estimated_tokens)) > 0:
+            self.logger.debug(f"Rate limiter: waiting {wait_time:.2f} seconds before sending ({estimated_tokens} tokens estimated)")
+            time.sleep(wait_time)
+
+    async def acquire_async(self, estimated_tokens: int) -> None:
+        while (wait_time := self.__try_acquire(estimated_tokens)) > 0:
+            self.logger.debug(f"Rate limiter: waiting {wait_time:.2f} seconds before sending ({estimated_tokens} tokens estimated)")
+            await asyncio.sleep(wait_time)
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int) -> None:
+        if self.tokens_bucket is not None and used_tokens is not None:
+            with self.lock:
+                self.tokens_bucket.consume(used_tokens - estimated_tokens)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.logger.warning(f"Rate limiter: pausing all requests for {seconds:.2f} seconds")
+
+    @staticmethod
+    def parse_duration(duration: str) -> float:
+        # Supports Retry-After seconds ("20", "1.5") and rate limit reset durations ("6m0s", "1s", "250ms")
+        if duration is None:
+            return None
+        duration = duration.strip()
+        if re.match(r'^\d+(\.\d+)?$', duration):
+            return float(duration)
+        seconds: float = 0
+        found: bool = False
+        for value, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', duration):
+            found = True
+            seconds += float(value) * {'ms': 0.001, 'h': 3600, 'm': 60, 's': 1}[unit]
+        return seconds if found else None
+
+    @staticmethod
+    def get_retry_after(headers: Dict) -> float:
+        if headers is None:
+            return None
+        retry_after_ms: str = headers.get("retry-after-ms")
+        if retry_after_ms is not None and re.match(r'^\d+(\.\d+)?$', retry_after_ms.strip()):
+            return float(retry_after_ms) / 1000.0
+        return RateLimiter.parse_duration(headers.get("retry-after"))
+
+    def update_from_headers(self, headers: Dict) -> None:
+        if headers is None:
+            return
+        for remaining_header, reset_header in [("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+                                               ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens")]:
+            remaining: str = headers.get(remaining_header)
+            if remaining is not None and remaining.strip() == "0":
+                reset_seconds: float = self.parse_duration(headers.get(reset_header))
+                if reset_seconds is not None:
+                    self.pause(reset_seconds)
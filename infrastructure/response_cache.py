@@ -0,0 +1,98 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict
+from pathlib import Path
+from logging import Logger
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+
+class ResponseCache:
+    """
+    @brief On-disk (SQLite) cache of LLM responses addressed by a hash of the model name,
+    the messages sent and the sampling parameters. Least recently used entries are evicted
+    once the cache exceeds its size cap.
+    """
+    CACHE_FILE_NAME: str = "responses.sqlite3"
+
+    def __init__(self, cache_dir: str, logger: Logger, max_size_mb: int = 1024, read_only: bool = False):
+        self.logger = logger
+        self.read_only = read_only
+        self.max_size_bytes: int = max_size_mb * 1024 * 1024
+        self.hits: int = 0
+        self.misses: int = 0
+        self.lock: threading.Lock = threading.Lock()
+        cache_path: Path = Path(cache_dir).expanduser()
+        cache_path.mkdir(parents=True, exist_ok=True)
+        self.cache_file_name: str = str(cache_path / self.CACHE_FILE_NAME)
+        self.connection = sqlite3.connect(self.cache_file_name, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+        self.total_size: int = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.logger.info(f"Response cache {self.cache_file_name} opened ({self.total_size / (1024 * 1024):.2f} MB used{', read only' if read_only else ''})")
+
+    @staticmethod
+    def compute_key(model_name: str, messages: List, temperature: float, top_p: float, max_tokens: int = None) -> str:
+        request: Dict = {
+            'model': model_name,
+            'messages': messages,
+            'temperature': temperature,
+            'top_p': top_p
+        }
+        # Only part of the key when set: keys of requests without max_tokens are unchanged
+        if max_tokens is not None:
+            request['max_tokens'] = max_tokens
+        normalized_request: str = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(normalized_request.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str:
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+            return row[0]
+
+    def contains(self, key: str) -> bool:
+        # Lookup without counting a hit or refreshing the entry: the request may still not be sent
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, response: str) -> None:
+        if self.read_only:
+            return
+        size: int = len(response.encode("utf-8"))
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if previous is not None:
+                self.total_size -= previous[0]
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)", (key, response, size, time.time()))
+            self.total_size += size
+            self.__evict()
+            self.connection.commit()
+
+    def __evict(self) -> None:
+        while self.total_size > self.max_size_bytes:
+            row = self.connection.execute("SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.total_size -= row[1]
+            self.logger.debug(f"Evicted cached response {row[0]} ({row[1]} bytes)")
+
+    def get_statistics_str(self) -> str:
+        lookups: int = self.hits + self.misses
+        hit_ratio: float = self.hits * 100.0 / lookups if lookups > 0 else 0
+        return f"Response cache: {self.hits} hits, {self.misses} misses ({hit_ratio:.1f}% hit ratio), {self.total_size / (1024 * 1024):.2f} MB used"
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
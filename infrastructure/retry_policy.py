@@ -0,0 +1,116 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError, InternalServerError
+import httpx
+import threading
+import random
+import time
+
+class CircuitOpenError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        # Seconds before calls may be let through again, None when unknown
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    @brief Opens after failure_threshold consecutive transient failures: calls then fail fast
+    until reset_timeout elapsed, after which a single trial call is let through (half open).
+    The other calls keep failing fast until the trial call succeeded (closed) or failed (open again).
+    """
+    CLOSED: str = "closed"
+    OPEN: str = "open"
+    HALF_OPEN: str = "half open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state: str = self.CLOSED
+        self.consecutive_failures: int = 0
+        self.opened_at: float = 0
+        self.probe_in_flight: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self.lock:
+            if self.state == self.OPEN:
+                remaining_time: float = self.reset_timeout - (time.monotonic() - self.opened_at)
+                if remaining_time > 0:
+                    raise CircuitOpenError(f"Circuit open after {self.consecutive_failures} consecutive failures, failing fast for {remaining_time:.2f} more seconds", remaining_time)
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self.probe_in_flight:
+                    raise CircuitOpenError("Circuit half open, waiting for the outcome of the trial call")
+                self.probe_in_flight = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self) -> bool:
+        with self.lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                opened: bool = self.state != self.OPEN
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                return opened
+            return False
+
+    def release_probe(self) -> None:
+        # The trial call failed for another reason than the endpoint (invalid request, ...): the next call is the trial
+        with self.lock:
+            self.probe_in_flight = False
+
+class RetryPolicy:
+    """
+    @brief Decides whether a failed LLM call is retried and after how long.
+    Errors are classified as retryable (network, timeouts, rate limits, 5xx, open circuit), context overflow (handled by
+    splitting the content) or fatal: any other error, including programming errors, is raised at once.
+    Delays follow the decorrelated jitter backoff: random between base_delay and 3 times the previous delay.
+    """
+    RETRYABLE: str = "retryable"
+    FATAL: str = "fatal"
+    CONTEXT_OVERFLOW: str = "context overflow"
+    CONTEXT_OVERFLOW_MARKERS: list = ["ContextWindowExceededError", "context_length_exceeded", "maximum context length"]
+    TRANSIENT_ERRORS: tuple = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError, httpx.TransportError)
+    TRANSIENT_STATUS_CODES: list = [408, 409]
+    DEFAULT_MAX_ATTEMPTS: int = 6
+    DEFAULT_CONNECT_TIMEOUT: float = 10.0
+    DEFAULT_READ_TIMEOUT: float = 600.0
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = 1.0, max_delay: float = 60.0, \
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT, \
+                 circuit_failure_threshold: int = 5, circuit_reset_timeout: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.circuit_breaker: CircuitBreaker = CircuitBreaker(circuit_failure_threshold, circuit_reset_timeout)
+
+    def get_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    def classify(self, err: Exception) -> str:
+        if any(marker in str(err) for marker in self.CONTEXT_OVERFLOW_MARKERS):
+            return self.CONTEXT_OVERFLOW
+        # Open circuits fail fast until they let a trial call through: the call is retried once it may succeed
+        if isinstance(err, self.TRANSIENT_ERRORS + (CircuitOpenError,)):
+            return self.RETRYABLE
+        if isinstance(err, APIStatusError) and (err.status_code in self.TRANSIENT_STATUS_CODES or err.status_code >= 500):
+            return self.RETRYABLE
+        return self.FATAL
+
+    def is_exhausted(self, attempt: int) -> bool:
+        return attempt >= self.max_attempts
+
+    def next_delay(self, previous_delay: float, retry_after: float = None) -> float:
+        delay: float = min(self.max_delay, random.uniform(self.base_delay, max(previous_delay, self.base_delay) * 3))
+        # The provider knows best: never retry before its Retry-After
+        return max(delay, retry_after) if retry_after is not None else delay
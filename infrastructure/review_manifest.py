@@ -0,0 +1,58 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from domain.imanifest import IManifest
+from typing import List, Dict
+from logging import Logger
+from pathlib import Path
+import threading
+import json
+import os
+
+class ReviewManifest(IManifest):
+    """
+    @brief Answers of the previous review of a document indexed by the content hash of each item (slide, chapters, deck).
+    A new revision of the document only sends the items whose content changed. The manifest is bound to the
+    configuration (model, reviewer, requests): another configuration starts from an empty manifest.
+    Once the review completes, the manifest is rewritten with the items of the current revision only.
+    """
+    def __init__(self, manifest_path: str, configuration_key: str, logger: Logger):
+        self.manifest_path = manifest_path
+        self.configuration_key = configuration_key
+        self.logger = logger
+        self.lock: threading.Lock = threading.Lock()
+        self.previous_items: Dict[str, List] = {}
+        self.current_items: Dict[str, List] = {}
+        self.__load()
+
+    def __load(self) -> None:
+        if not Path(self.manifest_path).is_file():
+            self.logger.info(f"No manifest {self.manifest_path} yet: the whole document is reviewed.")
+            return
+        with open(self.manifest_path, encoding="utf-8") as f:
+            manifest: Dict = json.load(f)
+        if manifest.get('configuration') != self.configuration_key:
+            self.logger.warning(f"Manifest {self.manifest_path} was written with another configuration: the whole document is reviewed.")
+            return
+        self.previous_items = manifest.get('items', {})
+        self.logger.info(f"Manifest {self.manifest_path} loaded: {len(self.previous_items)} items of the previous review can be reused.")
+
+    def get(self, content_hash: str) -> List:
+        with self.lock:
+            return self.previous_items.get(content_hash)
+
+    def record(self, content_hash: str, results: List) -> None:
+        with self.lock:
+            self.current_items[content_hash] = results
+
+    def close(self, completed: bool) -> None:
+        with self.lock:
+            # An interrupted review keeps the previous items: the next run still reuses them
+            items: Dict[str, List] = self.current_items if completed else dict(self.previous_items, **self.current_items)
+            temporary_path: str = f"{self.manifest_path}.temporary"
+            with open(temporary_path, "w", encoding="utf-8") as f:
+                json.dump({'configuration': self.configuration_key, 'items': items}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self.manifest_path)
+        self.logger.info(f"Manifest {self.manifest_path} written with {len(items)} items.")
@@ -0,0 +1,81 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict, Tuple
+import itertools
+import json
+from infrastructure.run_report import RunReport
+
+class ReviewPlan:
+    """
+    @brief Projection of a review planned with --plan: LLM calls, prompt and completion tokens and estimated cost per
+    request type are taken from the run report of the planned run. The wall time is projected from the expected
+    latencies for the configured number of workers, bounded by the rate limits of the model.
+    """
+    def __init__(self, run_report: RunReport, workers: int, schedule_whole_document: bool, requests_per_minute: float = None, \
+                 tokens_per_minute: float = None, max_prompt_tokens: int = None, max_cost: float = None):
+        self.run_report = run_report
+        self.workers = workers
+        self.schedule_whole_document = schedule_whole_document
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_cost = max_cost
+
+    def __get_stage_time(self, latencies: List[float]) -> float:
+        # The workers take the calls one after the other: the slowest call is a lower bound
+        return max(max(latencies), sum(latencies) / self.workers) if len(latencies) > 0 else 0
+
+    def get_projected_wall_time(self) -> Tuple[float, str]:
+        records: List[Dict] = [ record for record in self.run_report.get_records() if record['latency'] is not None ]
+        if self.schedule_whole_document:
+            compute_time: float = self.__get_stage_time([ record['latency'] for record in records ])
+        else:
+            # Chunks are reviewed one after the other, the requests of a chunk and then its post requests sharing the workers
+            compute_time: float = sum(self.__get_stage_time([ record['latency'] for record in stage_records ]) \
+                                      for _, stage_records in itertools.groupby(records, key=lambda record: record['chunk']))
+        bounds: List[Tuple[float, str]] = [(compute_time, f"{self.workers} workers")]
+        if self.requests_per_minute is not None:
+            bounds.append((len(records) * 60.0 / self.requests_per_minute, f"{self.requests_per_minute} requests per minute"))
+        if self.tokens_per_minute is not None:
+            bounds.append((sum(record['prompt_tokens'] + record['completion_tokens'] for record in records) * 60.0 / self.tokens_per_minute, \
+                           f"{self.tokens_per_minute} tokens per minute"))
+        return max(bounds)
+
+    def get_plan(self) -> Dict:
+        report: Dict = self.run_report.get_report()
+        projected_wall_time, limited_by = self.get_projected_wall_time()
+        plan: Dict = {
+            'total': report['total'],
+            'by_request_name': report['by_request_name'],
+            'workers': self.workers,
+            'projected_wall_time': projected_wall_time,
+            'limited_by': limited_by,
+            'exceeded_budgets': []
+        }
+        if self.max_prompt_tokens is not None and report['total']['prompt_tokens'] > self.max_prompt_tokens:
+            plan['exceeded_budgets'].append(f"{report['total']['prompt_tokens']} prompt tokens exceed the budget of {self.max_prompt_tokens}")
+        if self.max_cost is not None and report['total']['estimated_cost'] > self.max_cost:
+            plan['exceeded_budgets'].append(f"estimated cost {report['total']['estimated_cost']:.4f} exceeds the budget of {self.max_cost:.4f}")
+        return plan
+
+    def to_markdown(self) -> str:
+        plan: Dict = self.get_plan()
+        total: Dict = plan['total']
+        lines: List[str] = ["# Review plan", "",
+                            f"{total['llm_calls']} LLM calls, {total['prompt_tokens']} prompt tokens, about {total['completion_tokens']} completion tokens, " + \
+                            f"estimated cost {total['estimated_cost']:.4f}.",
+                            f"Projected wall time: {plan['projected_wall_time']:.1f} seconds (limited by {plan['limited_by']}).", "",
+                            "| Request name | LLM calls | Prompt tokens | Completion tokens | Estimated cost |",
+                            "| --- | --- | --- | --- | --- |"]
+        for name, aggregate in sorted(plan['by_request_name'].items(), key=lambda item: -item[1]['estimated_cost']):
+            lines.append(f"| {name} | {aggregate['llm_calls']} | {aggregate['prompt_tokens']} | {aggregate['completion_tokens']} | {aggregate['estimated_cost']:.4f} |")
+        if len(plan['exceeded_budgets']) > 0:
+            lines += ["", "Over budget: " + ", ".join(plan['exceeded_budgets']) + ": post requests would be dropped and the review would stop before its end."]
+        return "\n".join(lines) + "\n"
+
+    def write(self, plan_path_prefix: str) -> None:
+        with open(f"{plan_path_prefix}.plan.json", "w", encoding="utf-8") as f:
+            json.dump(self.get_plan(), f, indent=2)
+        with open(f"{plan_path_prefix}.plan.md", "w", encoding="utf-8") as f:
+            f.write(self.to_markdown())
@@ -0,0 +1,123 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import List, Dict, Tuple
+from logging import Logger
+from domain.model_profiles import ModelProfiles
+import threading
+import json
+import math
+
+class RunReport:
+    """
+    @brief Collects tokens, latency, retries and endpoint of every LLM response of the run and writes
+    a JSON and a markdown report aggregated by request name, by chunk (slide / chapters) and by model.
+    Costs are estimated from the model profile prices expressed per million tokens.
+    """
+    AGGREGATIONS: List = [('request_name', 'Request name'), ('chunk', 'Chunk'), ('model', 'Model')]
+
+    def __init__(self, logger: Logger, model_profiles: ModelProfiles):
+        self.logger = logger
+        self.model_profiles = model_profiles
+        self.lock: threading.Lock = threading.Lock()
+        self.records: List[Dict] = []
+        self.sections: List[Tuple[str, str]] = []
+
+    def set_sections(self, sections: List[Tuple[str, str]]) -> None:
+        # (title, status) of the chunks of an incremental review: fresh or reused from the previous revision
+        self.sections = sections
+
+    def record(self, response: Dict, chunk: str, model_name: str) -> None:
+        usage: Dict = response.get('usage', {})
+        # Cached and coalesced responses did not cost a call: only their occurrence is reported
+        is_call: bool = not response.get('from_cache', False) and not response.get('coalesced', False) and not response.get('placeholder', False)
+        record: Dict = {
+            'request_name': response['request_name'],
+            'chunk': chunk.strip() if chunk is not None else '',
+            'model': response.get('model', model_name),
+            'endpoint': response.get('endpoint'),
+            'from_cache': response.get('from_cache', False),
+            'coalesced': response.get('coalesced', False),
+            'prompt_tokens': usage.get('prompt_tokens', 0) if is_call else 0,
+            'completion_tokens': usage.get('completion_tokens', 0) if is_call else 0,
+            'cached_tokens': usage.get('cached_tokens', 0) if is_call else 0,
+            'latency': response.get('latency') if is_call else None,
+            'retries': response.get('retries', 0) if is_call else 0
+        }
+        record['cost'] = self.__get_cost(record)
+        with self.lock:
+            self.records.append(record)
+
+    def __get_cost(self, record: Dict) -> float:
+        return self.model_profiles.get_cost(record['model'], record['prompt_tokens'], record['cached_tokens'], record['completion_tokens'])
+
+    def get_records(self) -> List[Dict]:
+        with self.lock:
+            return list(self.records)
+
+    @staticmethod
+    def percentile(values: List[float], percent: float) -> float:
+        if len(values) == 0:
+            return None
+        sorted_values: List[float] = sorted(values)
+        return sorted_values[max(math.ceil(percent / 100.0 * len(sorted_values)) - 1, 0)]
+
+    @staticmethod
+    def __aggregate(records: List[Dict]) -> Dict:
+        latencies: List[float] = [ record['latency'] for record in records if record['latency'] is not None ]
+        return {
+            'requests': len(records),
+            'llm_calls': len(latencies),
+            'cache_hits': sum(1 for record in records if record['from_cache']),
+            'coalesced': sum(1 for record in records if record['coalesced']),
+            'prompt_tokens': sum(record['prompt_tokens'] for record in records),
+            'cached_tokens': sum(record['cached_tokens'] for record in records),
+            'completion_tokens': sum(record['completion_tokens'] for record in records),
+            'retries': sum(record['retries'] for record in records),
+            'latency_p50': RunReport.percentile(latencies, 50),
+            'latency_p95': RunReport.percentile(latencies, 95),
+            'latency_p99': RunReport.percentile(latencies, 99),
+            'estimated_cost': sum(record['cost'] for record in records)
+        }
+
+    def get_report(self) -> Dict:
+        records: List[Dict] = self.get_records()
+        report: Dict = {'total': self.__aggregate(records)}
+        for key, _ in self.AGGREGATIONS:
+            groups: Dict = {}
+            for record in records:
+                groups.setdefault(record[key] if record[key] is not None else '', []).append(record)
+            report[f'by_{key}'] = { group_name: self.__aggregate(group_records) for group_name, group_records in groups.items() }
+        if len(self.sections) > 0:
+            report['sections'] = [ {'title': title, 'status': status} for title, status in self.sections ]
+        return report
+
+    @staticmethod
+    def __format_seconds(value: float) -> str:
+        return f"{value:.2f}" if value is not None else "-"
+
+    def __to_markdown_table(self, aggregates: Dict, title: str) -> str:
+        table: str = f"| {title} | Requests | LLM calls | Cache hits | Prompt tokens | Cached tokens | Completion tokens | Retries | p50 (s) | p95 (s) | p99 (s) | Estimated cost |\n" + \
+                     "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |\n"
+        for name, aggregate in sorted(aggregates.items(), key=lambda item: -item[1]['estimated_cost']):
+            table += f"| {name} | {aggregate['requests']} | {aggregate['llm_calls']} | {aggregate['cache_hits']} | {aggregate['prompt_tokens']} | {aggregate['cached_tokens']} | " + \
+                     f"{aggregate['completion_tokens']} | {aggregate['retries']} | {self.__format_seconds(aggregate['latency_p50'])} | " + \
+                     f"{self.__format_seconds(aggregate['latency_p95'])} | {self.__format_seconds(aggregate['latency_p99'])} | {aggregate['estimated_cost']:.4f} |\n"
+        return table
+
+    def write(self, report_path_prefix: str) -> None:
+        report: Dict = self.get_report()
+        with open(f"{report_path_prefix}.report.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        with open(f"{report_path_prefix}.report.md", "w", encoding="utf-8") as f:
+            f.write("# LLM usage report\n\n")
+            f.write(self.__to_markdown_table({'All requests': report['total']}, 'Run'))
+            for key, title in self.AGGREGATIONS:
+                f.write(f"\n## By {title.lower()}\n\n")
+                f.write(self.__to_markdown_table(report[f'by_{key}'], title))
+            if 'sections' in report:
+                f.write("\n## Sections\n\n| Section | Status |\n| --- | --- |\n")
+                f.write("".join([ f"| {section['title']} | {section['status']} |\n" for section in report['sections'] ]))
+        total: Dict = report['total']
+        self.logger.info(f"Run report {report_path_prefix}.report.md: {total['llm_calls']} LLM calls, {total['prompt_tokens']} prompt tokens, " + \
+                         f"{total['completion_tokens']} completion tokens, p95 latency {self.__format_seconds(total['latency_p95'])} s, estimated cost {total['estimated_cost']:.4f}")
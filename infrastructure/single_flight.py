@@ -0,0 +1,68 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict, Callable, Awaitable
+from concurrent.futures import Future
+import threading
+import asyncio
+
+class SingleFlight:
+    """
+    @brief Coalesces identical requests in flight: the first caller of a key performs the call,
+    callers arriving with the same key while it runs wait for its result instead of sending again.
+    Works for threads and for coroutines of the async access alike.
+    """
+    def __init__(self):
+        self.lock: threading.Lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        self.saved_calls: int = 0
+
+    def __join(self, key: str) -> tuple:
+        with self.lock:
+            future: Future = self.in_flight.get(key)
+            if future is not None:
+                self.saved_calls += 1
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+            return future, True
+
+    def __leave(self, key: str) -> None:
+        with self.lock:
+            del self.in_flight[key]
+
+    @staticmethod
+    def __follower_result(result: Dict) -> Dict:
+        return dict(result, coalesced=True)
+
+    def do(self, key: str, function: Callable[[], Dict]) -> Dict:
+        future, is_leader = self.__join(key)
+        if not is_leader:
+            return self.__follower_result(future.result())
+        try:
+            result: Dict = function()
+            # The leader goes on updating its response (names, separators): followers copy a snapshot of it
+            future.set_result(dict(result))
+            return result
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            self.__leave(key)
+
+    async def do_async(self, key: str, coroutine_function: Callable[[], Awaitable[Dict]]) -> Dict:
+        future, is_leader = self.__join(key)
+        if not is_leader:
+            return self.__follower_result(await asyncio.wrap_future(future))
+        try:
+            result: Dict = await coroutine_function()
+            future.set_result(dict(result))
+            return result
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            self.__leave(key)
+
+    def get_statistics_str(self) -> str:
+        return f"Request coalescing: {self.saved_calls} LLM calls saved by joining identical requests in flight"
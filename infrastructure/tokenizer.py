@@ -0,0 +1,75 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from logging import Logger
+from pathlib import Path
+from domain.itokenizer import ITokenizer, HeuristicTokenizer
+
+class TiktokenTokenizer(ITokenizer):
+    def __init__(self, model_name: str, encoding_name: str = None):
+        import tiktoken
+        if encoding_name is not None:
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        else:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                # Models unknown to tiktoken (Llama, Gemma, ...) are closer to cl100k_base than to the character heuristic
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def get_name(self) -> str:
+        return f"tiktoken ({self.encoding.name})"
+
+class HuggingFaceTokenizer(ITokenizer):
+    def __init__(self, tokenizer_path: str):
+        from tokenizers import Tokenizer
+        self.tokenizer_path = tokenizer_path
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def get_name(self) -> str:
+        return f"HuggingFace ({self.tokenizer_path})"
+
+class TokenizerFactory:
+    """
+    @brief Creates the tokenizer described by --tokenizer:
+        auto (default): tiktoken when installed, the character heuristic otherwise
+        heuristic: the character heuristic
+        tiktoken or tiktoken:<encoding name>: tiktoken (pip install tiktoken)
+        <path to tokenizer.json>: a local HuggingFace tokenizer file (pip install tokenizers)
+    Any tokenizer that cannot be loaded falls back to the character heuristic.
+    """
+    AUTO: str = "auto"
+    HEURISTIC: str = "heuristic"
+    TIKTOKEN: str = "tiktoken"
+
+    @staticmethod
+    def create(tokenizer_description: str, model_name: str, logger: Logger) -> ITokenizer:
+        if tokenizer_description is None:
+            tokenizer_description = TokenizerFactory.AUTO
+        tokenizer: ITokenizer = None
+        try:
+            if tokenizer_description == TokenizerFactory.AUTO or tokenizer_description == TokenizerFactory.TIKTOKEN:
+                tokenizer = TiktokenTokenizer(model_name)
+            elif tokenizer_description.startswith(TokenizerFactory.TIKTOKEN + ":"):
+                tokenizer = TiktokenTokenizer(model_name, tokenizer_description[len(TokenizerFactory.TIKTOKEN) + 1:])
+            elif tokenizer_description != TokenizerFactory.HEURISTIC:
+                if not Path(tokenizer_description).is_file():
+                    raise FileNotFoundError(f"Tokenizer file {tokenizer_description} could not be read.")
+                tokenizer = HuggingFaceTokenizer(tokenizer_description)
+        except Exception as err:
+            log = logger.info if tokenizer_description == TokenizerFactory.AUTO else logger.warning
+            log(f"Tokenizer {tokenizer_description} could not be loaded ({err=}), falling back to the character heuristic.")
+            tokenizer = None
+        if tokenizer is None:
+            tokenizer = HeuristicTokenizer()
+        # tiktoken is optional: with auto, chunk sizes depend on whether it is installed
+        auto_information: str = f" ({TokenizerFactory.AUTO}: tiktoken {'is' if isinstance(tokenizer, TiktokenTokenizer) else 'is not'} installed, " + \
+                                f"--tokenizer {TokenizerFactory.HEURISTIC} or {TokenizerFactory.TIKTOKEN} make the choice explicit)" if tokenizer_description == TokenizerFactory.AUTO else ""
+        logger.info(f"Counting tokens with tokenizer {tokenizer.get_name()}{auto_information}")
+        return tokenizer
@@ -15,6 +15,7 @@ from docx.text.paragraph import Paragraph
 import xml.etree.ElementTree as ET
 from xml.etree import ElementTree
 from io import StringIO
+import threading
 from domain.ichecker import WordChecker
 from domain.allm_access import AbstractLLMAccess
 from domain.llm_utils import LLMUtils
@@ -27,6 +28,10 @@ class WordToDatastructure(ADocumentToDatastructure):
     LLM_REQUEST_PARAMS: str = 'llm_request_params'
     DONE_TEXT: str = 'done_text'
     INIT_PARAGRAPH: str = '0.0.0.0'
+    OCR_LANGUAGES: List = ['en', 'de', 'fr', 'da']
+    # Loading the OCR models takes seconds: one reader per process
+    ocr_reader: any = None
+    ocr_reader_lock: threading.Lock = threading.Lock()
 
 
     def __init__(self, document_path: str, paragraphs_to_skip: List, paragraphs_to_keep: List,\
@@ -133,6 +138,14 @@ class WordToDatastructure(ADocumentToDatastructure):
                     return True
         return False
 
+    @staticmethod
+    def get_ocr_reader() -> any:
+        with WordToDatastructure.ocr_reader_lock:
+            if WordToDatastructure.ocr_reader is None:
+                import easyocr
+                WordToDatastructure.ocr_reader = easyocr.Reader(WordToDatastructure.OCR_LANGUAGES)
+            return WordToDatastructure.ocr_reader
+
     def get_ocred_images(self, xmlstr, root, namespaces, document, block) -> List:
         images_ocred: List = []
         unique_id: int = 0
@@ -148,9 +161,7 @@ class WordToDatastructure(ADocumentToDatastructure):
                     document_part = document.part
                     image_part = document_part.related_parts[embed_attr]
                     self.logger.info(f"Extracting OCR for image {image_name} (In case of memory error deactivate OCR)")
-                    import easyocr
-                    reader = easyocr.Reader(['en', 'de', 'fr', 'da'])
-                    ocred_text: str = reader.readtext(image_part._blob)
+                    ocred_text: str = WordToDatastructure.get_ocr_reader().readtext(image_part._blob)
                     for text in ocred_text:
                         ocred_text += (f'OCRed text: {text}\n')
                     self.logger.debug(f"OCRed for image {image_name}:\n{ocred_text}\n")
@@ -163,6 +174,9 @@ class WordToDatastructure(ADocumentToDatastructure):
     def _document_to_data_structure(self):
         text_for_request: str = ""
         last_text_found: str = ""
+        # Running token counts: chunking stays linear in the document size
+        text_for_request_tokens: float = 0
+        last_text_found_tokens: float = 0
         latest_saved_heading_deepness: int = -1
         paragraphs_to_process: List = []
         paragraph_number:str = self.INIT_PARAGRAPH
@@ -201,31 +215,43 @@ class WordToDatastructure(ADocumentToDatastructure):
                         self.logger.info(f"Paragraph {paragraph_number} being skipped because not expected to be kept as per request.")
                         continue
 
-                    if self.llm_utils.get_number_tokens(text_for_request + last_text_found) < self.context_length_source_document and \
+                    if text_for_request_tokens + last_text_found_tokens < self.context_length_source_document and \
                        current_heading_deepness > latest_saved_heading_deepness and \
                        current_heading_deepness > self.split_request_per_paragraph_deepness - 1:
                         text_for_request += last_text_found
+                        text_for_request_tokens += last_text_found_tokens
                         last_text_found = ""
+                        last_text_found_tokens = 0
                     elif len(text_for_request) > 0:
                             self.logger.debug(f"Preparing new request for text: {text_for_request}")
                             latest_saved_heading_deepness = current_heading_deepness
                             data_structure = self.__append_to_data_structure(data_structure, text_for_request, paragraphs_to_process, paragraph_number)
                             text_for_request = last_text_found
+                            text_for_request_tokens = last_text_found_tokens
                             last_text_found = ""
+                            last_text_found_tokens = 0
                             paragraphs_to_process = []
                     paragraphs_to_process.append(paragraph_number)
-                    last_text_found += f'{"#" * current_heading_deepness} {" ".join(current_text_list)}\n\n'
+                    heading_text: str = f'{"#" * current_heading_deepness} {" ".join(current_text_list)}\n\n'
+                    last_text_found += heading_text
+                    last_text_found_tokens += self.llm_utils.get_number_tokens(heading_text)
                     
                 else:
-                    last_text_found += " ".join(current_text_list) + "\n\n"
+                    paragraph_text: str = " ".join(current_text_list) + "\n\n"
+                    last_text_found += paragraph_text
+                    last_text_found_tokens += self.llm_utils.get_number_tokens(paragraph_text)
                 
                 if image_found:
                     for ocred_image_name, ocred_image_text in self.get_ocred_images(xmlstr, root, namespaces, self.document, doc_part):
-                        last_text_found += f'Image text from OCR: "{ocred_image_text}"\n\n'
+                        ocr_text: str = f'Image text from OCR: "{ocred_image_text}"\n\n'
+                        last_text_found += ocr_text
+                        last_text_found_tokens += self.llm_utils.get_number_tokens(ocr_text)
                         self.logger.debug(f'Image name {ocred_image_name}, content: {ocred_image_text}')
 
             elif isinstance(doc_part, Table):
-                last_text_found += self.__convert_to_md_table(doc_part) + "\n"    
+                table_text: str = self.__convert_to_md_table(doc_part) + "\n"
+                last_text_found += table_text
+                last_text_found_tokens += self.llm_utils.get_number_tokens(table_text)
 
         text_for_request += last_text_found
         if len(text_for_request) > 0:
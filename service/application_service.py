@@ -4,8 +4,10 @@
 import re
 import os
 import sys
+import hashlib
+import json
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Callable
 import logging
 from domain.llm_utils import UtilsLogger, LLMUtils, DocumentType
 from domain.allm_access import AbstractLLMAccess
@@ -18,7 +20,29 @@ from infrastructure.llm_access import LLMAccess
 from infrastructure.llm_access_detailed import LLMAccessDetailed
 from infrastructure.llm_access_simulate import LLMAccessSimulateCalls
 from infrastructure.llm_access_detailed_simulate import LLMAccessDetailedSimulateCalls
+from infrastructure.llm_access_plan import LLMAccessPlan
+from infrastructure.llm_access_detailed_plan import LLMAccessDetailedPlan
+from infrastructure.async_llm_access import AsyncLLMAccess
+from infrastructure.response_cache import ResponseCache
+from infrastructure.rate_limiter import RateLimiter
+from infrastructure.single_flight import SingleFlight
+from infrastructure.endpoint_pool import EndpointPool
+from infrastructure.batch_file import BatchExportFile, BatchResults
+from infrastructure.llm_access_batch import LLMAccessBatchExport, LLMAccessBatchImport
+from infrastructure.llm_access_detailed_batch import LLMAccessDetailedBatchExport, LLMAccessDetailedBatchImport
+from infrastructure.cassette import Cassette, CassetteRecorder
+from infrastructure.llm_access_replay import LLMAccessReplay
+from infrastructure.llm_access_detailed_replay import LLMAccessDetailedReplay, AsyncLLMAccessReplay
+from infrastructure.run_report import RunReport
+from infrastructure.review_plan import ReviewPlan
+from infrastructure.budget import Budget
+from infrastructure.retry_policy import RetryPolicy
+from infrastructure.hedging_policy import HedgingPolicy
+from domain.model_profiles import ModelProfiles
+from infrastructure.checkpoint_journal import CheckpointJournal
+from infrastructure.review_manifest import ReviewManifest
 from infrastructure.content_out import ContentOut
+from service.shared_llm_resources import SharedLLMResources
 
 class ApplicationService:
     logger: logging.Logger = UtilsLogger.get_logger(__name__)
@@ -35,16 +59,52 @@ class ApplicationService:
                 ApplicationService.logger.error(f"File {file_path} could not be read.")
                 sys.exit(1)
         return text_file_content
+
+    def __get_component(self, name: str, factory: Callable[[], any]) -> any:
+        # In batch mode, all documents share one instance of the component
+        return factory() if self.shared_resources is None else self.shared_resources.get(name, factory)
+
+    @staticmethod
+    def get_default_to_document(document_path: str, detailed_analysis: bool) -> str:
+        return re.sub(r'\.[^\.]*$', '', str(document_path)) + ("-detailed" if detailed_analysis else "") + '.md'
+
+    @staticmethod
+    def __compute_configuration_key(configuration: Dict) -> str:
+        # A manifest is only valid for the revisions of a document reviewed with the same configuration
+        return hashlib.sha256(json.dumps(configuration, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def __compute_run_key(document_path: str, configuration_key: str) -> str:
+        # A journal is only valid for the same document reviewed with the same configuration
+        run_hash = hashlib.sha256()
+        with open(document_path, "rb") as document_file:
+            for block in iter(lambda: document_file.read(1024 * 1024), b""):
+                run_hash.update(block)
+        run_hash.update(configuration_key.encode("utf-8"))
+        return run_hash.hexdigest()
     
     def __init__(self, document_path: str, to_document: str, elements_to_skip: List, elements_to_keep: List, detailed_analysis: bool, reviewer_properties_path: str, \
                  simulate_calls_only: bool, llm_utils: LLMUtils, context_length: int, enable_ocr: bool,\
                  selected_text_slide_requests: List, selected_artistic_slide_requests: List, \
                  selected_deck_requests: List, selected_paragraphs_requests: List, split_request_per_paragraph_deepness: int,
-                 model_name: str, context_path: str, post_request_ids: List, document_type: DocumentType, consider_bullets_for_crlf: bool= True):
+                 model_name: str, context_path: str, post_request_ids: List, document_type: DocumentType, consider_bullets_for_crlf: bool= True,
+                 async_requests: bool = False, cache_dir: str = None, cache_readonly: bool = False, cache_max_size_mb: int = 1024,
+                 requests_per_minute: float = None, tokens_per_minute: float = None, stream_responses: bool = False,
+                 prefix_cache_layout: bool = False, endpoints_path: str = None, endpoint_routing: str = EndpointPool.LEAST_IN_FLIGHT,
+                 batch_export_path: str = None, batch_import_paths: List = None, model_context_window: int = None,
+                 max_attempts: int = RetryPolicy.DEFAULT_MAX_ATTEMPTS, connect_timeout: float = RetryPolicy.DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = RetryPolicy.DEFAULT_READ_TIMEOUT, hedge_percentile: float = None,
+                 hedge_max_extra_load: float = HedgingPolicy.DEFAULT_MAX_EXTRA_LOAD, record_cassette_path: str = None,
+                 replay_cassette_path: str = None, replay_latency_scale: float = 1.0, pipeline_post_requests: bool = False,
+                 schedule_whole_document: bool = False, resume: bool = False, journal_fsync: str = CheckpointJournal.FSYNC_PERIODIC,
+                 incremental: bool = False, plan: bool = False, max_prompt_tokens: int = None, max_cost: float = None, compact_serialization: bool = False,
+                 shared_resources: SharedLLMResources = None):
 
         ApplicationService.logger = ApplicationService.logger
+        self.shared_resources = shared_resources
         create_summary_findings: bool = True # TODO: We might need to find a better way to enable / disable it
         llm_utils.set_post_additional_requests(post_request_ids)
+        llm_utils.set_compact_serialization(compact_serialization)
         path = Path(document_path)
         if not path.is_file():
             ApplicationService.logger.error(f'The file {document_path} does not seem to exist ({os.getcwd()}).')
@@ -58,10 +118,11 @@ class ApplicationService:
                
         information_user: List = []
         if to_document is None:
-            to_document = re.sub(r'\.[^\.]*$', '', str(document_path))
-            if detailed_analysis:
-                to_document += "-detailed"
-            to_document += '.md'
+            to_document = self.get_default_to_document(document_path, detailed_analysis)
+        plan_path_prefix: str = re.sub(r'\.[^\.]*$', '', str(to_document))
+        if plan:
+            # A plan never overwrites the review it plans
+            to_document = plan_path_prefix + ".planned.md"
         
         ApplicationService.logger.info(f"Analyzing document: {document_path}, results will be stored in: {to_document}.")
         task_name: str = "Detailed Review" if detailed_analysis else "Review"
@@ -71,12 +132,93 @@ class ApplicationService:
             ApplicationService.logger.info(information)
             content_out.document(information)
             
+        offline_calls: bool = plan or simulate_calls_only or batch_export_path is not None or batch_import_paths is not None or replay_cassette_path is not None
         llm_access: AbstractLLMAccess = None
-        if detailed_analysis:
+        batch_export_file: BatchExportFile = None
+        if plan:
+            llm_access = LLMAccessDetailedPlan(ApplicationService.logger, reviewer_properties, model_name, llm_utils) if detailed_analysis else LLMAccessPlan(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+        elif replay_cassette_path is not None:
+            if detailed_analysis and async_requests:
+                llm_access = AsyncLLMAccessReplay(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+            elif detailed_analysis:
+                llm_access = LLMAccessDetailedReplay(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+            else:
+                llm_access = LLMAccessReplay(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+            llm_access.set_cassette(self.__get_component('cassette', lambda: Cassette(replay_cassette_path, ApplicationService.logger)), replay_latency_scale)
+        elif batch_import_paths is not None or batch_export_path is not None:
+            if batch_import_paths is not None:
+                llm_access = LLMAccessDetailedBatchImport(ApplicationService.logger, reviewer_properties, model_name, llm_utils) if detailed_analysis else LLMAccessBatchImport(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+                llm_access.set_batch_results(self.__get_component('batch_results', lambda: BatchResults(batch_import_paths, ApplicationService.logger)))
+            else:
+                llm_access = LLMAccessDetailedBatchExport(ApplicationService.logger, reviewer_properties, model_name, llm_utils) if detailed_analysis else LLMAccessBatchExport(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+            if batch_export_path is not None:
+                batch_export_file = self.__get_component('batch_export_file', lambda: BatchExportFile(batch_export_path, ApplicationService.logger))
+                llm_access.set_batch_export_file(batch_export_file)
+        elif detailed_analysis and async_requests and not simulate_calls_only:
+            llm_access = AsyncLLMAccess(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
+        elif detailed_analysis:
             llm_access = LLMAccessDetailed(ApplicationService.logger, reviewer_properties, model_name, llm_utils) if not simulate_calls_only else LLMAccessDetailedSimulateCalls(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
         else:
             llm_access = LLMAccess(ApplicationService.logger, reviewer_properties, model_name, llm_utils) if not simulate_calls_only else LLMAccessSimulateCalls(ApplicationService.logger, reviewer_properties, model_name, llm_utils)
 
+        response_cache: ResponseCache = None
+        # Replayed runs are benchmarks: every request goes to the cassette
+        if cache_dir is not None and not simulate_calls_only and not plan and replay_cassette_path is None:
+            response_cache = self.__get_component('response_cache', lambda: ResponseCache(cache_dir, ApplicationService.logger, cache_max_size_mb, cache_readonly))
+            llm_access.set_response_cache(response_cache)
+
+        # Planned runs estimate the warm up calls as well
+        llm_access.set_prefix_cache_layout(prefix_cache_layout, detailed_analysis and (plan or not offline_calls))
+
+        endpoint_pool: EndpointPool = None
+        if endpoints_path is not None and not offline_calls:
+            endpoint_pool = self.__get_component('endpoint_pool', lambda: EndpointPool.from_file(endpoints_path, ApplicationService.logger, endpoint_routing))
+            llm_access.set_endpoint_pool(endpoint_pool)
+
+        llm_access.set_retry_policy(RetryPolicy(max_attempts, connect_timeout=connect_timeout, read_timeout=read_timeout))
+
+        hedging_policy: HedgingPolicy = None
+        # Streamed duplicates would interleave in the temporary output
+        if hedge_percentile is not None and not offline_calls and not stream_responses:
+            hedging_policy = self.__get_component('hedging_policy', lambda: HedgingPolicy(hedge_percentile, hedge_max_extra_load))
+            llm_access.set_hedging_policy(hedging_policy)
+
+        cassette_recorder: CassetteRecorder = None
+        if record_cassette_path is not None and not offline_calls:
+            cassette_recorder = self.__get_component('cassette_recorder', lambda: CassetteRecorder(record_cassette_path, ApplicationService.logger))
+            llm_access.set_cassette_recorder(cassette_recorder)
+
+        single_flight: SingleFlight = self.__get_component('single_flight', SingleFlight)
+        llm_access.set_single_flight(single_flight)
+
+        if stream_responses and not offline_calls:
+            llm_access.set_stream_output(content_out)
+
+        model_profiles: ModelProfiles = ModelProfiles()
+        run_report: RunReport = RunReport(ApplicationService.logger, model_profiles)
+        llm_access.set_run_report(run_report)
+        if requests_per_minute is None:
+            requests_per_minute = model_profiles.get_value(model_name, ModelProfiles.REQUESTS_PER_MINUTE)
+        if tokens_per_minute is None:
+            tokens_per_minute = model_profiles.get_value(model_name, ModelProfiles.TOKENS_PER_MINUTE)
+        if (requests_per_minute is not None or tokens_per_minute is not None) and not offline_calls:
+            ApplicationService.logger.info(f"Rate limiting requests to {requests_per_minute} requests per minute and {tokens_per_minute} tokens per minute")
+            llm_access.set_rate_limiter(self.__get_component('rate_limiter', lambda: RateLimiter(ApplicationService.logger, requests_per_minute, tokens_per_minute)))
+
+        if model_context_window is None:
+            model_context_window = model_profiles.get_value(model_name, ModelProfiles.CONTEXT_WINDOW)
+        if model_context_window is not None:
+            reserved_output_tokens: int = model_profiles.get_value(model_name, ModelProfiles.RESERVED_OUTPUT_TOKENS, ModelProfiles.DEFAULT_RESERVED_OUTPUT_TOKENS)
+            ApplicationService.logger.info(f"Content exceeding the context window of {model_context_window} tokens ({reserved_output_tokens} reserved for the answer) is split before sending")
+            llm_access.set_context_window(model_context_window, reserved_output_tokens)
+        llm_access.set_model_profiles(model_profiles)
+
+        budget: Budget = None
+        if (max_prompt_tokens is not None or max_cost is not None) and not offline_calls:
+            # One budget per document: in batch mode and with the daemon, each review may have its own
+            budget = Budget(ApplicationService.logger, model_profiles, max_prompt_tokens, max_cost)
+            llm_access.set_budget(budget)
+
         document_to_llm: ADocumentToDatastructure = None
         if document_type == DocumentType.ppt:
             if elements_to_skip is not None and len(elements_to_skip) > 0:
@@ -105,7 +247,63 @@ class ApplicationService:
                  ApplicationService.logger, content_out, llm_utils, \
                  selected_paragraphs_requests, split_request_per_paragraph_deepness, llm_access,  context_length)
 
-        document_to_llm.process()
+        # Streamed answers of concurrent requests would interleave in the temporary output
+        if schedule_whole_document and not stream_responses:
+            ApplicationService.logger.info(f"All chunks are reviewed concurrently with at most {llm_access.get_number_workers()} requests in flight")
+            llm_access.set_max_in_flight(llm_access.get_number_workers())
+        if shared_resources is not None:
+            llm_access.set_in_flight_semaphore(shared_resources.in_flight_semaphore)
+        document_to_llm.set_scheduling(pipeline_post_requests and not stream_responses, schedule_whole_document and not stream_responses)
+        configuration_key: str = self.__compute_configuration_key({
+            'model_name': model_name, 'detailed_analysis': detailed_analysis, 'reviewer_properties': reviewer_properties,
+            'context': force_context_content, 'document_type': document_type.name, 'elements_to_skip': elements_to_skip,
+            'elements_to_keep': elements_to_keep, 'selected_text_slide_requests': selected_text_slide_requests,
+            'selected_artistic_slide_requests': selected_artistic_slide_requests, 'selected_deck_requests': selected_deck_requests,
+            'selected_paragraphs_requests': selected_paragraphs_requests, 'split_request_per_paragraph_deepness': split_request_per_paragraph_deepness,
+            'post_request_ids': post_request_ids, 'context_length': context_length, 'enable_ocr': enable_ocr,
+            'consider_bullets_for_crlf': consider_bullets_for_crlf, 'prefix_cache_layout': prefix_cache_layout, 'model_context_window': model_context_window,
+            'compact_serialization': compact_serialization
+        })
+        journal_path: str = re.sub(r'\.[^\.]*$', '', str(to_document)) + ".journal.jsonl"
+        # Simulated and exported answers are no reviews: they must not be resumed
+        if not plan and not simulate_calls_only and batch_export_path is None:
+            document_to_llm.set_journal(CheckpointJournal(journal_path, self.__compute_run_key(document_path, configuration_key), ApplicationService.logger, resume, journal_fsync))
+        if incremental and not plan:
+            manifest_path: str = re.sub(r'\.[^\.]*$', '', str(to_document)) + ".manifest.json"
+            ApplicationService.logger.info(f"Incremental review: only the content changed since the review stored in {manifest_path} is sent")
+            document_to_llm.set_manifest(ReviewManifest(manifest_path, configuration_key, ApplicationService.logger))
+        self.completed: bool = document_to_llm.process()
+        llm_access.close()
+        if prefix_cache_layout:
+            ApplicationService.logger.info(llm_access.get_prefix_cache_statistics_str())
+        # Shared components are reported and closed once the whole batch is done
+        if shared_resources is None:
+            ApplicationService.logger.info(single_flight.get_statistics_str())
+            if endpoint_pool is not None:
+                ApplicationService.logger.info(endpoint_pool.get_statistics_str())
+            if hedging_policy is not None:
+                ApplicationService.logger.info(hedging_policy.get_statistics_str())
+            if batch_export_file is not None:
+                batch_export_file.close()
+            if cassette_recorder is not None:
+                cassette_recorder.close()
+            if response_cache is not None:
+                ApplicationService.logger.info(response_cache.get_statistics_str())
+                response_cache.close()
+        if budget is not None:
+            ApplicationService.logger.info(budget.get_statistics_str())
+        if incremental:
+            run_report.set_sections(document_to_llm.get_sections())
+        # Simulated answers must not replace the report of the last real review
+        run_report.write(re.sub(r'\.[^\.]*$', '', str(to_document)) + (".simulated" if simulate_calls_only else ""))
+        self.to_document: str = to_document
+        self.run_report: RunReport = run_report
+        self.review_plan: ReviewPlan = None
+        if plan:
+            self.review_plan = ReviewPlan(run_report, llm_access.get_number_workers(), schedule_whole_document and not stream_responses, \
+                                          requests_per_minute, tokens_per_minute, max_prompt_tokens, max_cost)
+            self.review_plan.write(plan_path_prefix)
+            ApplicationService.logger.info(f"Review plan stored in {plan_path_prefix}.plan.md")
         ApplicationService.logger.info(f"Analysis stored in {to_document}")
         
    
\ No newline at end of file
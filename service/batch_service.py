@@ -0,0 +1,141 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict
+import logging
+import glob
+import json
+import time
+import os
+from domain.llm_utils import LLMUtils, DocumentType
+from service.application_service import ApplicationService
+from service.shared_llm_resources import SharedLLMResources
+
+class BatchService:
+    """
+    @brief Reviews many documents in one process: the document type is detected from the file extension, several
+    documents are parsed and reviewed at a time and all their LLM requests share one response cache, one rate limiter
+    and one bound of requests in flight. One review is written per document plus a batch summary.
+    """
+    DOCUMENT_TYPES: Dict[str, DocumentType] = {'.pptx': DocumentType.ppt, '.docx': DocumentType.doc, '.md': DocumentType.md, '.pdf': DocumentType.pdf}
+    SUMMARY_NAME: str = "batch_summary"
+
+    def __init__(self, logger: logging.Logger, document_paths: List[str], to_dir: str, parallel_documents: int, max_in_flight: int, \
+                 llm_utils: LLMUtils, detailed_analysis: bool, selected_document_type: DocumentType, elements_to_skip: List, elements_to_keep: List, \
+                 application_parameters: Dict):
+        self.logger = logger
+        self.document_paths = document_paths
+        self.to_dir = to_dir
+        self.parallel_documents = parallel_documents
+        self.llm_utils = llm_utils
+        self.detailed_analysis = detailed_analysis
+        # Slides or paragraphs to skip / keep are given for one document type only
+        self.selected_document_type = selected_document_type
+        self.elements_to_skip = elements_to_skip
+        self.elements_to_keep = elements_to_keep
+        self.application_parameters = application_parameters
+        self.shared_resources: SharedLLMResources = SharedLLMResources(logger, max_in_flight)
+
+    @staticmethod
+    def __is_review(path: Path) -> bool:
+        # Reviews and reports written next to the documents by a previous run are markdown files as well
+        if path.name.endswith(".report.md"):
+            return True
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            first_line: str = f.readline()
+        return first_line.startswith("# Review Of Filename") or first_line.startswith("# Detailed Review Of Filename")
+
+    @staticmethod
+    def list_documents(logger: logging.Logger, from_glob: str = None, from_dir: str = None) -> List[str]:
+        candidates: List[str] = glob.glob(from_glob, recursive=True) if from_glob is not None else \
+                                [ str(path) for path in Path(from_dir).rglob("*") ]
+        document_paths: List[str] = []
+        for candidate in sorted(candidates):
+            path: Path = Path(candidate)
+            if not path.is_file() or path.name.startswith("~$"):
+                continue
+            if path.suffix.lower() not in BatchService.DOCUMENT_TYPES:
+                logger.debug(f"Skipping {candidate}: unsupported document type.")
+                continue
+            if path.suffix.lower() == '.md' and BatchService.__is_review(path):
+                logger.debug(f"Skipping {candidate}: review written by document2llm.")
+                continue
+            document_paths.append(candidate)
+        return document_paths
+
+    def __get_to_document(self, document_path: str, used_names: set) -> str:
+        if self.to_dir is None:
+            return None
+        name: str = Path(document_path).stem + ("-detailed" if self.detailed_analysis else "")
+        unique_name: str = name
+        index: int = 2
+        while unique_name in used_names:
+            unique_name = f"{name}-{index}"
+            index += 1
+        used_names.add(unique_name)
+        return os.path.join(self.to_dir, f"{unique_name}.md")
+
+    @staticmethod
+    def review_document(logger: logging.Logger, document_path: str, document_type: DocumentType, llm_utils: LLMUtils, \
+                        shared_resources: SharedLLMResources, application_parameters: Dict) -> Dict:
+        # Document type, post requests and context are set on the utils: one copy per document
+        document_llm_utils: LLMUtils = llm_utils.copy()
+        document_llm_utils.set_document_type(document_type)
+        summary: Dict = {'document': document_path, 'type': document_type.name, 'status': 'failed', 'review': None}
+        start_time: float = time.monotonic()
+        logger.info(f"Starting review of {document_path} ({document_type.name})")
+        try:
+            application_service: ApplicationService = ApplicationService(document_path=document_path, llm_utils=document_llm_utils, document_type=document_type, \
+                                                                         shared_resources=shared_resources, **application_parameters)
+            total: Dict = application_service.run_report.get_report()['total']
+            summary.update({'status': 'completed' if application_service.completed else 'interrupted', 'review': application_service.to_document,
+                            'llm_calls': total['llm_calls'], 'cache_hits': total['cache_hits'], 'prompt_tokens': total['prompt_tokens'],
+                            'completion_tokens': total['completion_tokens'], 'estimated_cost': total['estimated_cost']})
+        except (Exception, SystemExit) as err:
+            logger.error(f"Review of {document_path} failed: {err}")
+            summary['error'] = str(err)
+        summary['duration'] = time.monotonic() - start_time
+        logger.info(f"Review of {document_path} {summary['status']} in {summary['duration']:.1f} seconds")
+        return summary
+
+    def __review(self, document_path: str, to_document: str) -> Dict:
+        document_type: DocumentType = self.DOCUMENT_TYPES[Path(document_path).suffix.lower()]
+        is_selected_type: bool = document_type == self.selected_document_type
+        return self.review_document(self.logger, document_path, document_type, self.llm_utils, self.shared_resources, \
+                                    dict(self.application_parameters, to_document=to_document, elements_to_skip=self.elements_to_skip if is_selected_type else [], \
+                                         elements_to_keep=self.elements_to_keep if is_selected_type else []))
+
+    @staticmethod
+    def to_markdown(summaries: List[Dict], duration: float) -> str:
+        lines: List[str] = ["# Batch review summary", "",
+                            f"{sum(1 for summary in summaries if summary['status'] == 'completed')} / {len(summaries)} documents reviewed in {duration:.1f} seconds, " + \
+                            f"{sum(summary.get('llm_calls', 0) for summary in summaries)} LLM calls, estimated cost {sum(summary.get('estimated_cost', 0) for summary in summaries):.4f}", "",
+                            "| Document | Type | Status | Review | LLM calls | Cache hits | Prompt tokens | Completion tokens | Estimated cost | Duration (s) |",
+                            "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |"]
+        for summary in summaries:
+            lines.append(f"| {summary['document']} | {summary['type']} | {summary['status']} | {summary['review'] or '-'} | {summary.get('llm_calls', '-')} | " + \
+                         f"{summary.get('cache_hits', '-')} | {summary.get('prompt_tokens', '-')} | {summary.get('completion_tokens', '-')} | " + \
+                         f"{summary.get('estimated_cost', 0):.4f} | {summary['duration']:.1f} |")
+        return "\n".join(lines) + "\n"
+
+    def run(self) -> List[Dict]:
+        self.logger.info(f"Reviewing {len(self.document_paths)} documents, {self.parallel_documents} at a time")
+        if self.to_dir is not None:
+            os.makedirs(self.to_dir, exist_ok=True)
+        used_names: set = set()
+        to_documents: List[str] = [ self.__get_to_document(document_path, used_names) for document_path in self.document_paths ]
+        start_time: float = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.parallel_documents, thread_name_prefix="doc2llm-document") as executor:
+            summaries: List[Dict] = list(executor.map(self.__review, self.document_paths, to_documents))
+        duration: float = time.monotonic() - start_time
+        self.shared_resources.close()
+
+        summary_path_prefix: str = os.path.join(self.to_dir or ".", self.SUMMARY_NAME)
+        with open(f"{summary_path_prefix}.json", "w", encoding="utf-8") as f:
+            json.dump({'duration': duration, 'documents': summaries}, f, indent=2)
+        with open(f"{summary_path_prefix}.md", "w", encoding="utf-8") as f:
+            f.write(self.to_markdown(summaries, duration))
+        self.logger.info(f"Batch summary stored in {summary_path_prefix}.md")
+        return summaries
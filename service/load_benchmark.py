@@ -0,0 +1,107 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict
+import argparse
+import logging
+import json
+import time
+import os
+from domain.llm_utils import LLMUtils, UtilsLogger
+from infrastructure.llm_access import LLMAccess
+from infrastructure.rate_limiter import RateLimiter
+from infrastructure.retry_policy import RetryPolicy
+from infrastructure.run_report import RunReport
+
+class LoadBenchmark:
+    """
+    @brief Sends synthetic review requests through LLMAccess with an increasing number of workers and measures
+    throughput and latency percentiles for each of them. Point OPENAI_BASE_URL to the mock server
+    (python -m infrastructure.mock_llm_server) to load test workers, retries and rate limiting without any quota.
+    """
+    def __init__(self, logger: logging.Logger, model_name: str, requests: int, prompt_words: int, max_attempts: int, \
+                 requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.logger = logger
+        self.model_name = model_name
+        self.requests = requests
+        self.prompt_words = prompt_words
+        self.max_attempts = max_attempts
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.llm_utils: LLMUtils = LLMUtils(["green", "purple"], "", "", "", "", "")
+
+    def __create_llm_access(self) -> LLMAccess:
+        # A fresh access per run: circuit breaker and rate limiter start from a clean state
+        llm_access: LLMAccess = LLMAccess(self.logger, LLMUtils.get_default_reviewer_properties(), self.model_name, self.llm_utils)
+        llm_access.set_retry_policy(RetryPolicy(self.max_attempts))
+        if self.requests_per_minute is not None or self.tokens_per_minute is not None:
+            llm_access.set_rate_limiter(RateLimiter(self.logger, self.requests_per_minute, self.tokens_per_minute))
+        return llm_access
+
+    def __send(self, llm_access: LLMAccess, index: int) -> Dict:
+        messages: List = [{"role": "system", "content": "You are a meticulous reviewer."},
+                          {"role": "user", "content": f"Request {index}: review the following text. " + " ".join(["lorem"] * self.prompt_words)}]
+        try:
+            return llm_access._send_request(messages, f"Load test request {index}", "Load test", 0.1, 0.1, None)
+        except Exception as err:
+            self.logger.warning(f"Load test request {index} failed: {err}")
+            return None
+
+    def run(self, workers: int) -> Dict:
+        llm_access: LLMAccess = self.__create_llm_access()
+        start_time: float = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            responses: List = list(executor.map(partial(self.__send, llm_access), range(self.requests)))
+        duration: float = time.monotonic() - start_time
+        succeeded: List[Dict] = [ response for response in responses if response is not None ]
+        latencies: List[float] = [ response['latency'] for response in succeeded ]
+        completion_tokens: int = sum(response.get('usage', {}).get('completion_tokens', 0) for response in succeeded)
+        return {
+            'workers': workers,
+            'requests': self.requests,
+            'failures': self.requests - len(succeeded),
+            'retries': sum(response['retries'] for response in succeeded),
+            'duration': duration,
+            'requests_per_second': len(succeeded) / duration,
+            'completion_tokens_per_second': completion_tokens / duration,
+            'latency_p50': RunReport.percentile(latencies, 50),
+            'latency_p95': RunReport.percentile(latencies, 95),
+            'latency_p99': RunReport.percentile(latencies, 99)
+        }
+
+    @staticmethod
+    def to_markdown(results: List[Dict]) -> str:
+        lines: List[str] = ["| Workers | Requests/s | Completion tokens/s | p50 (s) | p95 (s) | p99 (s) | Retries | Failures |",
+                            "|---|---|---|---|---|---|---|---|"]
+        for result in results:
+            latencies: List[str] = [ f"{result[key]:.2f}" if result[key] is not None else "-" for key in ['latency_p50', 'latency_p95', 'latency_p99'] ]
+            lines.append(f"| {result['workers']} | {result['requests_per_second']:.2f} | {result['completion_tokens_per_second']:.1f} | " + \
+                         " | ".join(latencies) + f" | {result['retries']} | {result['failures']} |")
+        return "\n".join(lines)
+
+if __name__ == "__main__":
+    csv_ = partial(str.split, sep=',')
+    parser = argparse.ArgumentParser(prog="python -m service.load_benchmark", description='Measure throughput and latency of LLMAccess for several numbers of workers against OPENAI_BASE_URL.')
+    parser.add_argument('--workers', type=csv_, default=["1", "2", "4", "8"], help='Comma separated numbers of concurrent workers to measure, default is 1,2,4,8')
+    parser.add_argument('--requests', type=int, default=40, help='Number of requests sent per number of workers, default is 40')
+    parser.add_argument('--prompt_words', type=int, default=200, help='Number of words of the synthetic content of each request, default is 200')
+    parser.add_argument('--model_name', type=str, default="mock", help='Model name sent with the requests, default is mock')
+    parser.add_argument('--max_attempts', type=int, default=RetryPolicy.DEFAULT_MAX_ATTEMPTS, help=f'Maximum number of attempts per request, default is {RetryPolicy.DEFAULT_MAX_ATTEMPTS}')
+    parser.add_argument('--requests_per_minute', type=float, help='Rate limit the requests per minute')
+    parser.add_argument('--tokens_per_minute', type=float, help='Rate limit the tokens per minute')
+    parser.add_argument('--output', type=str, help='JSON file receiving the measures of every run')
+    args = parser.parse_args()
+
+    logger: logging.Logger = UtilsLogger.get_logger(__name__)
+    logger.info(f"Load testing {os.getenv('OPENAI_BASE_URL')}")
+    load_benchmark: LoadBenchmark = LoadBenchmark(logger, args.model_name, args.requests, args.prompt_words, args.max_attempts, args.requests_per_minute, args.tokens_per_minute)
+    results: List[Dict] = []
+    for workers in args.workers:
+        results.append(load_benchmark.run(int(workers)))
+        logger.info(f"{workers} workers: {results[-1]['requests_per_second']:.2f} requests per second, p95 latency {results[-1]['latency_p95']} seconds")
+    print(LoadBenchmark.to_markdown(results))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
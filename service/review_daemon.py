@@ -0,0 +1,224 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from pathlib import Path
+from typing import List, Dict
+import itertools
+import threading
+import logging
+import time
+import uuid
+from domain.llm_utils import LLMUtils, DocumentType
+from service.application_service import ApplicationService
+from service.batch_service import BatchService
+from service.shared_llm_resources import SharedLLMResources
+
+class ReviewJob:
+    QUEUED: str = "queued"
+    RUNNING: str = "running"
+    COMPLETED: str = "completed"
+    INTERRUPTED: str = "interrupted"
+    FAILED: str = "failed"
+    CANCELLED: str = "cancelled"
+    FINISHED: List[str] = [COMPLETED, INTERRUPTED, FAILED, CANCELLED]
+
+    def __init__(self, sequence: int, client: str, priority: int, document_path: str, document_type: DocumentType, llm_utils: LLMUtils, parameters: Dict):
+        self.job_id: str = uuid.uuid4().hex[:12]
+        self.sequence = sequence
+        self.client = client
+        self.priority = priority
+        self.document_path = document_path
+        self.document_type = document_type
+        self.llm_utils = llm_utils
+        self.parameters = parameters
+        self.status: str = self.QUEUED
+        self.summary: Dict = None
+        self.submitted: float = time.time()
+        self.started: float = None
+        self.finished: float = None
+
+    def get_to_document(self) -> str:
+        if self.parameters.get('to_document') is not None:
+            return self.parameters['to_document']
+        return ApplicationService.get_default_to_document(self.document_path, self.parameters.get('detailed_analysis', False))
+
+    def to_dict(self) -> Dict:
+        return {'id': self.job_id, 'client': self.client, 'priority': self.priority, 'document': self.document_path,
+                'type': self.document_type.name, 'status': self.status, 'review': self.get_to_document(), 'summary': self.summary,
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+class ReviewDaemon:
+    """
+    @brief Long running review service: converters, request catalogs, tokenizer, OCR models and HTTP connection
+    pools are loaded once and every job shares the response cache, rate limiter and requests in flight.
+    Jobs are taken by priority (highest first, then in submission order) while each client runs at most
+    client_quota jobs at a time. The options of a job override the options the daemon was started with, only
+    the options of JOB_OPTIONS can be given per job and their paths must be under the root directory.
+    Finished jobs are forgotten after job_ttl seconds or once more than max_finished_jobs are kept.
+    """
+    # Command line names accepted for the review parameters
+    OPTION_ALIASES: Dict[str, str] = {
+        'from_document': 'document_path', 'post_requests': 'post_request_ids', 'batch_export': 'batch_export_path',
+        'batch_import': 'batch_import_paths', 'record_cassette': 'record_cassette_path', 'replay_cassette': 'replay_cassette_path',
+        'skip_slides': 'elements_to_skip', 'skip_paragraphs': 'elements_to_skip', 'only_slides': 'elements_to_keep', 'only_paragraphs': 'elements_to_keep',
+        'text_slide_requests': 'selected_text_slide_requests', 'artistic_slide_requests': 'selected_artistic_slide_requests',
+        'deck_requests': 'selected_deck_requests', 'paragraphs_requests': 'selected_paragraphs_requests'
+    }
+    # Given as "1,3-5,7" on the command line
+    ID_LIST_OPTIONS: List[str] = ['post_request_ids', 'selected_text_slide_requests', 'selected_artistic_slide_requests',
+                                  'selected_deck_requests', 'selected_paragraphs_requests']
+    # Review parameters a client may set per job
+    JOB_OPTIONS: List[str] = ['document_path', 'document_type', 'to_document', 'elements_to_skip', 'elements_to_keep', 'detailed_analysis',
+                              'force_temperature', 'force_top_p', 'selected_text_slide_requests', 'selected_artistic_slide_requests',
+                              'selected_deck_requests', 'selected_paragraphs_requests', 'split_request_per_paragraph_deepness', 'post_request_ids',
+                              'context_path', 'reviewer_properties_path', 'context_length', 'simulate_calls_only', 'async_requests',
+                              'stream_responses', 'prefix_cache_layout', 'pipeline_post_requests', 'schedule_whole_document', 'resume',
+                              'incremental', 'plan', 'max_prompt_tokens', 'max_cost', 'compact_serialization']
+    # Files read or written by a job: they must be under the root directory of the daemon
+    PATH_OPTIONS: List[str] = ['document_path', 'to_document', 'context_path', 'reviewer_properties_path']
+    # Configure the components shared by all the jobs: they are given when starting the daemon
+    SHARED_OPTIONS: List[str] = ['model_name', 'cache_dir', 'cache_readonly', 'cache_max_size_mb', 'requests_per_minute', 'tokens_per_minute',
+                                 'endpoints_path', 'endpoint_routing', 'batch_export_path', 'batch_import_paths', 'record_cassette_path',
+                                 'replay_cassette_path', 'replay_latency_scale', 'hedge_percentile', 'hedge_max_extra_load']
+    DEFAULT_JOB_TTL: float = 3600.0
+    DEFAULT_MAX_FINISHED_JOBS: int = 1000
+
+    def __init__(self, logger: logging.Logger, llm_utils: LLMUtils, application_parameters: Dict, jobs_in_parallel: int, client_quota: int, max_in_flight: int, \
+                 root_dir: str, job_ttl: float = DEFAULT_JOB_TTL, max_finished_jobs: int = DEFAULT_MAX_FINISHED_JOBS):
+        self.logger = logger
+        self.llm_utils = llm_utils
+        # Review document and slides / paragraphs to skip or keep only make sense per job
+        self.application_parameters: Dict = dict({'to_document': None, 'elements_to_skip': [], 'elements_to_keep': []}, **application_parameters)
+        self.client_quota = client_quota
+        self.root_dir: Path = Path(root_dir).expanduser().resolve()
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.shared_resources: SharedLLMResources = SharedLLMResources(logger, max_in_flight)
+        self.jobs: Dict[str, ReviewJob] = {}
+        self.sequence: itertools.count = itertools.count()
+        self.condition: threading.Condition = threading.Condition()
+        self.running: bool = True
+        self.workers: List[threading.Thread] = [ threading.Thread(target=self.__work, name=f"doc2llm-job-{index}", daemon=True) for index in range(jobs_in_parallel) ]
+        for worker in self.workers:
+            worker.start()
+
+    def __normalize_options(self, options: Dict) -> Dict:
+        parameters: Dict = {}
+        for name, value in options.items():
+            name = self.OPTION_ALIASES.get(name, name)
+            if name in self.ID_LIST_OPTIONS and isinstance(value, str):
+                value = LLMUtils.get_list_parameters(value.split(','))
+            elif name in ['elements_to_skip', 'elements_to_keep', 'batch_import_paths'] and isinstance(value, str):
+                value = value.split(',')
+            parameters[name] = value
+        shared_options: List[str] = [ name for name in parameters if name in self.SHARED_OPTIONS ]
+        if len(shared_options) > 0:
+            raise ValueError(f"Options {shared_options} configure components shared by all the jobs, they can only be given when starting the daemon.")
+        unknown_options: List[str] = [ name for name in parameters if name not in self.JOB_OPTIONS ]
+        if len(unknown_options) > 0:
+            raise ValueError(f"Unknown options or options not allowed per job {unknown_options}.")
+        for name in self.PATH_OPTIONS:
+            if parameters.get(name) is not None:
+                parameters[name] = self.__resolve_path(name, parameters[name])
+        return parameters
+
+    def __resolve_path(self, name: str, path: str) -> str:
+        # Relative paths are taken from the root directory, symbolic links and .. cannot leave it
+        resolved_path: Path = (self.root_dir / Path(str(path)).expanduser()).resolve()
+        if not resolved_path.is_relative_to(self.root_dir):
+            raise ValueError(f"Option {name}: {path} is not under the root directory {self.root_dir} of the daemon.")
+        return str(resolved_path)
+
+    def __evict_finished_jobs(self) -> None:
+        # Called with the condition held
+        now: float = time.time()
+        finished_jobs: List[ReviewJob] = sorted([ job for job in self.jobs.values() if job.status in ReviewJob.FINISHED ], key=lambda job: job.finished)
+        number_to_drop: int = len(finished_jobs) - self.max_finished_jobs
+        for index, job in enumerate(finished_jobs):
+            if index < number_to_drop or now - job.finished > self.job_ttl:
+                del self.jobs[job.job_id]
+
+    def submit(self, options: Dict, client: str = "default", priority: int = 0) -> ReviewJob:
+        parameters: Dict = self.__normalize_options(options)
+        document_path: str = parameters.pop('document_path', None)
+        if document_path is None or not Path(document_path).is_file():
+            raise ValueError(f"Document {document_path} does not exist.")
+        document_type_name: str = parameters.pop('document_type', None)
+        if document_type_name is not None and document_type_name not in DocumentType.__members__:
+            raise ValueError(f"Unknown document type {document_type_name}, expected one of {list(DocumentType.__members__)}.")
+        document_type: DocumentType = DocumentType[document_type_name] if document_type_name is not None else BatchService.DOCUMENT_TYPES.get(Path(document_path).suffix.lower())
+        if document_type is None:
+            raise ValueError(f"Cannot detect the type of document {document_path}, please give document_type.")
+        # Temperature and top_p are forced on a copy of the request catalogs
+        job_llm_utils: LLMUtils = self.llm_utils.copy()
+        force_temperature: float = parameters.pop('force_temperature', None)
+        force_top_p: float = parameters.pop('force_top_p', None)
+        if force_temperature is not None:
+            job_llm_utils.set_default_temperature(force_temperature)
+        if force_top_p is not None:
+            job_llm_utils.set_default_top_p(force_top_p)
+
+        with self.condition:
+            self.__evict_finished_jobs()
+            job: ReviewJob = ReviewJob(next(self.sequence), client, priority, document_path, document_type, job_llm_utils, dict(self.application_parameters, **parameters))
+            self.jobs[job.job_id] = job
+            self.condition.notify_all()
+        self.logger.info(f"Job {job.job_id} queued: {document_path} for client {client} with priority {priority}")
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        # Only queued jobs can be cancelled: a running review cannot be stopped half way
+        with self.condition:
+            job: ReviewJob = self.jobs.get(job_id)
+            if job is None or job.status != ReviewJob.QUEUED:
+                return False
+            job.status = ReviewJob.CANCELLED
+            job.finished = time.time()
+            return True
+
+    def get_job(self, job_id: str) -> ReviewJob:
+        return self.jobs.get(job_id)
+
+    def get_jobs(self, client: str = None) -> List[ReviewJob]:
+        with self.condition:
+            self.__evict_finished_jobs()
+            return [ job for job in self.jobs.values() if client is None or job.client == client ]
+
+    def get_queue_position(self, job: ReviewJob) -> int:
+        with self.condition:
+            queued_jobs: List[ReviewJob] = sorted([ queued for queued in self.jobs.values() if queued.status == ReviewJob.QUEUED ], key=lambda queued: (-queued.priority, queued.sequence))
+            return queued_jobs.index(job) if job in queued_jobs else None
+
+    def __get_next_job(self) -> ReviewJob:
+        running_per_client: Dict[str, int] = {}
+        for job in self.jobs.values():
+            if job.status == ReviewJob.RUNNING:
+                running_per_client[job.client] = running_per_client.get(job.client, 0) + 1
+        candidates: List[ReviewJob] = [ job for job in self.jobs.values() if job.status == ReviewJob.QUEUED and running_per_client.get(job.client, 0) < self.client_quota ]
+        return min(candidates, key=lambda job: (-job.priority, job.sequence)) if len(candidates) > 0 else None
+
+    def __work(self) -> None:
+        while True:
+            with self.condition:
+                job: ReviewJob = self.__get_next_job()
+                while job is None and self.running:
+                    self.condition.wait()
+                    job = self.__get_next_job()
+                if not self.running:
+                    return
+                job.status = ReviewJob.RUNNING
+                job.started = time.time()
+            job.summary = BatchService.review_document(self.logger, job.document_path, job.document_type, job.llm_utils, self.shared_resources, job.parameters)
+            with self.condition:
+                job.status = job.summary['status']
+                job.finished = time.time()
+                # A slot of the client is free again
+                self.condition.notify_all()
+
+    def shutdown(self) -> None:
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.shared_resources.close()
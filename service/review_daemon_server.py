@@ -0,0 +1,212 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import urlparse, parse_qs
+from pathlib import Path
+from typing import List, Dict
+from logging import Logger
+import threading
+import secrets
+import hmac
+import json
+import time
+import os
+from service.review_daemon import ReviewDaemon, ReviewJob
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads: bool = True
+
+class ReviewDaemonServer:
+    """
+    @brief Local HTTP API of the review daemon, on a TCP port or a Unix socket:
+    POST /jobs {"options": {...}, "client": ..., "priority": ...} queues a review, GET /jobs and GET /jobs/<id> report
+    the status, GET /jobs/<id>/stream follows the review while it is written, GET /jobs/<id>/result returns it
+    and DELETE /jobs/<id> cancels a queued job.
+    Every request but GET /health carries the header "Authorization: Bearer <token>", the token being generated at
+    start up and written to token_path, readable only by the user. Jobs are posted as application/json.
+    """
+    STREAM_POLL_PERIOD: float = 0.2
+
+    def __init__(self, review_daemon: ReviewDaemon, logger: Logger, token_path: str, host: str = "127.0.0.1", port: int = 8765, socket_path: str = None):
+        self.review_daemon = review_daemon
+        self.logger = logger
+        self.socket_path = socket_path
+        self.token: str = secrets.token_urlsafe(32)
+        self.__write_token(token_path)
+        if socket_path is not None:
+            Path(socket_path).unlink(missing_ok=True)
+            self.http_server: ThreadingUnixHTTPServer = ThreadingUnixHTTPServer(socket_path, self.__create_handler())
+        else:
+            self.http_server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), self.__create_handler())
+            self.http_server.daemon_threads = True
+
+    def __write_token(self, token_path: str) -> None:
+        token_file: Path = Path(token_path).expanduser()
+        token_file.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        token_file.unlink(missing_ok=True)
+        with os.fdopen(os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as token_stream:
+            token_stream.write(self.token)
+        self.logger.info(f"Review daemon token written to {token_file}")
+
+    def is_authorized(self, authorization: str) -> bool:
+        return authorization is not None and hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {self.token}".encode("utf-8"))
+
+    def get_address(self) -> str:
+        if self.socket_path is not None:
+            return f"unix://{self.socket_path}"
+        host, port = self.http_server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        self.logger.info(f"Review daemon listening on {self.get_address()}")
+        try:
+            self.http_server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("Review daemon stopping: waiting for the running jobs.")
+        self.shutdown()
+
+    def start(self) -> None:
+        threading.Thread(target=self.http_server.serve_forever, name="doc2llm-review-daemon-server", daemon=True).start()
+
+    def shutdown(self) -> None:
+        self.http_server.server_close()
+        if self.socket_path is not None:
+            Path(self.socket_path).unlink(missing_ok=True)
+        self.review_daemon.shutdown()
+
+    def __create_handler(self) -> type:
+        server: ReviewDaemonServer = self
+
+        class ReviewDaemonRequestHandler(BaseHTTPRequestHandler):
+            protocol_version: str = "HTTP/1.1"
+
+            def log_message(self, format: str, *args) -> None:
+                server.logger.debug(f"Review daemon: {format % args}")
+
+            def __send(self, status: int, body: bytes, content_type: str) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __send_json(self, status: int, body: any) -> None:
+                self.__send(status, json.dumps(body, indent=2).encode("utf-8"), "application/json")
+
+            def __send_chunk(self, data: bytes) -> None:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def __check_authorization(self) -> bool:
+                if server.is_authorized(self.headers.get('Authorization')):
+                    return True
+                # The body is not read: the connection cannot be reused
+                self.close_connection = True
+                self.__send_json(401, {'error': "Missing or invalid bearer token"})
+                return False
+
+            def __get_job(self, job_id: str) -> ReviewJob:
+                job: ReviewJob = server.review_daemon.get_job(job_id)
+                if job is None:
+                    self.__send_json(404, {'error': f"Unknown job {job_id}"})
+                return job
+
+            def __get_job_status(self, job: ReviewJob) -> Dict:
+                return dict(job.to_dict(), queue_position=server.review_daemon.get_queue_position(job))
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                parts: List[str] = [ part for part in url.path.split('/') if len(part) > 0 ]
+                if parts == ['health']:
+                    self.__send_json(200, {'status': 'ok'})
+                elif not self.__check_authorization():
+                    return
+                elif parts == ['jobs']:
+                    client: str = parse_qs(url.query).get('client', [None])[0]
+                    self.__send_json(200, [ job.to_dict() for job in server.review_daemon.get_jobs(client) ])
+                elif len(parts) == 2 and parts[0] == 'jobs':
+                    job: ReviewJob = self.__get_job(parts[1])
+                    if job is not None:
+                        self.__send_json(200, self.__get_job_status(job))
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'result':
+                    job: ReviewJob = self.__get_job(parts[1])
+                    if job is None:
+                        return
+                    if job.status not in [ReviewJob.COMPLETED, ReviewJob.INTERRUPTED] or not Path(job.get_to_document()).is_file():
+                        self.__send_json(409, {'error': f"Job {job.job_id} is {job.status}, no review yet", 'status': job.status})
+                        return
+                    with open(job.get_to_document(), "rb") as review_file:
+                        self.__send(200, review_file.read(), "text/markdown; charset=utf-8")
+                elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'stream':
+                    job: ReviewJob = self.__get_job(parts[1])
+                    if job is not None:
+                        self.__stream(job)
+                else:
+                    self.__send_json(404, {'error': f"Unknown path {self.path}"})
+
+            def __stream(self, job: ReviewJob) -> None:
+                # Follows the temporary review written while the job runs, then reports how the job ended
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                temporary_path: str = f"{job.get_to_document()}.temporary"
+                temporary_file = None
+                try:
+                    while True:
+                        finished: bool = job.status in ReviewJob.FINISHED
+                        if temporary_file is None and job.status == ReviewJob.RUNNING and os.path.isfile(temporary_path):
+                            temporary_file = open(temporary_path, "rb")
+                        data: bytes = temporary_file.read() if temporary_file is not None else b""
+                        if len(data) > 0:
+                            self.__send_chunk(data)
+                        if finished:
+                            break
+                        time.sleep(server.STREAM_POLL_PERIOD)
+                    self.__send_chunk(f"\n[Job {job.job_id} {job.status}]\n".encode("utf-8"))
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    server.logger.debug(f"Client stopped following job {job.job_id}")
+                finally:
+                    if temporary_file is not None:
+                        temporary_file.close()
+
+            def do_POST(self) -> None:
+                if not self.__check_authorization():
+                    return
+                if [ part for part in urlparse(self.path).path.split('/') if len(part) > 0 ] != ['jobs']:
+                    self.__send_json(404, {'error': f"Unknown path {self.path}"})
+                    return
+                if self.headers.get('Content-Type', '').split(';')[0].strip().lower() != "application/json":
+                    self.close_connection = True
+                    self.__send_json(415, {'error': "Jobs are posted as application/json"})
+                    return
+                try:
+                    request: Dict = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                    if not isinstance(request, dict) or not isinstance(request.get('options', {}), dict):
+                        raise ValueError("Expected a JSON object with an object of options")
+                    job: ReviewJob = server.review_daemon.submit(request.get('options', {}), str(request.get('client', 'default')), int(request.get('priority', 0)))
+                except (ValueError, TypeError) as err:
+                    self.__send_json(400, {'error': str(err)})
+                    return
+                self.__send_json(202, self.__get_job_status(job))
+
+            def do_DELETE(self) -> None:
+                if not self.__check_authorization():
+                    return
+                parts: List[str] = [ part for part in urlparse(self.path).path.split('/') if len(part) > 0 ]
+                if len(parts) != 2 or parts[0] != 'jobs':
+                    self.__send_json(404, {'error': f"Unknown path {self.path}"})
+                    return
+                job: ReviewJob = self.__get_job(parts[1])
+                if job is None:
+                    return
+                if not server.review_daemon.cancel(job.job_id):
+                    self.__send_json(409, {'error': f"Job {job.job_id} is {job.status}, only queued jobs can be cancelled", 'status': job.status})
+                    return
+                self.__send_json(200, job.to_dict())
+
+        return ReviewDaemonRequestHandler
@@ -0,0 +1,31 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+from typing import Dict, Callable
+from logging import Logger
+import threading
+
+class SharedLLMResources:
+    """
+    @brief LLM components shared by all the documents reviewed by one process (batch mode): response cache, rate limiter,
+    single flight, endpoint pool, recorders and one bound on the requests in flight for all documents together.
+    Each component is created by the first document needing it and closed once the batch is done.
+    """
+    def __init__(self, logger: Logger, max_in_flight: int):
+        self.logger = logger
+        self.in_flight_semaphore: threading.BoundedSemaphore = threading.BoundedSemaphore(max_in_flight)
+        self.lock: threading.Lock = threading.Lock()
+        self.components: Dict[str, any] = {}
+
+    def get(self, name: str, factory: Callable[[], any]) -> any:
+        with self.lock:
+            if name not in self.components:
+                self.components[name] = factory()
+            return self.components[name]
+
+    def close(self) -> None:
+        for name, component in self.components.items():
+            if hasattr(component, 'get_statistics_str'):
+                self.logger.info(f"{name}: {component.get_statistics_str()}")
+            if hasattr(component, 'close'):
+                component.close()
@@ -0,0 +1,56 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+import tempfile
+import logging
+import json
+import os
+from typing import List
+from infrastructure.checkpoint_journal import CheckpointJournal
+
+class TestCheckpointJournal(unittest.TestCase):
+    KEY: str = "document and configuration hash"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.journal_path: str = os.path.join(self.directory.name, "review.md.journal.jsonl")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __write_journal(self, lines: List) -> None:
+        with open(self.journal_path, "w", encoding="utf-8") as journal_file:
+            journal_file.write("".join([ f"{line}\n" for line in lines ]))
+
+    def test_resume_reads_the_recorded_chunks(self):
+        journal: CheckpointJournal = CheckpointJournal(self.journal_path, self.KEY, self.logger, False)
+        journal.record("slide 1", ["Reviewed"])
+        journal.close(False)
+        self.assertEqual(CheckpointJournal(self.journal_path, self.KEY, self.logger, True).get("slide 1"), ["Reviewed"])
+
+    def test_journal_of_another_run_is_not_resumed(self):
+        self.__write_journal([json.dumps({'key': "another key"}), json.dumps({'chunk': "slide 1", 'results': ["Reviewed"]})])
+        self.assertIsNone(CheckpointJournal(self.journal_path, self.KEY, self.logger, True).get("slide 1"))
+
+    def test_corrupt_header_starts_from_scratch(self):
+        for header in ['{"key": "document and', '["not", "an", "object"]']:
+            self.__write_journal([header, json.dumps({'chunk': "slide 1", 'results': ["Reviewed"]})])
+            with self.assertLogs(self.logger, logging.WARNING):
+                journal: CheckpointJournal = CheckpointJournal(self.journal_path, self.KEY, self.logger, True)
+            self.assertIsNone(journal.get("slide 1"))
+
+    def test_unreadable_records_are_skipped(self):
+        self.__write_journal([json.dumps({'key': self.KEY}), '{"chunk": "slide', json.dumps({'chunk': "slide 2"}),
+                              json.dumps(["slide 3"]), json.dumps({'chunk': "slide 4", 'results': ["Reviewed"]}), '{"chunk": "slide 5"'])
+        journal: CheckpointJournal = CheckpointJournal(self.journal_path, self.KEY, self.logger, True)
+        self.assertEqual(journal.get("slide 4"), ["Reviewed"])
+        for chunk_id in ["slide 2", "slide 3", "slide 5"]:
+            self.assertIsNone(journal.get(chunk_id))
+        journal.record("slide 6", ["Reviewed"])
+        journal.close(False)
+        self.assertEqual(CheckpointJournal(self.journal_path, self.KEY, self.logger, True).get("slide 6"), ["Reviewed"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+from typing import List
+from pptx import Presentation
+from pptx.util import Inches, Pt
+from domain.llm_utils import LLMUtils
+from infrastructure.ppt_reader import PPTReader
+
+class TestCompactSerialization(unittest.TestCase):
+    SLIDE_TEXTS: List = ["Quarterly results exceed the forecast in every region",
+                         "Revenue grew by twelve percent while operating costs stayed flat",
+                         "Next steps: consolidate suppliers and hire two account managers"]
+    # Token reduction measured with the heuristic tokenizer: 53% for text only slides, 79% with the graphical details
+    MIN_TEXT_REDUCTION: float = 0.5
+    MIN_GRAPHICAL_REDUCTION: float = 0.75
+
+    def setUp(self):
+        presentation = Presentation()
+        self.slide_size = (presentation.slide_width, presentation.slide_height)
+        self.slides: List = []
+        for slide_index in range(3):
+            slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+            for text_index, text in enumerate(self.SLIDE_TEXTS):
+                text_box = slide.shapes.add_textbox(Inches(1), Inches(1 + text_index * 1.5), Inches(8), Inches(1))
+                text_box.text_frame.text = f"{text} ({slide_index + 1})"
+                text_box.text_frame.paragraphs[0].runs[0].font.size = Pt(18)
+                text_box.text_frame.paragraphs[0].runs[0].font.bold = text_index == 0
+            table = slide.shapes.add_table(2, 3, Inches(1), Inches(5.5), Inches(8), Inches(1)).table
+            for column, header in enumerate(["Region", "Revenue", "Growth"]):
+                table.cell(0, column).text = header
+                table.cell(1, column).text = f"Value {slide_index}-{column}"
+            self.slides.append(slide)
+
+        self.llm_utils: LLMUtils = LLMUtils([], "", "", "", "", "")
+
+    def __get_shapes(self, slide_number: int, slide, need_graphical: bool) -> List:
+        shape_descriptions: List = []
+        for shape in slide.shapes:
+            if shape.has_text_frame:
+                PPTReader.add_text_box_info(slide_number, shape, need_graphical, shape_descriptions, self.slide_size)
+            elif shape.has_table:
+                table_str: str = "".join(["\n|" + "|".join([cell.text for cell in row.cells]) + "|" for row in shape.table.rows])
+                PPTReader.add_table_info(slide_number, shape, shape.table, table_str, need_graphical, shape_descriptions, self.slide_size)
+        return [ shape['json']['shape'] for shape in PPTReader.get_sorted_shapes_by_pos_y(shape_descriptions) ]
+
+    def __count_tokens(self, compact: bool, need_graphical: bool) -> float:
+        self.llm_utils.set_compact_serialization(compact)
+        number_tokens: float = 0
+        for slide_index, slide in enumerate(self.slides):
+            shapes: List = self.__get_shapes(slide_index + 1, slide, need_graphical)
+            content: List = PPTReader.get_compact_shapes(shapes) if compact else shapes
+            number_tokens += self.llm_utils.get_number_tokens(self.llm_utils.serialize_content(content))
+        return number_tokens
+
+    def __check_reduction(self, need_graphical: bool, min_reduction: float) -> None:
+        verbose_tokens: float = self.__count_tokens(compact=False, need_graphical=need_graphical)
+        compact_tokens: float = self.__count_tokens(compact=True, need_graphical=need_graphical)
+        reduction: float = 1 - compact_tokens / verbose_tokens
+        self.assertGreaterEqual(reduction, min_reduction,
+                                f"Compact serialization saves {reduction:.0%} of the tokens ({compact_tokens:.0f} instead of {verbose_tokens:.0f}), " + \
+                                f"expected at least {min_reduction:.0%}")
+
+    def test_compact_text_slides_use_fewer_tokens(self):
+        self.__check_reduction(False, self.MIN_TEXT_REDUCTION)
+
+    def test_compact_graphical_slides_use_fewer_tokens(self):
+        self.__check_reduction(True, self.MIN_GRAPHICAL_REDUCTION)
+
+    def test_compact_keeps_slide_texts(self):
+        self.llm_utils.set_compact_serialization(True)
+        serialized: str = self.llm_utils.serialize_content(PPTReader.get_compact_shapes(self.__get_shapes(1, self.slides[0], True)))
+        self.assertTrue(serialized.startswith("Slide 1\n"))
+        for text in self.SLIDE_TEXTS:
+            self.assertIn(f"{text} (1)", serialized)
+        self.assertIn("Region|Revenue|Growth", serialized)
+
+if __name__ == '__main__':
+    unittest.main()
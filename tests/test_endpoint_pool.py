@@ -0,0 +1,101 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+import threading
+import asyncio
+import logging
+import time
+from typing import List
+from infrastructure.mock_llm_server import MockLLMServer
+from infrastructure.endpoint_pool import Endpoint, EndpointPool
+
+class TestEndpointPool(unittest.TestCase):
+    HEALTH_CHECK_INTERVAL: float = 0.5
+
+    def setUp(self):
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.servers: List[MockLLMServer] = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+
+    def __start_server(self, ttft_median: float = 0.01, server_error_ratio: float = 0.0) -> str:
+        server: MockLLMServer = MockLLMServer(port=0, ttft_median=ttft_median, ttft_sigma=0.01, tokens_per_second=1000.0, tokens_per_second_stddev=0.0, \
+                                              output_tokens=5, output_tokens_stddev=0, server_error_ratio=server_error_ratio, seed=1)
+        server.start()
+        self.servers.append(server)
+        return server.get_base_url()
+
+    def __get_pool(self, endpoints: List[Endpoint], routing: str = EndpointPool.LEAST_IN_FLIGHT) -> EndpointPool:
+        return EndpointPool(endpoints, self.logger, routing, failure_threshold=2, health_check_interval=self.HEALTH_CHECK_INTERVAL)
+
+    def __send(self, endpoint_pool: EndpointPool, exclude: Endpoint = None) -> Endpoint:
+        endpoint: Endpoint = endpoint_pool.acquire(exclude)
+        start_time: float = time.monotonic()
+        try:
+            endpoint.client.chat.completions.create(model="mock", messages=[{'role': 'user', 'content': "Review this"}])
+        except Exception as err:
+            endpoint_pool.release(endpoint, err=err)
+            return endpoint
+        endpoint_pool.release(endpoint, time.monotonic() - start_time)
+        return endpoint
+
+    def test_least_in_flight_routing_follows_the_weights(self):
+        endpoint_pool: EndpointPool = self.__get_pool([Endpoint(self.__start_server(), "x", 1.0, name="single"),
+                                                       Endpoint(self.__start_server(), "x", 2.0, name="double")])
+        acquired: List[Endpoint] = [ endpoint_pool.acquire() for _ in range(6) ]
+        self.assertEqual(sorted([ endpoint.name for endpoint in acquired ]), ["double"] * 4 + ["single"] * 2)
+        for endpoint in acquired:
+            endpoint_pool.release(endpoint)
+        self.assertTrue(all(endpoint.in_flight == 0 for endpoint in endpoint_pool.endpoints))
+
+    def test_lowest_latency_routing_prefers_the_fastest_endpoint(self):
+        endpoint_pool: EndpointPool = self.__get_pool([Endpoint(self.__start_server(ttft_median=0.3), "x", name="slow"),
+                                                       Endpoint(self.__start_server(), "x", name="fast")], EndpointPool.LOWEST_LATENCY)
+        used: List[str] = [ self.__send(endpoint_pool).name for _ in range(6) ]
+        # Endpoints are measured once each, then the fastest one takes the sequential requests
+        self.assertEqual(sorted(used[:2]), ["fast", "slow"])
+        self.assertEqual(used[2:], ["fast"] * 4)
+        self.assertLess(endpoint_pool.endpoints[1].ewma_latency, endpoint_pool.endpoints[0].ewma_latency)
+
+    def test_failing_endpoint_is_taken_out_of_rotation_then_put_back(self):
+        endpoint_pool: EndpointPool = self.__get_pool([Endpoint(self.__start_server(server_error_ratio=1.0), "x", name="failing"),
+                                                       Endpoint(self.__start_server(), "x", name="healthy")])
+        failing, healthy = endpoint_pool.endpoints
+        # After a failure, the endpoint is avoided while another one answers
+        self.assertEqual([ self.__send(endpoint_pool).name for _ in range(3) ], ["failing", "healthy", "healthy"])
+        self.assertTrue(failing.healthy)
+        # Once it fails failure_threshold times in a row, it is not used any more, even when it is the only one left
+        self.assertIs(self.__send(endpoint_pool, healthy), failing)
+        self.assertFalse(failing.healthy)
+        acquired: List[Endpoint] = [ endpoint_pool.acquire(healthy) for _ in range(3) ]
+        self.assertEqual([ endpoint.name for endpoint in acquired ], ["healthy"] * 3)
+        for endpoint in acquired:
+            endpoint_pool.release(endpoint)
+        # The health check only lists the models: the failing endpoint answers it and is put back
+        deadline: float = time.monotonic() + self.HEALTH_CHECK_INTERVAL * 4
+        while not failing.healthy and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(failing.healthy)
+        self.assertEqual(failing.consecutive_failures, 0)
+
+    def test_async_acquire_is_woken_up_by_a_release(self):
+        endpoint_pool: EndpointPool = self.__get_pool([Endpoint(self.__start_server(), "x", max_concurrency=1)])
+        endpoint: Endpoint = endpoint_pool.acquire()
+        threading.Timer(0.1, endpoint_pool.release, [endpoint]).start()
+
+        async def acquire() -> float:
+            start_time: float = time.monotonic()
+            await endpoint_pool.acquire_async()
+            return time.monotonic() - start_time
+
+        waiting_time: float = asyncio.run(acquire())
+        self.assertGreaterEqual(waiting_time, 0.09)
+        # Well before the one second safety timeout of the wait
+        self.assertLess(waiting_time, 0.5)
+        self.assertEqual(endpoint_pool.async_waiters, [])
+
+if __name__ == '__main__':
+    unittest.main()
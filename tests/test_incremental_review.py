@@ -0,0 +1,83 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+import tempfile
+import logging
+import os
+from typing import List
+from pptx import Presentation
+from pptx.util import Inches
+from domain.llm_utils import LLMUtils
+from domain.allm_access import AbstractLLMAccess
+from infrastructure.content_out import ContentOut
+from infrastructure.review_manifest import ReviewManifest
+from infrastructure.powerpoint2datastructure import PowerPointToDataStructure
+
+class CountingLLMAccess(AbstractLLMAccess):
+    def __init__(self, logger: logging.Logger, llm_utils: LLMUtils):
+        super().__init__(logger, "a reviewer", "a model", llm_utils)
+        self.sent_contents: List = []
+
+    def _prepare_and_send_requests(self, request_inputs: List) -> List:
+        self.sent_contents.append(request_inputs[0]['slide_contents_str'])
+        return [ {'request_name': request_input['request_name'], 'response': f"Review of {request_input['slide_contents_str']}",
+                  'temperature': request_input['temperature'], 'top_p': request_input['top_p'], 'post_request_name': None} for request_input in request_inputs ]
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> str:
+        return ""
+
+class TestIncrementalReview(unittest.TestCase):
+    SLIDE_TEXTS: List = ["Quarterly results exceed the forecast", "Revenue grew by twelve percent", "Next steps: consolidate suppliers"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.llm_utils: LLMUtils = LLMUtils([], "", "", "", "", "")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __write_deck(self, file_name: str, slide_texts: List) -> str:
+        presentation = Presentation()
+        for slide_text in slide_texts:
+            slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+            slide.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(1)).text_frame.text = slide_text
+        deck_path: str = os.path.join(self.directory.name, file_name)
+        presentation.save(deck_path)
+        return deck_path
+
+    def __review(self, deck_path: str) -> CountingLLMAccess:
+        llm_access: CountingLLMAccess = CountingLLMAccess(self.logger, self.llm_utils)
+        to_document: str = os.path.join(self.directory.name, "review.md")
+        content_out: ContentOut = ContentOut("Review", "Test review", to_document, self.logger, False)
+        document_to_llm: PowerPointToDataStructure = PowerPointToDataStructure(deck_path, [], [], self.logger, content_out, self.llm_utils, [0], [], [], llm_access)
+        document_to_llm.flush_on_exception = False
+        document_to_llm.set_manifest(ReviewManifest(os.path.join(self.directory.name, "review.manifest.json"), "configuration", self.logger))
+        document_to_llm.process()
+        self.sections: List = document_to_llm.get_sections()
+        return llm_access
+
+    def __check_inserted_slide_only_is_sent(self):
+        self.assertEqual(len(self.__review(self.__write_deck("v1.pptx", self.SLIDE_TEXTS)).sent_contents), len(self.SLIDE_TEXTS))
+        llm_access: CountingLLMAccess = self.__review(self.__write_deck("v2.pptx", ["Agenda of the meeting"] + self.SLIDE_TEXTS))
+        self.assertEqual(len(llm_access.sent_contents), 1)
+        self.assertIn("Agenda of the meeting", llm_access.sent_contents[0])
+        self.assertEqual([ status for _, status in self.sections ], [PowerPointToDataStructure.SECTION_FRESH] + [PowerPointToDataStructure.SECTION_REUSED] * len(self.SLIDE_TEXTS))
+
+    def test_slide_inserted_at_the_front_reuses_the_other_slides(self):
+        self.llm_utils.set_compact_serialization(False)
+        self.__check_inserted_slide_only_is_sent()
+
+    def test_slide_inserted_at_the_front_reuses_the_other_slides_compact(self):
+        self.llm_utils.set_compact_serialization(True)
+        self.__check_inserted_slide_only_is_sent()
+
+    def test_changed_slide_is_sent_again(self):
+        self.__review(self.__write_deck("v1.pptx", self.SLIDE_TEXTS))
+        llm_access: CountingLLMAccess = self.__review(self.__write_deck("v2.pptx", self.SLIDE_TEXTS[:2] + ["Next steps: hire two account managers"]))
+        self.assertEqual(len(llm_access.sent_contents), 1)
+        self.assertIn("hire two account managers", llm_access.sent_contents[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+import time
+import httpx
+from openai import APIConnectionError, APITimeoutError, APIStatusError, RateLimitError, InternalServerError, AuthenticationError, BadRequestError
+from infrastructure.retry_policy import RetryPolicy, CircuitBreaker, CircuitOpenError
+
+class TestRetryPolicy(unittest.TestCase):
+    REQUEST: httpx.Request = httpx.Request("POST", "http://127.0.0.1/v1/chat/completions")
+
+    def setUp(self):
+        self.retry_policy: RetryPolicy = RetryPolicy(base_delay=1.0, max_delay=60.0)
+
+    def __status_error(self, error_class: type, status_code: int, message: str = "error") -> APIStatusError:
+        return error_class(message, response=httpx.Response(status_code, request=self.REQUEST), body=None)
+
+    def test_transient_errors_are_retried(self):
+        for err in [APIConnectionError(request=self.REQUEST), APITimeoutError(request=self.REQUEST), httpx.ReadTimeout("read timeout"),
+                    self.__status_error(RateLimitError, 429), self.__status_error(InternalServerError, 500),
+                    self.__status_error(APIStatusError, 503), self.__status_error(APIStatusError, 408), self.__status_error(APIStatusError, 409)]:
+            self.assertEqual(self.retry_policy.classify(err), RetryPolicy.RETRYABLE, repr(err))
+
+    def test_other_errors_are_fatal(self):
+        for err in [self.__status_error(AuthenticationError, 401), self.__status_error(BadRequestError, 400), self.__status_error(APIStatusError, 404),
+                    KeyError("response"), TypeError("unsupported operand"), ValueError("invalid literal")]:
+            self.assertEqual(self.retry_policy.classify(err), RetryPolicy.FATAL, repr(err))
+
+    def test_context_overflow(self):
+        err: APIStatusError = self.__status_error(BadRequestError, 400, "This model's maximum context length is 8192 tokens")
+        self.assertEqual(self.retry_policy.classify(err), RetryPolicy.CONTEXT_OVERFLOW)
+
+    def test_open_circuit_is_retried_after_the_remaining_open_time(self):
+        err: CircuitOpenError = CircuitOpenError("Circuit open", 30.0)
+        self.assertEqual(self.retry_policy.classify(err), RetryPolicy.RETRYABLE)
+        self.assertGreaterEqual(self.retry_policy.next_delay(1.0, err.retry_after), 30.0)
+
+    def test_backoff_bounds(self):
+        for previous_delay in [0.0, 1.0, 5.0, 30.0, 100.0]:
+            for _ in range(50):
+                delay: float = self.retry_policy.next_delay(previous_delay)
+                self.assertGreaterEqual(delay, self.retry_policy.base_delay)
+                self.assertLessEqual(delay, min(self.retry_policy.max_delay, max(previous_delay, self.retry_policy.base_delay) * 3))
+
+    def test_backoff_honors_retry_after(self):
+        self.assertEqual(self.retry_policy.next_delay(1.0, 120.0), 120.0)
+
+    def test_exhausted(self):
+        retry_policy: RetryPolicy = RetryPolicy(max_attempts=3)
+        self.assertFalse(retry_policy.is_exhausted(2))
+        self.assertTrue(retry_policy.is_exhausted(3))
+
+class TestCircuitBreaker(unittest.TestCase):
+    RESET_TIMEOUT: float = 0.05
+
+    def setUp(self):
+        self.circuit_breaker: CircuitBreaker = CircuitBreaker(2, self.RESET_TIMEOUT)
+
+    def __open(self) -> None:
+        self.circuit_breaker.before_call()
+        self.assertFalse(self.circuit_breaker.record_failure())
+        self.assertTrue(self.circuit_breaker.record_failure())
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+
+    def __count_calls_let_through(self, number_calls: int) -> int:
+        calls_let_through: int = 0
+        for _ in range(number_calls):
+            try:
+                self.circuit_breaker.before_call()
+                calls_let_through += 1
+            except CircuitOpenError:
+                pass
+        return calls_let_through
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        self.__open()
+        with self.assertRaises(CircuitOpenError) as context:
+            self.circuit_breaker.before_call()
+        self.assertGreater(context.exception.retry_after, 0)
+        self.assertLessEqual(context.exception.retry_after, self.RESET_TIMEOUT)
+
+    def test_success_resets_the_failure_count(self):
+        self.circuit_breaker.record_failure()
+        self.circuit_breaker.record_success()
+        self.assertFalse(self.circuit_breaker.record_failure())
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_lets_a_single_trial_call_through(self):
+        self.__open()
+        time.sleep(self.RESET_TIMEOUT * 1.5)
+        self.assertEqual(self.__count_calls_let_through(8), 1)
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_successful_trial_call_closes(self):
+        self.__open()
+        time.sleep(self.RESET_TIMEOUT * 1.5)
+        self.circuit_breaker.before_call()
+        self.circuit_breaker.record_success()
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.__count_calls_let_through(8), 8)
+
+    def test_failed_trial_call_opens_again(self):
+        self.__open()
+        time.sleep(self.RESET_TIMEOUT * 1.5)
+        self.circuit_breaker.before_call()
+        self.assertTrue(self.circuit_breaker.record_failure())
+        self.assertEqual(self.circuit_breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.__count_calls_let_through(8), 0)
+
+    def test_released_trial_call_lets_the_next_one_through(self):
+        self.__open()
+        time.sleep(self.RESET_TIMEOUT * 1.5)
+        self.circuit_breaker.before_call()
+        self.circuit_breaker.release_probe()
+        self.assertEqual(self.__count_calls_let_through(8), 1)
+
+if __name__ == '__main__':
+    unittest.main()
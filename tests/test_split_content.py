@@ -0,0 +1,123 @@
+"""
+@author Jean-Philippe Ulpiano
+"""
+import unittest
+import tempfile
+import logging
+import os
+from typing import List, Dict, Tuple
+from domain.llm_utils import LLMUtils
+from domain.ichecker import WordChecker
+from domain.allm_access import AbstractLLMAccess
+from domain.adocument2datastructure import ADocumentToDatastructure
+from infrastructure.content_out import ContentOut
+
+class RecordingLLMAccess(AbstractLLMAccess):
+    def __init__(self, logger: logging.Logger, llm_utils: LLMUtils):
+        super().__init__(logger, "a reviewer", "a model", llm_utils)
+        self.sent_contents: List = []
+
+    def _prepare_and_send_requests(self, request_inputs: List) -> List:
+        self.sent_contents.append(request_inputs[0]['slide_contents_str'])
+        return [ {'request_name': request_input['request_name'], 'response': "Reviewed", 'temperature': request_input['temperature'],
+                  'top_p': request_input['top_p'], 'post_request_name': None} for request_input in request_inputs ]
+
+    def _send_request_plain(self, messages: List, request_name: str, temperature: float, top_p: float, post_request_name: str, model_name: str = None, max_tokens: int = None) -> str:
+        return ""
+
+class ChaptersToDataStructure(ADocumentToDatastructure):
+    def __init__(self, logger: logging.Logger, content_out: ContentOut, llm_access: AbstractLLMAccess, llm_utils: LLMUtils, chapters: List):
+        super().__init__(logger, content_out, llm_access, llm_utils)
+        self.chapters = chapters
+
+    def _document_to_data_structure(self) -> List:
+        return self.chapters
+
+    def _get_title_rank_title_str_as_tuple(self, data: any) -> Tuple:
+        return (1, f"Check of content for chapter {self.chapters.index(data) + 1}")
+
+    def _get_checker_instance(self, data: any) -> any:
+        return WordChecker(self.llm_utils, [0, 1], f" (Chapter {self.chapters.index(data) + 1})", "")
+
+    def _get_llm_parameters_requests_as_tuple(self, data: any) -> Tuple:
+        return (data, True, "")
+
+    def _get_done_text(self, data: any) -> str:
+        return None
+
+class TestSplitContent(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger: logging.Logger = logging.getLogger(__name__)
+        self.llm_utils: LLMUtils = LLMUtils([], "", "", "", "", "")
+        self.llm_access: RecordingLLMAccess = RecordingLLMAccess(self.logger, self.llm_utils)
+        self.to_document: str = os.path.join(self.directory.name, "review.md")
+        self.content_out: ContentOut = ContentOut("Review", "Test review", self.to_document, self.logger, False)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def __get_document(self, chapters: List = []) -> ChaptersToDataStructure:
+        document: ChaptersToDataStructure = ChaptersToDataStructure(self.logger, self.content_out, self.llm_access, self.llm_utils, chapters)
+        document.flush_on_exception = False
+        return document
+
+    def test_split_at_headings_first(self):
+        content: str = "# Introduction\nFirst line\n\nSecond paragraph\n# Conclusion\nLast line\n"
+        self.assertEqual(self.__get_document()._split_content(content), ["# Introduction\nFirst line\n\nSecond paragraph\n", "# Conclusion\nLast line\n"])
+
+    def test_split_at_paragraphs_without_headings(self):
+        content: str = "First paragraph of the text\n\nSecond paragraph of the text\n\nThird paragraph of the text"
+        parts: List = self.__get_document()._split_content(content)
+        self.assertEqual(len(parts), 2)
+        self.assertEqual("".join(parts), content)
+        self.assertTrue(parts[0].endswith("\n\n"))
+
+    def test_split_at_lines_without_paragraphs(self):
+        content: str = "First line of the text\nSecond line of the text\nThird line of the text\nFourth line of the text"
+        parts: List = self.__get_document()._split_content(content)
+        self.assertEqual(parts, ["First line of the text\nSecond line of the text\n", "Third line of the text\nFourth line of the text"])
+
+    def test_single_line_cannot_be_split(self):
+        self.assertEqual(self.__get_document()._split_content("A single line without any boundary"), [])
+
+    def test_split_lists_between_elements(self):
+        document: ChaptersToDataStructure = self.__get_document()
+        self.assertEqual(document._split_content([{'text': "a" * 100}, {'text': "b" * 10}, {'text': "c" * 10}]),
+                         [[{'text': "a" * 100}], [{'text': "b" * 10}, {'text': "c" * 10}]])
+        self.assertEqual(document._split_content(["first slide", "second slide"]), [["first slide"], ["second slide"]])
+        self.assertEqual(document._split_content([{'text': "only shape"}]), [])
+
+    def test_stitch_responses_per_request(self):
+        part_results: List = [[{'request_name': "Spell check", 'response': "Part one"}, {'request_name': "Clarity", 'response': "Clear one"}],
+                              [{'request_name': "Spell check", 'response': "Part two"}, {'request_name': "Clarity", 'response': "Clear two", 'placeholder': True}]]
+        stitched: List = self.__get_document()._ADocumentToDatastructure__stitch_responses(part_results)
+        self.assertEqual([ response['request_name'] for response in stitched ], ["Spell check", "Clarity"])
+        self.assertEqual(stitched[0]['response'], "**Part 1 / 2**\n\nPart one\n\n**Part 2 / 2**\n\nPart two")
+        self.assertNotIn('placeholder', stitched[0])
+        self.assertTrue(stitched[1]['placeholder'])
+
+    def __set_context_window(self, content_tokens: int) -> None:
+        # Room for the prompt of the chapter requests plus content_tokens of content
+        self.llm_access.set_checker(WordChecker(self.llm_utils, [0, 1], "", ""))
+        self.llm_access.set_context_window(self.llm_access.get_prompt_tokens("", True) + content_tokens, 0)
+
+    def test_oversized_content_is_split_and_sent_in_parts(self):
+        self.__set_context_window(40)
+        chapter: str = "\n\n".join([ f"Paragraph {index} of the chapter with some words" for index in range(6) ])
+        self.assertTrue(self.__get_document([chapter]).process())
+        self.assertGreater(len(self.llm_access.sent_contents), 1)
+        self.assertEqual("".join(self.llm_access.sent_contents).count("of the chapter"), 6)
+
+    def test_content_that_cannot_be_split_does_not_stop_the_review(self):
+        self.__set_context_window(40)
+        self.assertTrue(self.__get_document(["word " * 200, "A short chapter"]).process())
+        self.assertEqual(len(self.llm_access.sent_contents), 1)
+        self.assertIn("A short chapter", self.llm_access.sent_contents[0])
+        with open(self.to_document, encoding="utf-8") as review_file:
+            review: str = review_file.read()
+        self.assertIn("exceeds the context window and cannot be split any further", review)
+        self.assertEqual(review.count("Not reviewed"), 2)
+
+if __name__ == '__main__':
+    unittest.main()